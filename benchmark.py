@@ -0,0 +1,481 @@
+"""
+Mide la latencia de las operaciones de funcionalidades.txt contra la base de datos configurada y escribe
+los percentiles en JSON, para comparar versiones y detectar regresiones.
+
+Uso:
+    python generar_datos.py --escala 1m --vaciar
+    python benchmark.py --etiqueta 1m [--repeticiones 200] [--salida resultados.json]
+
+Las consultas se hacen sobre filas elegidas al azar. Las operaciones de escritura trabajan sobre libros,
+categorias, prestamos y estudiantes que crea el propio benchmark y que borra al final; la promocion de
+un curso completo se deshace despues de cada medida. Aun asi, conviene usar una base de datos de pruebas.
+
+consultar_libro y los nombres de categoria de buscar_libros se sirven de las caches de repositorio; para medir
+las consultas sin cache, ejecutar con BIBLIOTECA_CACHE_TAMANO=0.
+
+Con escrituras, se prueban tambien los prestamos concurrentes (--hilos): en cada ronda todos los hilos intentan
+prestar a la vez el mismo libro, y despues cada hilo presta libros distintos. El resultado ('concurrencia')
+indica cuantos prestamos se han efectuado y rechazado, cuantos libros han quedado con mas de un prestamo
+abierto (debe ser 0) y los prestamos por segundo de cada fase. Ademas, se comprueban los motivos de los
+prestamos en lote con elementos rechazados y repetidos ('lotes', con la lista de errores vacia si todo es
+correcto).
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import psycopg2
+
+import conexion
+import repositorio
+from generar_datos import PALABRAS
+
+
+TABLAS = ("categoria", "estudiante", "libro", "preciolibro", "prestamo")
+
+
+def muestra_ids(conn, tabla, cantidad):
+    """
+    Devuelve hasta cantidad ids al azar de una tabla. En tablas grandes se lee solo una muestra de
+    las paginas (TABLESAMPLE) en lugar de recorrer toda la tabla.
+    :param conn: La conexion con la base de datos
+    :param tabla: El nombre de la tabla
+    :param cantidad: El numero de ids
+    :return: La lista de ids
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT greatest(reltuples, 0) FROM pg_class WHERE oid = CAST(%s AS REGCLASS)", (tabla,))
+        filas = cur.fetchone()[0]
+        porcentaje = min(100.0, 100.0 * cantidad * 10 / filas) if filas > 0 else 100.0
+        cur.execute(f"SELECT id FROM {tabla} TABLESAMPLE SYSTEM (%s) ORDER BY random() LIMIT %s", (porcentaje, cantidad))
+        ids = [fila[0] for fila in cur]
+        if len(ids) < cantidad:
+            cur.execute(f"SELECT id FROM {tabla} ORDER BY random() LIMIT %s", (cantidad,))
+            ids = [fila[0] for fila in cur]
+    conn.rollback()
+    return ids
+
+
+def contar_filas(conn):
+    """
+    Numero aproximado de filas de cada tabla segun las estadisticas de PostgreSQL. En las tablas
+    particionadas se suman las de sus particiones, que son las que mantiene autovacuum.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                c.relname,
+                CAST(CASE
+                    WHEN c.relkind = 'p' THEN coalesce(sum(greatest(p.reltuples, 0)), 0)
+                    ELSE greatest(c.reltuples, 0)
+                END AS BIGINT)
+            FROM
+                pg_class c
+            LEFT JOIN
+                pg_inherits i ON i.inhparent = c.oid
+            LEFT JOIN
+                pg_class p ON p.oid = i.inhrelid
+            WHERE
+                c.relname = ANY(%s)
+                AND c.relkind IN ('r', 'p')
+            GROUP BY
+                c.relname, c.relkind, c.reltuples
+        """, (list(TABLAS),))
+        filas = dict(cur.fetchall())
+    conn.rollback()
+    return filas
+
+
+class Medidor:
+    """Guarda los tiempos y errores de cada operacion."""
+
+    def __init__(self, calentamiento):
+        self.calentamiento = calentamiento
+        self.tiempos = {}
+        self.errores = {}
+        self._vistas = {}
+        self._cerrojo = threading.Lock()
+
+    def medir(self, nombre, operacion, *args):
+        """
+        Ejecuta y mide una operacion. Las primeras 'calentamiento' ejecuciones de cada operacion no se cuentan.
+        :return: Lo que devuelva la operacion, o None si falla
+        """
+        inicio = time.perf_counter()
+        try:
+            resultado = operacion(*args)
+        except repositorio.ErrorBiblioteca as e:
+            with self._cerrojo:
+                self.errores.setdefault(nombre, []).append(str(e))
+            return None
+        duracion = time.perf_counter() - inicio
+
+        with self._cerrojo:
+            vistas = self._vistas[nombre] = self._vistas.get(nombre, 0) + 1
+            if vistas > self.calentamiento:
+                self.tiempos.setdefault(nombre, []).append(duracion)
+        return resultado
+
+    def resumen(self):
+        """
+        Percentiles en milisegundos de cada operacion.
+        """
+        resumen = {}
+        for nombre in sorted(set(self.tiempos) | set(self.errores)):
+            tiempos = [t * 1000 for t in self.tiempos.get(nombre, [])]
+            errores = self.errores.get(nombre, [])
+            datos = {'n': len(tiempos), 'errores': len(errores)}
+            if errores:
+                datos['primer_error'] = errores[0]
+            if len(tiempos) >= 2:
+                percentiles = statistics.quantiles(tiempos, n=100, method='inclusive')
+                datos.update({
+                    'media_ms': round(statistics.fmean(tiempos), 3),
+                    'p50_ms': round(percentiles[49], 3),
+                    'p95_ms': round(percentiles[94], 3),
+                    'p99_ms': round(percentiles[98], 3),
+                    'max_ms': round(max(tiempos), 3),
+                })
+            resumen[nombre] = datos
+        return resumen
+
+
+def medir_consultas(conn, medidor, repeticiones, rng):
+    """
+    Mide las operaciones de lectura sobre filas existentes elegidas al azar.
+    """
+    libros = muestra_ids(conn, "libro", repeticiones)
+    estudiantes = muestra_ids(conn, "estudiante", repeticiones)
+    prestamos = muestra_ids(conn, "prestamo", repeticiones)
+    pagina = 20
+
+    for i in range(repeticiones):
+        palabra = rng.choice(PALABRAS)
+        for modo in repositorio.MODOS_BUSQUEDA:
+            texto = palabra[:3] if modo == 'p' else palabra
+            medidor.medir(f"buscar_libros[{modo}]", repositorio.buscar_libros, conn,
+                          repositorio.FiltrosLibro(modo=modo, titulo=texto), pagina)
+
+        if libros:
+            id_libro = libros[i % len(libros)]
+            medidor.medir("consultar_libro", repositorio.consultar_libro, conn, id_libro)
+            medidor.medir("historial_precios", repositorio.historial_precios, conn, id_libro, pagina)
+            medidor.medir("historial_prestamos_libro", repositorio.historial_prestamos_libro, conn, id_libro, pagina)
+        if estudiantes:
+            id_estudiante = estudiantes[i % len(estudiantes)]
+            medidor.medir("consultar_estudiante", repositorio.consultar_estudiante, conn, id_estudiante)
+            medidor.medir("historial_prestamos_estudiante", repositorio.historial_prestamos_estudiante, conn,
+                          id_estudiante, pagina)
+        if prestamos:
+            medidor.medir("consultar_prestamo", repositorio.consultar_prestamo, conn, prestamos[i % len(prestamos)])
+
+
+def medir_escrituras(conn, medidor, repeticiones, rng):
+    """
+    Mide las operaciones de escritura sobre filas creadas para la medida, y las borra al terminar.
+    """
+    marca = uuid.uuid4().hex[:8]
+    libros, categorias, estudiantes, prestamos = [], [], [], []
+
+    for i in range(repeticiones):
+        id_libro = medidor.medir("anadir_libro", repositorio.anadir_libro, conn, repositorio.LibroNuevo(
+            titulo=f"Benchmark {rng.choice(PALABRAS)} {i}", autor="Benchmark", aniopublicacion=2000,
+            isbn=f"B{marca}{i:08d}", sinopsis="Libro creado por benchmark.py"))
+        if id_libro is not None:
+            libros.append(id_libro)
+
+        id_categoria = medidor.medir("anadir_categoria", repositorio.anadir_categoria, conn,
+                                     f"Benchmark {marca} {i}", "Categoria creada por benchmark.py")
+        if id_categoria is not None:
+            categorias.append(id_categoria)
+
+        id_estudiante = medidor.medir("anadir_estudiante", repositorio.anadir_estudiante, conn,
+                                      repositorio.EstudianteNuevo(nombre="Benchmark", apellidos=marca, curso=1,
+                                                                  email=f"benchmark{i}.{marca}@biblioteca.test"))
+        if id_estudiante is not None:
+            estudiantes.append(id_estudiante)
+
+    for id_libro in libros:
+        medidor.medir("modificar_libro", repositorio.modificar_libro, conn, id_libro,
+                      {'titulo': f"Benchmark {rng.choice(PALABRAS)}", 'precio': round(rng.uniform(5, 60), 2)})
+        medidor.medir("actualizar_precio[manual]", repositorio.actualizar_precio, conn, id_libro,
+                      round(rng.uniform(5, 60), 2))
+        medidor.medir("actualizar_precio[porcentaje]", repositorio.actualizar_precio, conn, id_libro, None,
+                      rng.uniform(-20, 20))
+    for id_categoria in categorias:
+        medidor.medir("modificar_categoria", repositorio.modificar_categoria, conn, id_categoria,
+                      {'descripcion': f"Categoria de {rng.choice(PALABRAS)}"})
+    for id_estudiante in estudiantes:
+        medidor.medir("modificar_estudiante", repositorio.modificar_estudiante, conn, id_estudiante,
+                      {'nombre': rng.choice(PALABRAS).capitalize()})
+
+    for id_libro, id_estudiante in zip(libros, estudiantes):
+        id_prestamo = medidor.medir("efectuar_prestamo", repositorio.efectuar_prestamo, conn, id_libro,
+                                    id_estudiante, "Prestamo de benchmark.py")
+        if id_prestamo is not None:
+            prestamos.append(id_prestamo)
+    for id_prestamo in prestamos:
+        medidor.medir("finalizar_prestamo", repositorio.finalizar_prestamo, conn, id_prestamo)
+    for id_prestamo in prestamos:
+        medidor.medir("eliminar_prestamo", repositorio.eliminar_prestamo, conn, id_prestamo)
+
+    # Se promociona un curso completo y se deshace sin medir, para no cambiar los datos
+    for _ in range(min(repeticiones, 20)):
+        curso = rng.randint(1, 6)
+        promocionados = medidor.medir("aumentar_curso_completo", repositorio.aumentar_curso_completo, conn, curso)
+        if promocionados:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE estudiante SET curso = curso - 1 WHERE id = ANY(%s)", (promocionados,))
+            conn.commit()
+
+    for id_libro in libros:
+        medidor.medir("eliminar_libro", repositorio.eliminar_libro, conn, id_libro)
+    for id_categoria in categorias:
+        medidor.medir("eliminar_categoria", repositorio.eliminar_categoria, conn, id_categoria)
+    for id_estudiante in estudiantes:
+        medidor.medir("eliminar_estudiante", repositorio.eliminar_estudiante, conn, id_estudiante)
+
+
+# Libros con mas de un prestamo abierto, y libros y estudiantes cuyos datos derivados no coinciden con
+# los prestamos abiertos, entre los indicados
+SQL_COMPROBAR_PRESTAMOS = """
+    SELECT
+        (SELECT count(*) FROM (
+            SELECT idlibro
+            FROM prestamo
+            WHERE idlibro = ANY(%(libros)s)
+            AND fechadevolucion IS NULL
+            GROUP BY idlibro
+            HAVING count(*) > 1
+        ) d) AS prestamos_dobles,
+        (SELECT count(*)
+            FROM libro l
+            WHERE l.id = ANY(%(libros)s)
+            AND l.prestado <> EXISTS (
+                SELECT 1 FROM prestamo p WHERE p.idlibro = l.id AND p.fechadevolucion IS NULL)
+        ) + (SELECT count(*)
+            FROM estudiante e
+            WHERE e.id = ANY(%(estudiantes)s)
+            AND e.librosenposesion <> (
+                SELECT count(*) FROM prestamo p WHERE p.idestudiante = e.id AND p.fechadevolucion IS NULL)
+        ) AS incoherencias
+"""
+
+
+def medir_prestamos_concurrentes(pool, medidor, hilos, rondas):
+    """
+    Prueba efectuar_prestamo desde varios hilos a la vez, con un libro por ronda que todos intentan prestar
+    (solo uno debe conseguirlo) y con libros distintos para cada hilo. Trabaja sobre libros y estudiantes
+    creados para la prueba, y los borra al terminar.
+    :param pool: Pool con al menos 'hilos' conexiones
+    :param hilos: Numero de hilos
+    :param rondas: Numero de libros disputados (y de libros libres por hilo)
+    :return: Diccionario con el resultado de la prueba
+    """
+    marca = uuid.uuid4().hex[:8]
+    with pool.conexion() as conn:
+        disputados = [repositorio.anadir_libro(conn, repositorio.LibroNuevo(titulo=f"Benchmark disputado {i}",
+                                                                          isbn=f"D{marca}{i:08d}"))
+                      for i in range(rondas)]
+        libres = [[repositorio.anadir_libro(conn, repositorio.LibroNuevo(titulo=f"Benchmark libre {h}.{i}",
+                                                                       isbn=f"L{marca}{h:03d}{i:06d}"))
+                   for i in range(rondas)] for h in range(hilos)]
+        estudiantes = [repositorio.anadir_estudiante(conn, repositorio.EstudianteNuevo(
+            nombre="Benchmark", apellidos=marca, curso=1, email=f"concurrencia{h}.{marca}@biblioteca.test"))
+            for h in range(hilos)]
+
+    barrera = threading.Barrier(hilos)
+    efectuados, rechazados, otros_errores = [0], [0], []
+    cerrojo = threading.Lock()
+    duraciones = {}
+    fallos = []
+
+    def trabajar(h):
+        try:
+            with pool.conexion() as conn:
+                inicio = time.perf_counter()
+                for id_libro in disputados:
+                    barrera.wait()
+                    try:
+                        repositorio.efectuar_prestamo(conn, id_libro, estudiantes[h], "Prestamo concurrente")
+                        resultado = efectuados
+                    except repositorio.Duplicado:
+                        resultado = rechazados
+                    except repositorio.ErrorBiblioteca as e:
+                        with cerrojo:
+                            otros_errores.append(str(e))
+                        continue
+                    with cerrojo:
+                        resultado[0] += 1
+                barrera.wait()
+                mitad = time.perf_counter()
+                for id_libro in libres[h]:
+                    medidor.medir("efectuar_prestamo[concurrente]", repositorio.efectuar_prestamo, conn, id_libro,
+                                  estudiantes[h], "Prestamo concurrente")
+                with cerrojo:
+                    duraciones[h] = (mitad - inicio, time.perf_counter() - mitad)
+        except BaseException as e:
+            # Sin este hilo, los demas esperarian para siempre en la barrera
+            with cerrojo:
+                fallos.append(e)
+            barrera.abort()
+            raise
+
+    todos = disputados + [id_libro for libros in libres for id_libro in libros]
+    try:
+        trabajadores = [threading.Thread(target=trabajar, args=(h,)) for h in range(hilos)]
+        for trabajador in trabajadores:
+            trabajador.start()
+        for trabajador in trabajadores:
+            trabajador.join()
+
+        with pool.conexion() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SQL_COMPROBAR_PRESTAMOS, {'libros': todos, 'estudiantes': estudiantes})
+                prestamos_dobles, incoherencias = cur.fetchone()
+    finally:
+        with pool.conexion() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM prestamo WHERE idlibro = ANY(%s)", (todos,))
+            conn.commit()
+            for id_libro in todos:
+                repositorio.eliminar_libro(conn, id_libro)
+            for id_estudiante in estudiantes:
+                repositorio.eliminar_estudiante(conn, id_estudiante)
+
+    if fallos:
+        # El primer fallo es el que ha roto la barrera; los demas hilos fallan por eso
+        raise RuntimeError("La prueba de prestamos concurrentes ha fallado") from fallos[0]
+
+    segundos_disputados = max(d[0] for d in duraciones.values())
+    segundos_libres = max(d[1] for d in duraciones.values())
+    return {
+        'hilos': hilos,
+        'rondas': rondas,
+        'efectuados_disputados': efectuados[0],
+        'rechazados_disputados': rechazados[0],
+        'otros_errores': len(otros_errores),
+        'prestamos_dobles': prestamos_dobles,
+        'incoherencias': incoherencias,
+        'intentos_por_segundo_disputados': round(hilos * rondas / segundos_disputados, 1),
+        'prestamos_por_segundo_libres': round(hilos * rondas / segundos_libres, 1),
+    }
+
+
+def comprobar_prestamos_lote(conn):
+    """
+    Comprueba los motivos de efectuar_prestamos con lotes que mezclan elementos rechazados y repetidos: un
+    elemento rechazado no debe impedir prestar un elemento posterior del mismo libro. Trabaja sobre libros y
+    un estudiante creados para la prueba, y los borra al terminar.
+    :return: Diccionario con los lotes probados y los elementos cuyo resultado no es el esperado
+    """
+    marca = uuid.uuid4().hex[:8]
+    libros = [repositorio.anadir_libro(conn, repositorio.LibroNuevo(titulo=f"Benchmark lote {i}",
+                                                                  isbn=f"T{marca}{i:08d}"))
+              for i in range(2)]
+    id_estudiante = repositorio.anadir_estudiante(conn, repositorio.EstudianteNuevo(
+        nombre="Benchmark", apellidos=marca, curso=1, email=f"lote.{marca}@biblioteca.test"))
+    inexistente = -1
+
+    # Cada lote con el motivo esperado de cada elemento (None si se presta)
+    casos = [
+        ([(libros[0], inexistente), (libros[0], id_estudiante)],
+         ["El estudiante no existe.", None]),
+        ([(libros[1], id_estudiante), (libros[1], id_estudiante), (libros[0], id_estudiante)],
+         [None, "El libro esta repetido en el lote.", "El libro ya esta prestado."]),
+    ]
+    errores = []
+    for lote, esperados in casos:
+        resultados = repositorio.efectuar_prestamos(conn, lote, "Prestamo en lote de benchmark.py")
+        for resultado, esperado in zip(resultados, esperados):
+            if resultado.motivo != esperado or (resultado.idprestamo is None) != (esperado is not None):
+                errores.append(f"{lote} [{resultado.posicion}]: {resultado.motivo!r}, se esperaba {esperado!r}")
+
+    with conn.cursor() as cur:
+        cur.execute(SQL_COMPROBAR_PRESTAMOS, {'libros': libros, 'estudiantes': [id_estudiante]})
+        prestamos_dobles, incoherencias = cur.fetchone()
+        cur.execute("DELETE FROM prestamo WHERE idlibro = ANY(%s)", (libros,))
+    conn.commit()
+    for id_libro in libros:
+        repositorio.eliminar_libro(conn, id_libro)
+    repositorio.eliminar_estudiante(conn, id_estudiante)
+
+    return {
+        'lotes': len(casos),
+        'errores': errores,
+        'prestamos_dobles': prestamos_dobles,
+        'incoherencias': incoherencias,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide la latencia de las operaciones de la biblioteca.")
+    parser.add_argument("--etiqueta", default="", help="Nombre de la medida en el JSON (por ejemplo, la escala)")
+    parser.add_argument("--repeticiones", type=int, default=200, help="Ejecuciones medidas de cada operacion")
+    parser.add_argument("--calentamiento", type=int, default=5, help="Ejecuciones iniciales que no se cuentan")
+    parser.add_argument("--sin-escrituras", action="store_true", help="Mide solo las consultas")
+    parser.add_argument("--hilos", type=int, default=8,
+                        help="Hilos de la prueba de prestamos concurrentes (0 para no hacerla)")
+    parser.add_argument("--semilla", type=int, help="Semilla del generador aleatorio")
+    parser.add_argument("--salida", help="Fichero JSON de salida (por defecto, la salida estandar)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    try:
+        pool = conexion.PoolBiblioteca(minconn=1, maxconn=1)
+    except psycopg2.Error:
+        print("Error de conexion")
+        sys.exit(1)
+
+    medidor = Medidor(args.calentamiento)
+    repeticiones = args.repeticiones + args.calentamiento
+    lotes = None
+    try:
+        with pool.conexion() as conn:
+            filas = contar_filas(conn)
+            version = conn.server_version
+            medir_consultas(conn, medidor, repeticiones, rng)
+            if not args.sin_escrituras:
+                medir_escrituras(conn, medidor, repeticiones, rng)
+                lotes = comprobar_prestamos_lote(conn)
+    finally:
+        pool.closeall()
+
+    concurrencia = None
+    if not args.sin_escrituras and args.hilos > 0:
+        pool = conexion.PoolBiblioteca(minconn=args.hilos, maxconn=args.hilos)
+        try:
+            concurrencia = medir_prestamos_concurrentes(pool, medidor, args.hilos, min(args.repeticiones, 50))
+        finally:
+            pool.closeall()
+
+    resultado = {
+        'etiqueta': args.etiqueta,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'version_postgresql': version,
+        'repeticiones': args.repeticiones,
+        'filas': filas,
+        'operaciones': medidor.resumen(),
+        'transacciones': {nombre: vars(estadisticas)
+                          for nombre, estadisticas in repositorio.estadisticas_transacciones().items()},
+        'caches': {nombre: vars(estadisticas) for nombre, estadisticas in repositorio.estadisticas_caches().items()},
+        'concurrencia': concurrencia,
+        'lotes': lotes,
+    }
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as fichero:
+            fichero.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
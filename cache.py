@@ -0,0 +1,278 @@
+"""
+Caches en memoria del proceso (LRU con caducidad) e invalidacion entre procesos con LISTEN/NOTIFY.
+
+Cada cache se invalida de forma explicita desde las operaciones que modifican sus datos. Si varios procesos
+usan la misma base de datos, las invalidaciones se pueden enviar a los demas con NOTIFY en el canal
+CANAL_INVALIDACIONES, y cada proceso las recibe con EscuchaInvalidaciones.
+
+La configuracion se toma del entorno:
+    BIBLIOTECA_CACHE_TAMANO     Entradas como maximo de cada cache (por defecto 1000; 0 las desactiva)
+    BIBLIOTECA_CACHE_TTL        Segundos que dura cada entrada (por defecto 300)
+    BIBLIOTECA_CACHE_NOTIFY     Si es 1, las invalidaciones se envian con NOTIFY y se escuchan las de los
+                                demas procesos (por defecto 1). Con 0, un cambio hecho desde otro proceso
+                                no se ve en este hasta que caduca la entrada; solo conviene si un unico
+                                proceso usa la base de datos
+"""
+
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Hashable, Iterable
+
+import psycopg2
+import psycopg2.extensions
+
+
+TAMANO_CACHE = int(os.environ.get("BIBLIOTECA_CACHE_TAMANO", 1000))
+TTL_CACHE = float(os.environ.get("BIBLIOTECA_CACHE_TTL", 300))
+NOTIFY_CACHE = os.environ.get("BIBLIOTECA_CACHE_NOTIFY", "1") == "1"
+
+CANAL_INVALIDACIONES = "biblioteca_cache"
+
+_log = logging.getLogger("biblioteca.cache")
+
+# Mensaje de NOTIFY que invalida una cache completa
+TODAS = "*"
+
+SQL_NOTIFICAR = """
+    SELECT
+        pg_notify(%(c)s, %(m)s)
+"""
+
+
+@dataclass
+class EstadisticasCache:
+    """Aciertos, fallos, entradas invalidadas y entradas expulsadas por falta de espacio de una cache."""
+    aciertos: int = 0
+    fallos: int = 0
+    invalidaciones: int = 0
+    expulsiones: int = 0
+
+
+class CacheLRU:
+    """
+    Cache con un numero maximo de entradas, que expulsa las usadas hace mas tiempo, y caducidad de cada
+    entrada. La pueden usar varios hilos.
+
+    Un valor leido de la base de datos no se guarda si mientras se leia se ha invalidado cualquier entrada
+    de la cache: la invalidacion puede corresponder a un cambio confirmado despues de la lectura.
+    """
+
+    def __init__(self, nombre: str, tamano: int | None = None, ttl: float | None = None):
+        """
+        :param nombre: El nombre de la cache (en las estadisticas y en los mensajes de NOTIFY)
+        :param tamano: Numero maximo de entradas (0 desactiva la cache). Por defecto, BIBLIOTECA_CACHE_TAMANO
+        :param ttl: Segundos que dura cada entrada. Por defecto, BIBLIOTECA_CACHE_TTL
+        """
+        self.nombre = nombre
+        self.tamano = tamano if tamano is not None else TAMANO_CACHE
+        self.ttl = ttl if ttl is not None else TTL_CACHE
+        self._entradas = OrderedDict()
+        self._generacion = 0
+        self._estadisticas = EstadisticasCache()
+        self._cerrojo = threading.Lock()
+
+    def _buscar(self, clave):
+        """Devuelve (True, valor) si la clave esta en la cache y no ha caducado. Se llama con el cerrojo."""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return False, None
+        caducidad, valor = entrada
+        if caducidad <= time.monotonic():
+            del self._entradas[clave]
+            return False, None
+        self._entradas.move_to_end(clave)
+        return True, valor
+
+    def _guardar(self, clave, valor):
+        """Guarda una entrada y expulsa las mas antiguas si no caben. Se llama con el cerrojo."""
+        self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.tamano:
+            self._entradas.popitem(last=False)
+            self._estadisticas.expulsiones += 1
+
+    def consultar(self, claves: Iterable[Hashable]) -> tuple[dict, list, int]:
+        """
+        Busca varias claves en la cache y cuenta los aciertos y fallos. Para cargar valores sin bloquear
+        (por ejemplo, desde codigo asincrono), se leen de la base de datos las claves que faltan y se pasan a
+        guardar junto con la generacion devuelta.
+        :param claves: Las claves
+        :return: Los valores encontrados (por clave), las claves que faltan y la generacion de la cache
+        """
+        valores, faltan = {}, []
+        with self._cerrojo:
+            for clave in dict.fromkeys(claves):
+                encontrado, valor = self._buscar(clave)
+                if encontrado:
+                    valores[clave] = valor
+                else:
+                    faltan.append(clave)
+            self._estadisticas.aciertos += len(valores)
+            self._estadisticas.fallos += len(faltan)
+            return valores, faltan, self._generacion
+
+    def guardar(self, valores: dict, generacion: int) -> None:
+        """
+        Guarda valores leidos de la base de datos, salvo que se haya invalidado alguna entrada desde que se
+        obtuvo la generacion (con consultar).
+        :param valores: Los valores, por clave
+        :param generacion: La generacion devuelta por consultar antes de leer los valores
+        :return: None
+        """
+        with self._cerrojo:
+            if self.tamano > 0 and generacion == self._generacion:
+                for clave, valor in valores.items():
+                    self._guardar(clave, valor)
+
+    def obtener(self, clave: Hashable, cargar: Callable[[], Any]) -> Any:
+        """
+        Devuelve el valor de una clave, leyendolo con cargar() si no esta en la cache.
+        :param clave: La clave
+        :param cargar: Funcion que lee el valor de la base de datos. Si lanza una excepcion, no se guarda nada
+        :return: El valor
+        """
+        valores, faltan, generacion = self.consultar([clave])
+        if not faltan:
+            return valores[clave]
+        valor = cargar()
+        self.guardar({clave: valor}, generacion)
+        return valor
+
+    def obtener_varios(self, claves: Iterable[Hashable], cargar: Callable[[list], dict]) -> dict:
+        """
+        Devuelve los valores de varias claves, leyendo en una sola llamada a cargar las que no esten en la cache.
+        :param claves: Las claves
+        :param cargar: Funcion que recibe la lista de claves que faltan y devuelve un diccionario con sus
+                       valores. Las claves que no devuelva no aparecen en el resultado
+        :return: Diccionario con el valor de cada clave encontrada
+        """
+        valores, faltan, generacion = self.consultar(claves)
+        if faltan:
+            cargados = cargar(faltan)
+            self.guardar(cargados, generacion)
+            valores.update(cargados)
+        return valores
+
+    def invalidar(self, clave: Hashable | None = None) -> None:
+        """
+        Borra una entrada de la cache, o todas si no se indica clave.
+        :param clave: La clave a borrar
+        :return: None
+        """
+        with self._cerrojo:
+            self._generacion += 1
+            if clave is None:
+                self._estadisticas.invalidaciones += len(self._entradas)
+                self._entradas.clear()
+            elif self._entradas.pop(clave, None) is not None:
+                self._estadisticas.invalidaciones += 1
+
+    def estadisticas(self) -> EstadisticasCache:
+        """
+        Devuelve una copia de las estadisticas de la cache.
+        :return: Las estadisticas
+        """
+        with self._cerrojo:
+            return EstadisticasCache(**asdict(self._estadisticas))
+
+    def reiniciar_estadisticas(self) -> None:
+        """
+        Pone a cero las estadisticas de la cache.
+        :return: None
+        """
+        with self._cerrojo:
+            self._estadisticas = EstadisticasCache()
+
+
+# ------------------------------------------------------------
+# Invalidacion entre procesos
+
+def notificar(cur, nombre: str, clave: Hashable | None = None) -> None:
+    """
+    Envia a los demas procesos la invalidacion de una entrada (o de toda la cache, sin clave), si
+    BIBLIOTECA_CACHE_NOTIFY esta activado. PostgreSQL entrega el mensaje al confirmar la transaccion del
+    cursor, y no lo entrega si se deshace.
+    :param cur: Un cursor de la transaccion que modifica los datos
+    :param nombre: El nombre de la cache
+    :param clave: La clave a invalidar
+    :return: None
+    """
+    if NOTIFY_CACHE:
+        cur.execute(SQL_NOTIFICAR, {'c': CANAL_INVALIDACIONES, 'm': f"{nombre}:{TODAS if clave is None else clave}"})
+
+
+class EscuchaInvalidaciones(threading.Thread):
+    """
+    Hilo que escucha las invalidaciones enviadas con notificar y las aplica a las caches de este proceso.
+    Usa una conexion propia en modo autocommit. Si la conexion se pierde, vuelve a conectar, y cada vez que
+    empieza a escuchar vacia las caches: los mensajes enviados mientras no escuchaba se han perdido.
+    """
+
+    def __init__(self, dsn: str, caches: dict[str, CacheLRU], espera: float = 5.0):
+        """
+        :param dsn: El DSN de la base de datos
+        :param caches: Las caches, por nombre. Las claves enteras de los mensajes se convierten a int
+        :param espera: Segundos entre comprobaciones de parar() y entre intentos de reconexion
+        """
+        super().__init__(name="EscuchaInvalidaciones", daemon=True)
+        self.dsn = dsn
+        self.caches = caches
+        self.espera = espera
+        self._parar = threading.Event()
+
+    def parar(self) -> None:
+        """
+        Pide al hilo que termine; lo hace como mucho 'espera' segundos despues.
+        :return: None
+        """
+        self._parar.set()
+
+    def _aplicar(self, mensaje):
+        """Invalida la entrada de un mensaje 'cache:clave'. Los mensajes de caches desconocidas se ignoran."""
+        nombre, _, clave = mensaje.partition(":")
+        cache = self.caches.get(nombre)
+        if cache is None:
+            return
+        if clave == TODAS:
+            cache.invalidar()
+        else:
+            cache.invalidar(int(clave) if clave.lstrip("-").isdigit() else clave)
+
+    def run(self):
+        while not self._parar.is_set():
+            try:
+                conn = psycopg2.connect(self.dsn)
+            except psycopg2.Error:
+                self._parar.wait(self.espera)
+                continue
+
+            try:
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CANAL_INVALIDACIONES}")
+                # Las entradas leidas antes de escuchar pueden estar invalidadas por mensajes que no han llegado
+                for cache in self.caches.values():
+                    cache.invalidar()
+                while not self._parar.is_set():
+                    if select.select([conn], [], [], self.espera) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        try:
+                            self._aplicar(payload)
+                        except Exception:
+                            _log.exception("Mensaje de invalidacion no valido: %r", payload)
+            except psycopg2.Error:
+                pass
+            except Exception:
+                # El hilo no debe terminar: se vuelve a conectar, y al escuchar se vacian las caches
+                _log.exception("Error en la escucha de invalidaciones")
+                self._parar.wait(self.espera)
+            finally:
+                conn.close()
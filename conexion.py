@@ -0,0 +1,149 @@
+"""
+Pool de conexiones con la base de datos de la biblioteca.
+
+La configuracion se toma del entorno:
+    BIBLIOTECA_DSN          DSN de libpq (por defecto, la base de datos local 'biblioteca')
+    BIBLIOTECA_POOL_MIN     Conexiones que se abren al crear el pool (por defecto 1)
+    BIBLIOTECA_POOL_MAX     Conexiones abiertas como maximo (por defecto 10). Las conexiones que se abren
+                            al necesitarlas se quedan abiertas en el pool al devolverlas
+    BIBLIOTECA_POOL_PING    Segundos de inactividad a partir de los cuales se comprueba una
+                            conexion con SELECT 1 antes de prestarla (por defecto 30)
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+
+DSN_POR_DEFECTO = "host=localhost user=postgres password=1234 dbname=biblioteca"
+
+
+class PoolBiblioteca(psycopg2.pool.ThreadedConnectionPool):
+    """
+    Pool de conexiones que pueden compartir varios hilos (menu, procesos por lotes, servicio HTTP).
+    Cada operacion pide una conexion con conexion(nivel) y la devuelve al terminar. Si todas las conexiones
+    estan prestadas, la peticion espera a que se devuelva una en lugar de fallar. Las conexiones devueltas
+    siguen abiertas (hasta maxconn), con sus sentencias preparadas, para las peticiones siguientes.
+    """
+
+    def __init__(self, dsn=None, minconn=None, maxconn=None, segundos_ping=None):
+        """
+        Crea el pool y abre las conexiones minimas. Los parametros omitidos se toman del entorno.
+        :param dsn: El DSN de la base de datos
+        :param minconn: Numero de conexiones abiertas al crear el pool
+        :param maxconn: Numero maximo de conexiones abiertas
+        :param segundos_ping: Inactividad a partir de la cual se comprueba la conexion antes de prestarla
+        :raise psycopg2.Error: Si no se pueden abrir las conexiones iniciales
+        """
+        self.dsn = dsn if dsn is not None else os.environ.get("BIBLIOTECA_DSN", DSN_POR_DEFECTO)
+        minconn = minconn if minconn is not None else int(os.environ.get("BIBLIOTECA_POOL_MIN", 1))
+        maxconn = maxconn if maxconn is not None else int(os.environ.get("BIBLIOTECA_POOL_MAX", 10))
+        self.segundos_ping = segundos_ping if segundos_ping is not None else float(os.environ.get("BIBLIOTECA_POOL_PING", 30))
+
+        super().__init__(minconn, maxconn, self.dsn)
+
+        self._disponibles = threading.BoundedSemaphore(maxconn)
+        self._ultimo_uso = {}
+
+    def _putconn(self, conn, key=None, close=False):
+        """
+        Devuelve una conexion al pool (se llama con el cerrojo del pool). A diferencia de psycopg2, que cierra
+        las conexiones devueltas cuando ya hay minconn libres, solo se cierran las que se piden cerrar o que
+        estan cerradas o rotas, asi que las conexiones abiertas en momentos de carga se reutilizan.
+        :param conn: La conexion
+        :param key: La clave de la conexion en el pool (por defecto, la suya)
+        :param close: Si la conexion se debe cerrar en lugar de guardarla
+        """
+        if self.closed:
+            raise psycopg2.pool.PoolError("connection pool is closed")
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+
+        if not close and not conn.closed:
+            try:
+                estado = conn.info.transaction_status
+                if estado == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif estado != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed:
+            conn.close()
+            self._ultimo_uso.pop(id(conn), None)
+        else:
+            self._pool.append(conn)
+
+        del self._used[key]
+        del self._rused[id(conn)]
+
+    def _closeall(self):
+        """Cierra todas las conexiones del pool y olvida su ultimo uso."""
+        super()._closeall()
+        self._ultimo_uso.clear()
+
+    def _conexion_sana(self, conn):
+        """
+        Comprueba que una conexion del pool se puede usar. Solo hace una consulta de prueba si la conexion
+        lleva mas de segundos_ping sin usarse.
+        :param conn: La conexion a comprobar
+        :return: True si la conexion esta abierta y responde
+        """
+        if conn.closed:
+            return False
+
+        if time.monotonic() - self._ultimo_uso.get(id(conn), 0) < self.segundos_ping:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prestar(self):
+        """
+        Obtiene una conexion sana del pool, descartando las que se hayan cerrado o no respondan.
+        :return: La conexion
+        """
+        while True:
+            conn = self.getconn()
+            if self._conexion_sana(conn):
+                return conn
+            self.putconn(conn, close=True)
+
+    @contextmanager
+    def conexion(self, nivel=psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED):
+        """
+        Presta una conexion del pool con el nivel de aislamiento indicado durante un bloque with.
+        Al salir del bloque se deshace la transaccion que haya quedado abierta y la conexion vuelve al pool.
+        :param nivel: El nivel de aislamiento (psycopg2.extensions.ISOLATION_LEVEL_*)
+        :return: La conexion prestada
+        """
+        self._disponibles.acquire()
+        try:
+            conn = self._prestar()
+            try:
+                conn.isolation_level = nivel
+                yield conn
+            finally:
+                try:
+                    if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+
+                if not conn.closed:
+                    self._ultimo_uso[id(conn)] = time.monotonic()
+                self.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._disponibles.release()
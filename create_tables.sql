@@ -1,11 +1,17 @@
-DROP TABLE prestamo, libro, estudiante, categoria CASCADE;
+DROP TABLE IF EXISTS preciolibro, prestamo, libro, estudiante, categoria, marcainforme CASCADE;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 CREATE TABLE categoria (
     id BIGSERIAL,
     nombre VARCHAR(100) NOT NULL,
     descripcion VARCHAR(255) NOT NULL,
+    -- Dias de prestamo de los libros de la categoria (los libros sin categoria usan
+    -- repositorio.DIAS_PRESTAMO_POR_DEFECTO, el mismo valor)
+    diasprestamo SMALLINT NOT NULL DEFAULT 14,
     CONSTRAINT CategoriaPK PRIMARY KEY (id),
-    CONSTRAINT CategoriaNombreUQ UNIQUE (nombre)
+    CONSTRAINT CategoriaNombreUQ UNIQUE (nombre),
+    CONSTRAINT DiasPrestamoGTZ CHECK (diasprestamo > 0)
 );
 
 CREATE TABLE estudiante (
@@ -15,10 +21,14 @@ CREATE TABLE estudiante (
     curso SMALLINT NOT NULL,
     email VARCHAR(150) NOT NULL,
     telefono VARCHAR(20),
+    librosenposesion INTEGER NOT NULL DEFAULT 0,
+    -- Version de los datos, para el control de concurrencia optimista de modificar_estudiante
+    version INTEGER NOT NULL DEFAULT 1,
     CONSTRAINT EstudiantePK PRIMARY KEY (id),
     CONSTRAINT EstudianteEmailUQ UNIQUE (email),
     CONSTRAINT EstudianteTelefonoUQ UNIQUE (telefono),
-    CONSTRAINT CursoGTZ CHECK (curso > 0)
+    CONSTRAINT CursoGTZ CHECK (curso > 0),
+    CONSTRAINT LibrosEnPosesionNN CHECK (librosenposesion >= 0)
 );
 
 CREATE TABLE libro (
@@ -29,29 +39,66 @@ CREATE TABLE libro (
     isbn VARCHAR(20),
     sinopsis TEXT,
     idcategoria BIGINT,
+    precioactual FLOAT,
+    prestado BOOLEAN NOT NULL DEFAULT FALSE,
+    -- Version de los datos y del precio, para el control de concurrencia optimista de modificar_libro
+    version INTEGER NOT NULL DEFAULT 1,
+    busqueda TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('spanish', coalesce(titulo, '')), 'A') ||
+        setweight(to_tsvector('spanish', coalesce(autor, '')), 'B') ||
+        setweight(to_tsvector('spanish', coalesce(sinopsis, '')), 'C')
+    ) STORED,
     CONSTRAINT LibroPK PRIMARY KEY (id),
     CONSTRAINT LibroISBNUQ UNIQUE (isbn),
+    CONSTRAINT LibroPrecioNN CHECK (precioactual >= 0),
     CONSTRAINT LibroCategoriaFK FOREIGN KEY (idcategoria)
         REFERENCES categoria(id)
         ON DELETE SET NULL
         ON UPDATE CASCADE
 );
 
+-- Historial de precios, particionado por anio de la fecha. La clave primaria de una tabla
+-- particionada tiene que incluir la columna de particion.
 CREATE TABLE preciolibro (
     id BIGSERIAL,
     precio FLOAT NOT NULL,
-    fecha TIMESTAMP NOT NULL,
+    fecha TIMESTAMP NOT NULL DEFAULT NOW(),
     idlibro BIGINT NOT NULL
         REFERENCES libro(id)
         ON DELETE CASCADE
         ON UPDATE CASCADE,
+    CONSTRAINT PrecioLibroPK PRIMARY KEY (id, fecha),
     CONSTRAINT PrecioNN CHECK (precio >= 0)
-);
+) PARTITION BY RANGE (fecha);
+
+-- Una particion por anio (preciolibro_AAAA). Los precios fuera de esos anios van a la particion
+-- por defecto; para anadir un anio nuevo con la tabla en uso, ver repositorio.crear_particion_precios.
+DO $$
+BEGIN
+    FOR anio IN 2020..2030 LOOP
+        EXECUTE format(
+            'CREATE TABLE preciolibro_%s PARTITION OF preciolibro FOR VALUES FROM (%L) TO (%L)',
+            anio, make_date(anio, 1, 1), make_date(anio + 1, 1, 1));
+    END LOOP;
+END
+$$;
+
+CREATE TABLE preciolibro_defecto PARTITION OF preciolibro DEFAULT;
+
+CREATE INDEX LibroBusquedaIDX ON libro USING GIN (busqueda);
+CREATE INDEX LibroTituloTrgmIDX ON libro USING GIN (titulo gin_trgm_ops);
+CREATE INDEX LibroAutorTrgmIDX ON libro USING GIN (autor gin_trgm_ops);
+
+-- Historial de cada libro y precio en una fecha (repositorio.precios_en_fecha): el ultimo precio anterior a
+-- la fecha se lee solo del indice, sin visitar la tabla
+CREATE INDEX PrecioLibroFechaIDX ON preciolibro (idlibro, fecha DESC) INCLUDE (precio);
 
 CREATE TABLE prestamo (
     id BIGSERIAL,
     fechaprestamo TIMESTAMP NOT NULL,
     fechadevolucion TIMESTAMP,
+    -- Fecha de prestamo mas los dias de prestamo de la categoria del libro en ese momento
+    fechalimite TIMESTAMP NOT NULL,
     comentarios TEXT,
     idlibro BIGINT,
     idestudiante BIGINT,
@@ -64,4 +111,75 @@ CREATE TABLE prestamo (
         REFERENCES estudiante(id)
         ON DELETE SET NULL
         ON UPDATE CASCADE
-);
\ No newline at end of file
+);
+
+CREATE INDEX PrestamoLibroIDX ON prestamo (idlibro, fechaprestamo DESC);
+CREATE INDEX PrestamoEstudianteIDX ON prestamo (idestudiante, fechaprestamo DESC);
+-- Un libro tiene como mucho un prestamo abierto: dos prestamos simultaneos del mismo libro no pueden
+-- confirmarse los dos, sin necesidad de transacciones SERIALIZABLE
+CREATE UNIQUE INDEX PrestamoLibroAbiertoUQ ON prestamo (idlibro) WHERE fechadevolucion IS NULL;
+-- Libros en posesion de cada estudiante (consultar_estudiante), ya ordenados por fecha de prestamo
+CREATE INDEX PrestamoEstudianteAbiertoIDX ON prestamo (idestudiante, fechaprestamo) INCLUDE (idlibro)
+    WHERE fechadevolucion IS NULL;
+-- Prestamos abiertos por fecha limite: los vencidos son un rango al principio del indice (informes.py)
+CREATE INDEX PrestamoVencimientoIDX ON prestamo (fechalimite) INCLUDE (idestudiante)
+    WHERE fechadevolucion IS NULL;
+
+-- Procesos incrementales de informes.py: instante hasta el que se ha procesado cada uno (NULL si todavia
+-- no se ha ejecutado)
+CREATE TABLE marcainforme (
+    nombre VARCHAR(50),
+    hasta TIMESTAMP,
+    CONSTRAINT MarcaInformePK PRIMARY KEY (nombre)
+);
+
+-- Estadisticas de circulacion (informes.py). Se calculan sobre todo el historial de prestamos y se
+-- refrescan sin bloquear las lecturas con repositorio.refrescar_estadisticas, que necesita un indice unico
+-- en cada vista. Los prestamos de libros eliminados no se cuentan.
+
+-- Prestamos de cada libro por mes, con los devueltos y la suma de sus dias de prestamo (para la duracion media)
+CREATE MATERIALIZED VIEW circulacionmensual AS
+SELECT
+    CAST(date_trunc('month', p.fechaprestamo) AS DATE) AS mes,
+    p.idlibro,
+    l.idcategoria,
+    count(*) AS prestamos,
+    count(p.fechadevolucion) AS devueltos,
+    coalesce(CAST(sum(EXTRACT(EPOCH FROM p.fechadevolucion - p.fechaprestamo)) / 86400 AS FLOAT), 0) AS diasprestado
+FROM
+    prestamo p
+JOIN
+    libro l ON l.id = p.idlibro
+GROUP BY
+    1, 2, 3;
+
+CREATE UNIQUE INDEX CirculacionMensualUQ ON circulacionmensual (mes, idlibro);
+-- Libros mas prestados de cada categoria en un mes, ya ordenados
+CREATE INDEX CirculacionMensualCategoriaIDX ON circulacionmensual (mes, idcategoria, prestamos DESC, idlibro);
+
+-- Los mismos totales por categoria y mes, a partir de circulacionmensual (se refresca despues)
+CREATE MATERIALIZED VIEW circulacioncategoria AS
+SELECT
+    mes,
+    idcategoria,
+    CAST(sum(prestamos) AS BIGINT) AS prestamos,
+    CAST(sum(devueltos) AS BIGINT) AS devueltos,
+    sum(diasprestado) AS diasprestado
+FROM
+    circulacionmensual
+GROUP BY
+    mes,
+    idcategoria;
+
+CREATE UNIQUE INDEX CirculacionCategoriaUQ ON circulacioncategoria (mes, idcategoria) NULLS NOT DISTINCT;
+
+-- Libros que no se han prestado nunca
+CREATE MATERIALIZED VIEW libronuncaprestado AS
+SELECT
+    l.id
+FROM
+    libro l
+WHERE
+    NOT EXISTS (SELECT 1 FROM prestamo p WHERE p.idlibro = l.id);
+
+CREATE UNIQUE INDEX LibroNuncaPrestadoUQ ON libronuncaprestado (id);
@@ -0,0 +1,131 @@
+"""
+Exportacion del catalogo y del historial de prestamos y precios a CSV o Parquet, para analizarlos fuera de la
+base de datos.
+
+Uso:
+    python exportar.py libros [--formato csv|parquet] [--salida libros.csv] [--categoria 1]
+    python exportar.py prestamos [--formato csv|parquet] [--salida prestamos.parquet] [--desde 2025-01-01]
+                                 [--hasta 2025-07-01] [--lote 100000]
+    python exportar.py precios [--formato csv|parquet] [--salida precios.csv] [--desde ...] [--hasta ...]
+
+'libros' exporta los libros con el nombre de su categoria y su precio actual; 'prestamos' y 'precios', los
+prestamos y el historial de precios con fecha (de prestamo o de precio) entre --desde (incluida) y --hasta
+(excluida). Las filas se escriben segun llegan, sin cargar la tabla en memoria: en CSV las genera el servidor
+con COPY (por defecto, en la salida estandar); en Parquet se leen por lotes de --lote filas y cada lote se
+escribe como un grupo de filas. Parquet necesita pyarrow (pip install pyarrow), que no hace falta para el
+resto de la aplicacion.
+La conexion se configura como en el resto de la aplicacion (ver conexion.py).
+"""
+
+import argparse
+import sys
+from datetime import datetime
+
+import psycopg2
+
+import conexion
+import repositorio
+
+
+def fecha(texto):
+    """Convierte una fecha AAAA-MM-DD en datetime (tipo de argparse)."""
+    try:
+        return datetime.strptime(texto, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{texto}' no es una fecha AAAA-MM-DD.")
+
+
+def esquema_parquet(pa, exportacion):
+    """
+    Devuelve el esquema de los ficheros Parquet de una exportacion. Se fija de antemano para que todos los
+    lotes tengan los mismos tipos aunque alguna columna de un lote tenga solo nulos.
+    :param pa: El modulo pyarrow
+    :param exportacion: El nombre de la exportacion
+    :return: El esquema (pyarrow.Schema)
+    """
+    instante = pa.timestamp('us')
+    return pa.schema({
+        'libros': [
+            ('id', pa.int64()), ('titulo', pa.string()), ('autor', pa.string()), ('aniopublicacion', pa.int16()),
+            ('isbn', pa.string()), ('sinopsis', pa.string()), ('idcategoria', pa.int64()),
+            ('categoria', pa.string()), ('precioactual', pa.float64()), ('prestado', pa.bool_()),
+        ],
+        'prestamos': [
+            ('id', pa.int64()), ('fechaprestamo', instante), ('fechalimite', instante),
+            ('fechadevolucion', instante), ('comentarios', pa.string()), ('idlibro', pa.int64()),
+            ('idestudiante', pa.int64()),
+        ],
+        'precios': [
+            ('id', pa.int64()), ('idlibro', pa.int64()), ('precio', pa.float64()), ('fecha', instante),
+        ],
+    }[exportacion])
+
+
+def exportar_parquet(conn, exportacion, salida, filtros, tamano_lote):
+    """
+    Escribe una exportacion en un fichero Parquet, un grupo de filas por lote.
+    :param conn: La conexion con la base de datos
+    :param exportacion: El nombre de la exportacion
+    :param salida: La ruta del fichero
+    :param filtros: Los FiltrosExportacion
+    :param tamano_lote: El numero de filas de cada lote
+    :return: El numero de filas exportadas
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise repositorio.DatosNoValidos("El formato parquet necesita pyarrow (pip install pyarrow).")
+
+    esquema = esquema_parquet(pa, exportacion)
+    with pq.ParquetWriter(salida, esquema) as escritor:
+        def escribir_lote(columnas, filas):
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array([fila[i] for fila in filas], esquema.field(columna).type)
+                 for i, columna in enumerate(columnas)], schema=esquema))
+            print(f"{len(filas)} filas escritas...", file=sys.stderr)
+
+        return repositorio.exportar_lotes(conn, exportacion, escribir_lote, filtros, tamano_lote)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta el catalogo y el historial a CSV o Parquet.")
+    parser.add_argument("exportacion", choices=list(repositorio.SQL_EXPORTAR), help="Datos a exportar")
+    parser.add_argument("--formato", choices=["csv", "parquet"], default="csv", help="Formato de salida")
+    parser.add_argument("--salida", help="Fichero de salida (en csv, por defecto la salida estandar)")
+    parser.add_argument("--categoria", type=int, help="Solo los libros de esta categoria (libros)")
+    parser.add_argument("--desde", type=fecha, help="Fecha inicial AAAA-MM-DD, incluida (prestamos y precios)")
+    parser.add_argument("--hasta", type=fecha, help="Fecha final AAAA-MM-DD, excluida (prestamos y precios)")
+    parser.add_argument("--lote", type=int, default=100_000, help="Filas de cada lote (parquet)")
+    args = parser.parse_args()
+    if args.formato == "parquet" and not args.salida:
+        parser.error("el formato parquet necesita --salida")
+
+    filtros = repositorio.FiltrosExportacion(idcategoria=args.categoria, desde=args.desde, hasta=args.hasta)
+
+    try:
+        pool = conexion.PoolBiblioteca(minconn=1, maxconn=1)
+    except psycopg2.Error:
+        print("Error de conexion", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        with pool.conexion() as conn:
+            if args.formato == "parquet":
+                filas = exportar_parquet(conn, args.exportacion, args.salida, filtros, args.lote)
+            elif args.salida:
+                with open(args.salida, "wb") as fichero:
+                    filas = repositorio.exportar_csv(conn, args.exportacion, fichero, filtros)
+            else:
+                filas = repositorio.exportar_csv(conn, args.exportacion, sys.stdout.buffer, filtros)
+                sys.stdout.flush()
+        print(f"Filas exportadas: {filas}.", file=sys.stderr)
+    except repositorio.ErrorBiblioteca as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Generador de datos sinteticos para pruebas de rendimiento.
+
+Uso:
+    python generar_datos.py --escala 1m [--vaciar] [--semilla 1]
+    python generar_datos.py --libros 50000 --estudiantes 5000 --prestamos 200000 --precios 4
+
+Carga categorias, estudiantes, libros, historial de precios y prestamos con COPY. Las distribuciones
+estan sesgadas como en una biblioteca real: unos pocos libros, autores, categorias y estudiantes
+concentran la mayoria de prestamos y libros, y el numero de cambios de precio por libro varia.
+Los datos derivados (libro.precioactual, libro.prestado, estudiante.librosenposesion) quedan
+coherentes con el historial, y cada libro tiene como mucho un prestamo abierto. Al terminar se refrescan
+las estadisticas de circulacion.
+
+Las filas se anaden a las que ya haya, salvo con --vaciar, que vacia antes todas las tablas.
+La conexion se configura como en el resto de la aplicacion (ver conexion.py).
+"""
+
+import argparse
+import array
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+import psycopg2.extras
+
+import conexion
+import repositorio
+
+
+# Tamanos predefinidos: libros, estudiantes, prestamos y cambios de precio medios por libro
+ESCALAS = {
+    '10k': (10_000, 2_000, 50_000, 3),
+    '1m': (1_000_000, 100_000, 3_000_000, 3),
+    '10m': (10_000_000, 1_000_000, 30_000_000, 3),
+}
+
+# Exponente del sesgo: con s, el elemento elegido es int(n * u ** s) con u uniforme en [0, 1), de modo
+# que los primeros elementos (tras permutarlos) se eligen mucho mas que los ultimos
+SESGO_LIBROS = 2
+SESGO_ESTUDIANTES = 1.5
+SESGO_AUTORES = 2
+SESGO_CATEGORIAS = 1.5
+
+# Fraccion de prestamos que siguen abiertos (sin devolver)
+FRACCION_ABIERTOS = 0.05
+
+CURSOS = 6
+
+PALABRAS = (
+    "historia", "mar", "noche", "ciudad", "tiempo", "camino", "sombra", "luz", "guerra", "amor", "viaje",
+    "secreto", "jardin", "rio", "montana", "memoria", "silencio", "fuego", "invierno", "verano", "isla",
+    "reino", "ciencia", "datos", "sistemas", "redes", "algoritmos", "economia", "arte", "musica", "poesia",
+    "filosofia", "matematicas", "fisica", "quimica", "biologia", "lenguaje", "cocina", "deporte", "viento",
+)
+NOMBRES = (
+    "Ana", "Luis", "Maria", "Carlos", "Lucia", "Javier", "Sofia", "Pablo", "Elena", "Diego", "Laura", "Hugo",
+    "Marta", "Daniel", "Paula", "Adrian", "Sara", "Alvaro", "Irene", "Manuel", "Clara", "Mateo", "Noa", "Iago",
+)
+APELLIDOS = (
+    "Garcia", "Fernandez", "Gonzalez", "Rodriguez", "Lopez", "Martinez", "Sanchez", "Perez", "Gomez", "Martin",
+    "Jimenez", "Ruiz", "Hernandez", "Diaz", "Moreno", "Alvarez", "Romero", "Otero", "Castro", "Varela",
+)
+
+INICIO_PRECIOS = datetime(2020, 1, 1)
+
+
+class Sesgada:
+    """
+    Elige elementos de 0 a n - 1 con una distribucion sesgada. Los mas frecuentes se reparten por todo el
+    rango (multiplicando por un paso primo con n, cercano a n por la razon aurea) para que no coincidan con los ids mas bajos.
+    """
+
+    def __init__(self, rng, n, sesgo):
+        self.rng = rng
+        self.n = n
+        self.sesgo = sesgo
+        self.paso = next(p for p in range(int(n * 0.618) | 1, 2 * n + 3, 2) if math.gcd(p, n) == 1)
+
+    def elegir(self):
+        return int(self.n * self.rng.random() ** self.sesgo) * self.paso % self.n
+
+
+def _reservar_ids(cur, tabla):
+    """
+    Bloquea la tabla hasta el final de la transaccion y devuelve el primer id libre, a partir del cual
+    se cargan las filas con ids consecutivos.
+    """
+    cur.execute(f"LOCK TABLE {tabla} IN EXCLUSIVE MODE")
+    cur.execute(f"SELECT coalesce(max(id), 0) + 1 AS primero FROM {tabla}")
+    return cur.fetchone()['primero']
+
+
+def _ajustar_secuencia(cur, tabla):
+    """Avanza la secuencia de ids de la tabla hasta el mayor id cargado."""
+    cur.execute(f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), (SELECT max(id) FROM {tabla}))")
+
+
+def _copiar(cur, tabla, columnas, filas):
+    """
+    Carga filas en una tabla con COPY FROM STDIN, y ajusta su secuencia de ids.
+    """
+    inicio = time.monotonic()
+    cur.copy_expert(f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv)", repositorio.FlujoCSV(filas))
+    cargadas = cur.rowcount
+    _ajustar_secuencia(cur, tabla)
+    print(f"  {tabla}: {cargadas} filas en {time.monotonic() - inicio:.1f} s", file=sys.stderr)
+
+
+def generar(conn, libros, estudiantes, prestamos, precios, semilla=None, vaciar=False):
+    """
+    Genera y carga los datos en una sola transaccion, y actualiza las estadisticas de las tablas.
+    :param conn: La conexion con la base de datos
+    :param libros: Numero de libros
+    :param estudiantes: Numero de estudiantes
+    :param prestamos: Numero de prestamos
+    :param precios: Numero medio de precios por libro
+    :param semilla: Semilla del generador aleatorio, para repetir los mismos datos
+    :param vaciar: Si es True, se vacian antes todas las tablas
+    :return: None
+    """
+    rng = random.Random(semilla)
+    ahora = datetime.now().replace(microsecond=0)
+    segundos_precios = int((ahora - INICIO_PRECIOS).total_seconds())
+
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+        if vaciar:
+            cur.execute("TRUNCATE prestamo, preciolibro, libro, estudiante, categoria RESTART IDENTITY")
+
+        # Tantas categorias como libros / 1000, entre 5 y 200
+        n_categorias = min(max(libros // 1000, 5), 200)
+        primera_categoria = _reservar_ids(cur, "categoria")
+        _copiar(cur, "categoria", ("id", "nombre", "descripcion"), (
+            (primera_categoria + i, f"{PALABRAS[i % len(PALABRAS)].capitalize()} {i + primera_categoria}",
+             f"Libros de {PALABRAS[i % len(PALABRAS)]}")
+            for i in range(n_categorias)))
+
+        # Prestamos abiertos: se deciden antes para que libro.prestado y estudiante.librosenposesion
+        # se escriban ya coherentes. Un libro tiene como mucho un prestamo abierto.
+        elegir_libro = Sesgada(rng, libros, SESGO_LIBROS)
+        elegir_estudiante = Sesgada(rng, estudiantes, SESGO_ESTUDIANTES)
+        abiertos = {}
+        for _ in range(min(int(prestamos * FRACCION_ABIERTOS), libros)):
+            libro = elegir_libro.elegir()
+            while libro in abiertos:
+                libro = rng.randrange(libros)
+            abiertos[libro] = elegir_estudiante.elegir()
+        en_posesion = array.array('I', bytes(4 * estudiantes))
+        for estudiante in abiertos.values():
+            en_posesion[estudiante] += 1
+
+        primer_estudiante = _reservar_ids(cur, "estudiante")
+        _copiar(cur, "estudiante", ("id", "nombre", "apellidos", "curso", "email", "telefono", "librosenposesion"), (
+            (primer_estudiante + i, rng.choice(NOMBRES), f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}",
+             rng.randint(1, CURSOS), f"estudiante{primer_estudiante + i}@biblioteca.test",
+             f"+34 6{primer_estudiante + i:08d}", en_posesion[i])
+            for i in range(estudiantes)))
+
+        # Numero de precios y precio actual de cada libro, para escribir libro.precioactual antes que el historial
+        elegir_categoria = Sesgada(rng, n_categorias, SESGO_CATEGORIAS)
+        n_autores = max(libros // 20, 1)
+        elegir_autor = Sesgada(rng, n_autores, SESGO_AUTORES)
+        n_precios = array.array('H', (min(int(rng.expovariate(1 / precios)) + 1, 1000) if precios > 0 else 0
+                                      for _ in range(libros)))
+        precio_actual = array.array('d', (round(rng.uniform(5, 60), 2) for _ in range(libros)))
+
+        def filas_libros():
+            for i in range(libros):
+                titulo = " ".join(rng.choice(PALABRAS) for _ in range(rng.randint(1, 5))).capitalize()
+                autor = elegir_autor.elegir()
+                yield (
+                    primer_libro + i,
+                    titulo,
+                    f"{NOMBRES[autor % len(NOMBRES)]} {APELLIDOS[autor // len(NOMBRES) % len(APELLIDOS)]} {autor}",
+                    rng.randint(1900, ahora.year),
+                    f"978-{primer_libro + i:013d}",
+                    " ".join(rng.choice(PALABRAS) for _ in range(rng.randint(10, 40))).capitalize() + ".",
+                    primera_categoria + elegir_categoria.elegir(),
+                    precio_actual[i] if n_precios[i] > 0 else None,
+                    i in abiertos,
+                )
+
+        primer_libro = _reservar_ids(cur, "libro")
+        _copiar(cur, "libro", ("id", "titulo", "autor", "aniopublicacion", "isbn", "sinopsis", "idcategoria",
+                               "precioactual", "prestado"), filas_libros())
+
+        def filas_precios():
+            for i in range(libros):
+                fechas = sorted(INICIO_PRECIOS + timedelta(seconds=rng.randrange(segundos_precios))
+                                for _ in range(n_precios[i]))
+                for j, fecha in enumerate(fechas):
+                    precio = precio_actual[i] if j == len(fechas) - 1 else round(rng.uniform(5, 60), 2)
+                    yield precio, fecha, primer_libro + i
+
+        _copiar(cur, "preciolibro", ("precio", "fecha", "idlibro"), filas_precios())
+
+        # Las categorias generadas tienen los dias de prestamo por defecto
+        dias_prestamo = timedelta(days=repositorio.DIAS_PRESTAMO_POR_DEFECTO)
+
+        def filas_prestamos():
+            for libro, estudiante in abiertos.items():
+                fecha = ahora - timedelta(seconds=rng.randrange(60 * 86400))
+                yield (fecha, None, fecha + dias_prestamo, "Prestamo generado", primer_libro + libro,
+                       primer_estudiante + estudiante)
+            for _ in range(prestamos - len(abiertos)):
+                fecha = ahora - timedelta(seconds=rng.randrange(3 * 365 * 86400))
+                devolucion = min(fecha + timedelta(seconds=rng.randrange(86400, 60 * 86400)), ahora)
+                yield (fecha, devolucion, fecha + dias_prestamo, None, primer_libro + elegir_libro.elegir(),
+                       primer_estudiante + elegir_estudiante.elegir())
+
+        _copiar(cur, "prestamo", ("fechaprestamo", "fechadevolucion", "fechalimite", "comentarios", "idlibro",
+                                  "idestudiante"), filas_prestamos())
+
+    conn.commit()
+
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE categoria, estudiante, libro, preciolibro, prestamo")
+    conn.commit()
+
+    repositorio.refrescar_estadisticas(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera datos sinteticos sesgados y los carga con COPY.")
+    parser.add_argument("--escala", choices=ESCALAS, help="Tamano predefinido (libros, estudiantes, prestamos, precios)")
+    parser.add_argument("--libros", type=int, help="Numero de libros")
+    parser.add_argument("--estudiantes", type=int, help="Numero de estudiantes")
+    parser.add_argument("--prestamos", type=int, help="Numero de prestamos")
+    parser.add_argument("--precios", type=float, help="Numero medio de precios por libro")
+    parser.add_argument("--semilla", type=int, help="Semilla del generador aleatorio")
+    parser.add_argument("--vaciar", action="store_true", help="Vacia todas las tablas antes de cargar")
+    args = parser.parse_args()
+
+    libros, estudiantes, prestamos, precios = ESCALAS[args.escala or '10k']
+    libros = args.libros if args.libros is not None else libros
+    estudiantes = args.estudiantes if args.estudiantes is not None else estudiantes
+    prestamos = args.prestamos if args.prestamos is not None else prestamos
+    precios = args.precios if args.precios is not None else precios
+    if libros <= 0 or estudiantes <= 0 or prestamos < 0 or precios < 0:
+        parser.error("Debe haber al menos un libro y un estudiante, y los prestamos y precios no pueden ser negativos.")
+
+    try:
+        pool = conexion.PoolBiblioteca(minconn=1, maxconn=1)
+    except psycopg2.Error:
+        print("Error de conexion")
+        sys.exit(1)
+
+    print(f"Generando {libros} libros, {estudiantes} estudiantes, {prestamos} prestamos "
+          f"y {precios} precios por libro de media...", file=sys.stderr)
+    try:
+        with pool.conexion() as conn:
+            generar(conn, libros, estudiantes, prestamos, precios, args.semilla, args.vaciar)
+    except psycopg2.Error as e:
+        print(f"Error: {repositorio.traducir_error(e)}")
+        sys.exit(1)
+    finally:
+        pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Importacion masiva de libros desde ficheros CSV o JSON lines.
+
+Uso:
+    python importar.py libros.csv [--formato csv|json] [--rechazados rechazados.csv] [--sin-precios]
+
+Los ficheros CSV necesitan una cabecera con las columnas de repositorio.COLUMNAS_IMPORTACION (las que falten
+se toman como vacias y las demas se ignoran). En JSON lines, cada linea es un objeto con esas claves.
+La categoria se indica por su nombre. Si se indica precio, se registra como precio actual del libro.
+
+Los registros que no se pueden importar se escriben en el fichero de rechazados (por defecto, el nombre del
+fichero de entrada con el sufijo .rechazados.csv) con su numero de linea y el motivo.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import psycopg2
+
+import conexion
+import repositorio
+
+
+def leer_csv(fichero):
+    """
+    Lee los registros de un fichero CSV con cabecera.
+    :param fichero: El fichero abierto
+    :return: Iterador de pares (numero de linea, registro)
+    """
+    lector = csv.DictReader(fichero)
+    for registro in lector:
+        yield lector.line_num, registro
+
+
+def leer_json(fichero, rechazados):
+    """
+    Lee los registros de un fichero JSON lines. Las lineas que no son un objeto JSON se anaden a rechazados.
+    :param fichero: El fichero abierto
+    :param rechazados: Lista donde anadir las lineas no validas
+    :return: Iterador de pares (numero de linea, registro)
+    """
+    for linea, texto in enumerate(fichero, 1):
+        if texto.strip() == "":
+            continue
+        try:
+            registro = json.loads(texto)
+        except ValueError:
+            registro = None
+        if not isinstance(registro, dict):
+            rechazados.append(repositorio.Rechazado(linea, None, None, "La linea no es un objeto JSON."))
+            continue
+        yield linea, registro
+
+
+def escribir_rechazados(ruta, rechazados):
+    """
+    Escribe los registros rechazados en un fichero CSV.
+    :param ruta: La ruta del fichero
+    :param rechazados: Los registros rechazados
+    :return: None
+    """
+    with open(ruta, "w", newline="", encoding="utf-8") as fichero:
+        escritor = csv.writer(fichero)
+        escritor.writerow(("linea", "isbn", "titulo", "motivo"))
+        for rechazado in rechazados:
+            escritor.writerow((rechazado.linea, rechazado.isbn, rechazado.titulo, rechazado.motivo))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa libros en bloque desde un fichero CSV o JSON lines.")
+    parser.add_argument("fichero", help="Fichero de entrada")
+    parser.add_argument("--formato", choices=("csv", "json"),
+                        help="Formato del fichero (por defecto, segun la extension)")
+    parser.add_argument("--rechazados", help="Fichero CSV donde escribir los registros rechazados")
+    parser.add_argument("--sin-precios", action="store_true", help="Ignora la columna precio")
+    args = parser.parse_args()
+
+    formato = args.formato
+    if formato is None:
+        formato = "json" if os.path.splitext(args.fichero)[1].lower() in (".json", ".jsonl", ".ndjson") else "csv"
+    ruta_rechazados = args.rechazados or os.path.splitext(args.fichero)[0] + ".rechazados.csv"
+
+    rechazados_lectura = []
+    try:
+        pool = conexion.PoolBiblioteca(minconn=1, maxconn=1)
+    except psycopg2.Error:
+        print("Error de conexion")
+        sys.exit(1)
+
+    try:
+        with open(args.fichero, newline="", encoding="utf-8") as fichero, pool.conexion() as conn:
+            registros = leer_csv(fichero) if formato == "csv" else leer_json(fichero, rechazados_lectura)
+            resultado = repositorio.importar_libros(conn, registros, precios=not args.sin_precios)
+    except OSError as e:
+        print(f"Error: no se puede leer el fichero: {e}")
+        sys.exit(1)
+    except (csv.Error, UnicodeDecodeError) as e:
+        print(f"Error: el fichero no es valido: {e}")
+        sys.exit(1)
+    except repositorio.ErrorBiblioteca as e:
+        print(f"Error: {e}")
+        print("No se ha importado ningun libro.")
+        sys.exit(1)
+    finally:
+        pool.closeall()
+
+    rechazados = sorted(rechazados_lectura + resultado.rechazados, key=lambda r: r.linea)
+    print(f"Libros importados: {resultado.importados} ({resultado.precios} con precio).")
+    if rechazados:
+        escribir_rechazados(ruta_rechazados, rechazados)
+        print(f"Registros rechazados: {len(rechazados)} (ver {ruta_rechazados}).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Informes de prestamos vencidos y estadisticas de circulacion, para ejecutar desde la linea de comandos o una
+tarea programada.
+
+Uso:
+    python informes.py vencidos [--curso 2]
+    python informes.py recordatorios [--proceso recordatorios]
+    python informes.py refrescar
+    python informes.py mas-prestados --mes 2025-03 [--categoria 1] [--limite 5]
+    python informes.py duracion [--desde 2025-01] [--hasta 2025-06]
+    python informes.py nunca-prestados [--categoria 1] [--limite 50]
+
+'vencidos' lista todos los prestamos abiertos que han pasado su fecha limite, agrupados por estudiante y
+curso. 'recordatorios' es la ejecucion nocturna: lista solo los prestamos que han vencido desde la ejecucion
+anterior del mismo proceso (la primera vez, todos los vencidos), con el email de cada estudiante, y apunta
+hasta cuando ha procesado (ver repositorio.vencidos_desde_ultima_vez).
+
+Las estadisticas de circulacion (libros mas prestados por categoria y mes, duracion media de los prestamos
+y libros que no se han prestado nunca) se leen de vistas materializadas, con los datos del ultimo
+'refrescar', que se puede programar (por ejemplo, cada noche) sin bloquear las consultas.
+La conexion se configura como en el resto de la aplicacion (ver conexion.py).
+"""
+
+import argparse
+import sys
+from datetime import datetime
+
+import psycopg2
+
+import conexion
+import repositorio
+
+
+def mes(texto):
+    """Convierte un mes AAAA-MM en la fecha de su primer dia (tipo de argparse)."""
+    try:
+        return datetime.strptime(texto, "%Y-%m").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{texto}' no es un mes AAAA-MM.")
+
+
+def escribir_vencidos(vencidos, emails=False):
+    """
+    Escribe los prestamos vencidos agrupados por curso y estudiante.
+    :param vencidos: Los VencidosEstudiante del informe
+    :param emails: Si es True, se escribe tambien el email de cada estudiante
+    :return: None
+    """
+    curso = None
+    for estudiante in vencidos:
+        if estudiante.curso != curso:
+            curso = estudiante.curso
+            print(f"\n[Curso {curso}]")
+        contacto = f" <{estudiante.email}>" if emails else ""
+        print(f"{estudiante.apellidos}, {estudiante.nombre} (id {estudiante.idestudiante}){contacto}")
+        for prestamo in estudiante.prestamos:
+            print(f"  Prestamo {prestamo.idprestamo}: {prestamo.titulo or 'Libro eliminado'} - "
+                  f"fecha limite {prestamo.fechalimite.date()} ({prestamo.diasretraso} dias de retraso)")
+    prestamos = sum(len(estudiante.prestamos) for estudiante in vencidos)
+    print(f"\nPrestamos vencidos: {prestamos} de {len(vencidos)} estudiantes.")
+
+
+def escribir_mas_prestados(libros):
+    """
+    Escribe los libros mas prestados de cada categoria.
+    :param libros: Los LibroMasPrestado del informe
+    :return: None
+    """
+    categoria = None
+    for i, libro in enumerate(libros):
+        if i == 0 or libro.idcategoria != categoria:
+            categoria = libro.idcategoria
+            print(f"\n[{libro.nombrecategoria or 'Sin categoria'}]")
+        print(f"  {libro.posicion}. {libro.titulo} ({libro.autor or 'autor desconocido'}, id {libro.idlibro}): "
+              f"{libro.prestamos} prestamos")
+    if not libros:
+        print("No hay prestamos en ese mes.")
+
+
+def escribir_duracion(duraciones):
+    """
+    Escribe los prestamos y la duracion media de cada categoria y del total.
+    :param duraciones: Los DuracionPrestamos del informe
+    :return: None
+    """
+    for duracion in duraciones:
+        nombre = "TOTAL" if duracion.total else duracion.nombrecategoria or "Sin categoria"
+        media = f"{duracion.diasmedios:.1f} dias" if duracion.diasmedios is not None else "-"
+        print(f"{nombre}: {duracion.prestamos} prestamos, {duracion.devueltos} devueltos, duracion media {media}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Informes de prestamos vencidos y estadisticas de circulacion.")
+    subparsers = parser.add_subparsers(dest="informe", required=True)
+    parser_vencidos = subparsers.add_parser("vencidos", help="Todos los prestamos vencidos")
+    parser_vencidos.add_argument("--curso", type=int, help="Solo los estudiantes de este curso")
+    parser_recordatorios = subparsers.add_parser("recordatorios",
+                                                 help="Prestamos vencidos desde la ejecucion anterior")
+    parser_recordatorios.add_argument("--proceso", default=repositorio.PROCESO_RECORDATORIOS,
+                                      help="Nombre del proceso incremental")
+    subparsers.add_parser("refrescar", help="Vuelve a calcular las estadisticas de circulacion")
+    parser_mas_prestados = subparsers.add_parser("mas-prestados", help="Libros mas prestados por categoria en un mes")
+    parser_mas_prestados.add_argument("--mes", type=mes, required=True, help="Mes AAAA-MM")
+    parser_mas_prestados.add_argument("--categoria", type=int, help="Id de la categoria (por defecto, todas)")
+    parser_mas_prestados.add_argument("--limite", type=int, default=5, help="Libros de cada categoria")
+    parser_duracion = subparsers.add_parser("duracion", help="Duracion media de los prestamos por categoria")
+    parser_duracion.add_argument("--desde", type=mes, help="Primer mes AAAA-MM")
+    parser_duracion.add_argument("--hasta", type=mes, help="Ultimo mes AAAA-MM")
+    parser_nunca = subparsers.add_parser("nunca-prestados", help="Libros que no se han prestado nunca")
+    parser_nunca.add_argument("--categoria", type=int, help="Id de la categoria (por defecto, todas)")
+    parser_nunca.add_argument("--limite", type=int, help="Numero maximo de libros (por defecto, todos)")
+    args = parser.parse_args()
+
+    try:
+        pool = conexion.PoolBiblioteca(minconn=1, maxconn=1)
+    except psycopg2.Error:
+        print("Error de conexion")
+        sys.exit(1)
+
+    try:
+        with pool.conexion() as conn:
+            if args.informe == "vencidos":
+                escribir_vencidos(repositorio.informe_vencidos(conn, args.curso))
+            elif args.informe == "recordatorios":
+                escribir_vencidos(repositorio.vencidos_desde_ultima_vez(conn, args.proceso), emails=True)
+            elif args.informe == "refrescar":
+                print(f"Estadisticas de circulacion actualizadas a {repositorio.refrescar_estadisticas(conn)}.")
+                return
+            else:
+                actualizadas = repositorio.fecha_estadisticas(conn)
+                print(f"Estadisticas de circulacion a {actualizadas or 'ninguna fecha (sin refrescar)'}.")
+                if args.informe == "mas-prestados":
+                    escribir_mas_prestados(repositorio.libros_mas_prestados(conn, args.mes, args.categoria,
+                                                                            args.limite))
+                elif args.informe == "duracion":
+                    escribir_duracion(repositorio.duracion_prestamos(conn, args.desde, args.hasta))
+                else:
+                    libros = repositorio.recorrer(lambda n, despues: repositorio.libros_nunca_prestados(
+                        conn, n, despues, args.categoria))
+                    total = 0
+                    for libro in libros:
+                        if args.limite is not None and total == args.limite:
+                            break
+                        total += 1
+                        print(f"{libro.id}: {libro.titulo} ({libro.nombrecategoria or 'Sin categoria'})")
+                    print(f"\nLibros: {total}.")
+    except repositorio.ErrorBiblioteca as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
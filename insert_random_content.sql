@@ -1,10 +1,10 @@
 -- Insertar categorias
-INSERT INTO categoria (nombre, descripcion) VALUES
-('Ficcion', 'Libros de ficcion imaginativa'),
-('Ciencia', 'Libros cientificos y divulgativos'),
-('Historia', 'Libros historicos'),
-('Tecnologia', 'Libros sobre avances tecnologicos'),
-('Arte', 'Libros de arte y cultura');
+INSERT INTO categoria (nombre, descripcion, diasprestamo) VALUES
+('Ficcion', 'Libros de ficcion imaginativa', 21),
+('Ciencia', 'Libros cientificos y divulgativos', 14),
+('Historia', 'Libros historicos', 14),
+('Tecnologia', 'Libros sobre avances tecnologicos', 7),
+('Arte', 'Libros de arte y cultura', 30);
 
 -- Insertar libros
 INSERT INTO libro (titulo, autor, aniopublicacion, isbn, sinopsis, idcategoria) VALUES
@@ -182,6 +182,15 @@ INSERT INTO preciolibro (precio, fecha, idlibro) VALUES
 (46.8, '2024-08-14', 50),
 (15.21, '2024-08-16', 50);
 
+-- Precio actual de cada libro (ultimo precio registrado)
+UPDATE libro l SET precioactual = (
+    SELECT precio
+    FROM preciolibro
+    WHERE idlibro = l.id
+    ORDER BY fecha DESC
+    LIMIT 1
+);
+
 -- Insertar estudiantes
 INSERT INTO estudiante (nombre, apellidos, curso, email, telefono) VALUES
 ('Nombre1', 'Apellido1', 1, 'estudiante1@email.com', '600000000'),
@@ -235,8 +244,16 @@ INSERT INTO estudiante (nombre, apellidos, curso, email, telefono) VALUES
 ('Nombre49', 'Apellido49', 1, 'estudiante49@email.com', '600000048'),
 ('Nombre50', 'Apellido50', 2, 'estudiante50@email.com', '600000049');
 
--- Insertar prestamos
-INSERT INTO prestamo (fechaprestamo, fechadevolucion, comentarios, idLibro, idestudiante) VALUES
+-- Insertar prestamos, con la fecha limite segun los dias de prestamo de la categoria del libro
+INSERT INTO prestamo (fechaprestamo, fechadevolucion, fechalimite, comentarios, idLibro, idestudiante)
+SELECT
+    CAST(v.fechaprestamo AS TIMESTAMP),
+    CAST(v.fechadevolucion AS TIMESTAMP),
+    CAST(v.fechaprestamo AS TIMESTAMP) + make_interval(days => coalesce(c.diasprestamo, 14)),
+    v.comentarios,
+    v.idlibro,
+    v.idestudiante
+FROM (VALUES
 ('2025-03-22', '2025-04-16', 'Prestamo generado automaticamente (5/15)', 5, 15),
 ('2025-03-30', NULL, 'Prestamo generado automaticamente (36/15)', 36, 15),
 ('2025-03-30', '2025-04-05', 'Prestamo generado automaticamente (2/47)', 2, 47),
@@ -265,13 +282,13 @@ INSERT INTO prestamo (fechaprestamo, fechadevolucion, comentarios, idLibro, ides
 ('2025-03-16', '2025-03-25', 'Prestamo generado automaticamente (42/26)', 42, 26),
 ('2025-04-15', '2025-04-30', 'Prestamo generado automaticamente (29/29)', 29, 29),
 ('2025-03-09', '2025-03-29', 'Prestamo generado automaticamente (20/32)', 20, 32),
-('2025-03-18', NULL, 'Prestamo generado automaticamente (28/6)', 28, 6),
+('2025-03-18', '2025-03-28', 'Prestamo generado automaticamente (28/6)', 28, 6),
 ('2025-04-08', NULL, 'Prestamo generado automaticamente (31/44)', 31, 44),
 ('2025-03-19', NULL, 'Prestamo generado automaticamente (43/37)', 43, 37),
 ('2025-04-28', '2025-05-19', 'Prestamo generado automaticamente (35/29)', 35, 29),
 ('2025-04-06', '2025-04-07', 'Prestamo generado automaticamente (11/31)', 11, 31),
 ('2025-04-07', '2025-04-11', 'Prestamo generado automaticamente (42/35)', 42, 35),
-('2025-03-24', NULL, 'Prestamo generado automaticamente (50/14)', 50, 14),
+('2025-03-24', '2025-04-20', 'Prestamo generado automaticamente (50/14)', 50, 14),
 ('2025-03-11', '2025-03-15', 'Prestamo generado automaticamente (47/23)', 47, 23),
 ('2025-03-18', '2025-03-23', 'Prestamo generado automaticamente (44/26)', 44, 26),
 ('2025-03-26', '2025-04-12', 'Prestamo generado automaticamente (8/8)', 8, 8),
@@ -280,38 +297,38 @@ INSERT INTO prestamo (fechaprestamo, fechadevolucion, comentarios, idLibro, ides
 ('2025-03-17', '2025-04-06', 'Prestamo generado automaticamente (2/14)', 2, 14),
 ('2025-04-27', NULL, 'Prestamo generado automaticamente (7/2)', 7, 2),
 ('2025-04-07', '2025-04-18', 'Prestamo generado automaticamente (13/35)', 13, 35),
-('2025-04-08', NULL, 'Prestamo generado automaticamente (41/1)', 41, 1),
+('2025-04-08', '2025-04-22', 'Prestamo generado automaticamente (41/1)', 41, 1),
 ('2025-03-01', '2025-03-10', 'Prestamo generado automaticamente (9/10)', 9, 10),
 ('2025-03-19', '2025-04-02', 'Prestamo generado automaticamente (45/10)', 45, 10),
 ('2025-03-01', '2025-03-08', 'Prestamo generado automaticamente (28/1)', 28, 1),
-('2025-03-11', NULL, 'Prestamo generado automaticamente (40/31)', 40, 31),
+('2025-03-11', '2025-04-24', 'Prestamo generado automaticamente (40/31)', 40, 31),
 ('2025-03-23', '2025-03-27', 'Prestamo generado automaticamente (14/38)', 14, 38),
 ('2025-03-06', NULL, 'Prestamo generado automaticamente (13/12)', 13, 12),
-('2025-04-24', NULL, 'Prestamo generado automaticamente (40/47)', 40, 47),
+('2025-04-24', '2025-04-26', 'Prestamo generado automaticamente (40/47)', 40, 47),
 ('2025-03-22', NULL, 'Prestamo generado automaticamente (8/22)', 8, 22),
 ('2025-04-22', '2025-05-07', 'Prestamo generado automaticamente (26/30)', 26, 30),
 ('2025-03-16', '2025-04-07', 'Prestamo generado automaticamente (6/43)', 6, 43),
-('2025-03-25', NULL, 'Prestamo generado automaticamente (14/40)', 14, 40),
+('2025-03-25', '2025-04-09', 'Prestamo generado automaticamente (14/40)', 14, 40),
 ('2025-04-24', '2025-05-01', 'Prestamo generado automaticamente (32/13)', 32, 13),
-('2025-04-23', NULL, 'Prestamo generado automaticamente (11/34)', 11, 34),
+('2025-04-23', '2025-04-23', 'Prestamo generado automaticamente (11/34)', 11, 34),
 ('2025-04-07', '2025-04-24', 'Prestamo generado automaticamente (31/23)', 31, 23),
 ('2025-04-22', NULL, 'Prestamo generado automaticamente (41/8)', 41, 8),
 ('2025-03-12', NULL, 'Prestamo generado automaticamente (46/1)', 46, 1),
 ('2025-04-05', '2025-04-06', 'Prestamo generado automaticamente (16/20)', 16, 20),
 ('2025-04-04', NULL, 'Prestamo generado automaticamente (26/42)', 26, 42),
-('2025-04-14', NULL, 'Prestamo generado automaticamente (17/32)', 17, 32),
-('2025-04-13', NULL, 'Prestamo generado automaticamente (7/50)', 7, 50),
+('2025-04-14', '2025-04-22', 'Prestamo generado automaticamente (17/32)', 17, 32),
+('2025-04-13', '2025-04-27', 'Prestamo generado automaticamente (7/50)', 7, 50),
 ('2025-04-23', NULL, 'Prestamo generado automaticamente (11/24)', 11, 24),
 ('2025-03-31', '2025-04-30', 'Prestamo generado automaticamente (34/27)', 34, 27),
 ('2025-03-03', NULL, 'Prestamo generado automaticamente (34/23)', 34, 23),
 ('2025-03-08', NULL, 'Prestamo generado automaticamente (5/43)', 5, 43),
-('2025-03-01', NULL, 'Prestamo generado automaticamente (2/17)', 2, 17),
+('2025-03-01', '2025-04-11', 'Prestamo generado automaticamente (2/17)', 2, 17),
 ('2025-04-11', NULL, 'Prestamo generado automaticamente (2/34)', 2, 34),
 ('2025-04-14', '2025-04-25', 'Prestamo generado automaticamente (44/48)', 44, 48),
 ('2025-04-11', '2025-04-14', 'Prestamo generado automaticamente (14/6)', 14, 6),
-('2025-04-20', NULL, 'Prestamo generado automaticamente (29/46)', 29, 46),
+('2025-04-20', '2025-04-25', 'Prestamo generado automaticamente (29/46)', 29, 46),
 ('2025-04-20', '2025-05-15', 'Prestamo generado automaticamente (47/49)', 47, 49),
-('2025-04-21', NULL, 'Prestamo generado automaticamente (11/40)', 11, 40),
+('2025-04-21', '2025-04-23', 'Prestamo generado automaticamente (11/40)', 11, 40),
 ('2025-04-14', NULL, 'Prestamo generado automaticamente (20/27)', 20, 27),
 ('2025-04-28', '2025-05-28', 'Prestamo generado automaticamente (31/3)', 31, 3),
 ('2025-04-27', NULL, 'Prestamo generado automaticamente (48/17)', 48, 17),
@@ -319,21 +336,47 @@ INSERT INTO prestamo (fechaprestamo, fechadevolucion, comentarios, idLibro, ides
 ('2025-04-23', '2025-04-28', 'Prestamo generado automaticamente (19/26)', 19, 26),
 ('2025-03-19', '2025-04-18', 'Prestamo generado automaticamente (15/6)', 15, 6),
 ('2025-03-08', '2025-04-07', 'Prestamo generado automaticamente (13/32)', 13, 32),
-('2025-03-31', NULL, 'Prestamo generado automaticamente (31/9)', 31, 9),
+('2025-03-31', '2025-04-08', 'Prestamo generado automaticamente (31/9)', 31, 9),
 ('2025-03-04', '2025-03-05', 'Prestamo generado automaticamente (27/24)', 27, 24),
 ('2025-04-16', '2025-05-04', 'Prestamo generado automaticamente (29/25)', 29, 25),
 ('2025-03-23', '2025-04-06', 'Prestamo generado automaticamente (24/45)', 24, 45),
 ('2025-04-19', '2025-05-16', 'Prestamo generado automaticamente (22/14)', 22, 14),
-('2025-03-07', NULL, 'Prestamo generado automaticamente (14/15)', 14, 15),
+('2025-03-07', '2025-03-25', 'Prestamo generado automaticamente (14/15)', 14, 15),
 ('2025-04-17', NULL, 'Prestamo generado automaticamente (42/20)', 42, 20),
 ('2025-03-31', '2025-04-27', 'Prestamo generado automaticamente (31/4)', 31, 4),
-('2025-04-11', NULL, 'Prestamo generado automaticamente (17/28)', 17, 28),
-('2025-03-13', NULL, 'Prestamo generado automaticamente (11/7)', 11, 7),
+('2025-04-11', '2025-04-14', 'Prestamo generado automaticamente (17/28)', 17, 28),
+('2025-03-13', '2025-04-21', 'Prestamo generado automaticamente (11/7)', 11, 7),
 ('2025-03-22', NULL, 'Prestamo generado automaticamente (10/31)', 10, 31),
 ('2025-04-03', '2025-04-14', 'Prestamo generado automaticamente (8/37)', 8, 37),
 ('2025-04-09', NULL, 'Prestamo generado automaticamente (14/18)', 14, 18),
 ('2025-03-01', '2025-03-08', 'Prestamo generado automaticamente (43/19)', 43, 19),
 ('2025-03-21', NULL, 'Prestamo generado automaticamente (4/27)', 4, 27),
 ('2025-04-27', '2025-05-01', 'Prestamo generado automaticamente (42/15)', 42, 15),
-('2025-03-03', NULL, 'Prestamo generado automaticamente (43/49)', 43, 49),
-('2025-03-01', '2025-03-26', 'Prestamo generado automaticamente (1/22)', 1, 22);
\ No newline at end of file
+('2025-03-03', '2025-03-19', 'Prestamo generado automaticamente (43/49)', 43, 49),
+('2025-03-01', '2025-03-26', 'Prestamo generado automaticamente (1/22)', 1, 22)
+) AS v (fechaprestamo, fechadevolucion, comentarios, idlibro, idestudiante)
+LEFT JOIN
+    libro l ON l.id = v.idlibro
+LEFT JOIN
+    categoria c ON c.id = l.idcategoria;
+
+-- Disponibilidad de libros y libros en posesion de estudiantes (prestamos abiertos)
+UPDATE libro l SET prestado = EXISTS (
+    SELECT 1
+    FROM prestamo p
+    WHERE p.idlibro = l.id
+    AND p.fechadevolucion IS NULL
+);
+
+UPDATE estudiante e SET librosenposesion = (
+    SELECT count(*)
+    FROM prestamo p
+    WHERE p.idestudiante = e.id
+    AND p.fechadevolucion IS NULL
+);
+
+-- Estadisticas de circulacion con los datos anteriores
+REFRESH MATERIALIZED VIEW circulacionmensual;
+REFRESH MATERIALIZED VIEW circulacioncategoria;
+REFRESH MATERIALIZED VIEW libronuncaprestado;
+INSERT INTO marcainforme (nombre, hasta) VALUES ('estadisticas', NOW());
@@ -0,0 +1,257 @@
+"""
+Instrumentacion de las sentencias SQL: duracion, filas y nivel de aislamiento de cada ejecucion,
+estadisticas agregadas por sentencia y registro de sentencias lentas.
+
+Las sentencias se identifican por el nombre de la constante SQL_* de repositorio que las contiene
+(ver registrar_sentencias). La configuracion se toma del entorno:
+    BIBLIOTECA_LENTAS_MS        Duracion a partir de la cual una sentencia se registra como lenta
+                                (por defecto 200; 0 registra todas, negativo desactiva el registro)
+    BIBLIOTECA_LENTAS_LOG       Fichero del registro de sentencias lentas (por defecto
+                                consultas_lentas.log en el directorio temporal del sistema)
+    BIBLIOTECA_LENTAS_EXPLAIN   Si es 1, anade al registro el plan de las consultas lentas con
+                                EXPLAIN (ANALYZE, BUFFERS). Solo se hace con SELECT, que se pueden repetir.
+    BIBLIOTECA_ESTADISTICAS     Donde volcar las estadisticas al salir de main.py: '-' para la salida
+                                estandar o la ruta de un fichero JSON (por defecto no se vuelcan)
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+
+FICHERO_LENTAS = os.environ.get("BIBLIOTECA_LENTAS_LOG",
+                                os.path.join(tempfile.gettempdir(), "consultas_lentas.log"))
+UMBRAL_LENTAS = float(os.environ.get("BIBLIOTECA_LENTAS_MS", 200)) / 1000
+EXPLAIN_LENTAS = os.environ.get("BIBLIOTECA_LENTAS_EXPLAIN", "0") == "1"
+
+NIVELES = {
+    psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT: "AUTOCOMMIT",
+    psycopg2.extensions.ISOLATION_LEVEL_READ_UNCOMMITTED: "READ UNCOMMITTED",
+    psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED: "READ COMMITTED",
+    psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ: "REPEATABLE READ",
+    psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE: "SERIALIZABLE",
+    None: "DEFAULT",
+}
+
+_log_lentas = logging.getLogger("biblioteca.lentas")
+_log_lentas.propagate = False
+_log_lentas.setLevel(logging.INFO)
+
+
+def _configurar_log():
+    """
+    Abre el fichero del registro de sentencias lentas la primera vez que hace falta.
+    """
+    if not _log_lentas.handlers:
+        manejador = logging.FileHandler(FICHERO_LENTAS, encoding="utf-8", delay=True)
+        manejador.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        _log_lentas.addHandler(manejador)
+
+
+# ------------------------------------------------------------
+# Nombres de las sentencias
+
+_nombres = {}
+
+
+def registrar_sentencias(espacio):
+    """
+    Registra con su nombre las sentencias de las constantes SQL_* de un modulo. En las constantes que son
+    diccionarios de sentencias, el nombre incluye la clave (SQL_MODIFICAR_CATEGORIA[nombre]).
+    :param espacio: Las variables globales del modulo (globals())
+    :return: None
+    """
+    for nombre, valor in espacio.items():
+        if not nombre.startswith("SQL_"):
+            continue
+        if isinstance(valor, str):
+            _nombres[valor] = nombre
+        elif isinstance(valor, dict):
+            for clave, sentencia in valor.items():
+                if isinstance(sentencia, str):
+                    _nombres[sentencia] = f"{nombre}[{clave}]"
+
+
+def nombre_sentencia(sql):
+    """
+    Devuelve el nombre registrado de una sentencia o, si no lo tiene, su comienzo.
+    :param sql: La sentencia (str o psycopg2.sql.Composable)
+    :return: El nombre
+    """
+    nombre = _nombres.get(sql) if isinstance(sql, str) else None
+    if nombre is None:
+        texto = sql if isinstance(sql, str) else type(sql).__name__
+        nombre = re.sub(r"\s+", " ", texto).strip()[:60]
+    return nombre
+
+
+# ------------------------------------------------------------
+# Estadisticas
+
+@dataclass
+class EstadisticasSentencia:
+    """Ejecuciones, tiempo total y maximo (en segundos), filas y ejecuciones lentas de una sentencia."""
+    ejecuciones: int = 0
+    segundos: float = 0.0
+    maximo: float = 0.0
+    filas: int = 0
+    lentas: int = 0
+
+
+_estadisticas = {}
+_cerrojo = threading.Lock()
+
+
+def _registrar(nombre, nivel, duracion, filas):
+    """Suma una ejecucion a las estadisticas de la sentencia."""
+    with _cerrojo:
+        estadisticas = _estadisticas.setdefault((nombre, nivel), EstadisticasSentencia())
+        estadisticas.ejecuciones += 1
+        estadisticas.segundos += duracion
+        estadisticas.maximo = max(estadisticas.maximo, duracion)
+        estadisticas.filas += max(filas, 0)
+        if 0 <= UMBRAL_LENTAS <= duracion:
+            estadisticas.lentas += 1
+
+
+def estadisticas_sentencias() -> dict[tuple[str, str], EstadisticasSentencia]:
+    """
+    Devuelve una copia de las estadisticas, por nombre de sentencia y nivel de aislamiento.
+    :return: Diccionario con las estadisticas de cada sentencia
+    """
+    with _cerrojo:
+        return {clave: EstadisticasSentencia(**asdict(valor)) for clave, valor in _estadisticas.items()}
+
+
+def reiniciar_estadisticas_sentencias() -> None:
+    """
+    Borra las estadisticas de todas las sentencias.
+    :return: None
+    """
+    with _cerrojo:
+        _estadisticas.clear()
+
+
+def volcar_estadisticas(destino=None) -> None:
+    """
+    Vuelca las estadisticas de las sentencias, ordenadas por tiempo total.
+    :param destino: '-' para la salida estandar, una ruta para un fichero JSON, o None para tomarlo de
+                    BIBLIOTECA_ESTADISTICAS (si no esta definida, no se vuelca nada)
+    :return: None
+    """
+    destino = destino if destino is not None else os.environ.get("BIBLIOTECA_ESTADISTICAS")
+    if not destino:
+        return
+
+    filas = sorted(estadisticas_sentencias().items(), key=lambda item: item[1].segundos, reverse=True)
+    if destino == "-":
+        print(f"\n{'Sentencia':<45} {'Nivel':<15} {'Ejec.':>7} {'Total ms':>10} {'Media ms':>9} {'Max ms':>9} {'Filas':>9} {'Lentas':>6}")
+        for (nombre, nivel), e in filas:
+            print(f"{nombre[:45]:<45} {nivel:<15} {e.ejecuciones:>7} {e.segundos * 1000:>10.1f} "
+                  f"{e.segundos * 1000 / e.ejecuciones:>9.2f} {e.maximo * 1000:>9.2f} {e.filas:>9} {e.lentas:>6}")
+    else:
+        with open(destino, "w", encoding="utf-8") as fichero:
+            json.dump([{'sentencia': nombre, 'nivel': nivel, **asdict(e)} for (nombre, nivel), e in filas],
+                      fichero, indent=2)
+
+
+# ------------------------------------------------------------
+# Cursor
+
+class CursorInstrumentado(psycopg2.extras.DictCursor):
+    """
+    DictCursor que mide cada execute y copy_expert. En los cursores con nombre (del servidor) las filas se
+    leen despues de execute, asi que la medida va desde execute hasta close e incluye las lecturas, y las
+    filas se cuentan segun se leen.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._medida = None
+        self._leidas = 0
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            if self.name is None:
+                self._terminar(query, vars, inicio, self.rowcount)
+            else:
+                self._medida = (query, vars, inicio)
+                self._leidas = 0
+
+    def copy_expert(self, sql, file, size=8192):
+        inicio = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._terminar(sql, None, inicio, self.rowcount)
+
+    def fetchone(self):
+        fila = super().fetchone()
+        if fila is not None:
+            self._leidas += 1
+        return fila
+
+    def fetchmany(self, size=None):
+        filas = super().fetchmany(size)
+        self._leidas += len(filas)
+        return filas
+
+    def fetchall(self):
+        filas = super().fetchall()
+        self._leidas += len(filas)
+        return filas
+
+    def __iter__(self):
+        for fila in super().__iter__():
+            self._leidas += 1
+            yield fila
+
+    def close(self):
+        if self._medida is not None and not self.closed:
+            query, vars, inicio = self._medida
+            self._medida = None
+            self._terminar(query, vars, inicio, self._leidas)
+        super().close()
+
+    def _terminar(self, query, vars, inicio, filas):
+        duracion = time.perf_counter() - inicio
+        nombre = nombre_sentencia(query)
+        nivel = NIVELES.get(self.connection.isolation_level, str(self.connection.isolation_level))
+        _registrar(nombre, nivel, duracion, filas)
+
+        if 0 <= UMBRAL_LENTAS <= duracion:
+            _configurar_log()
+            mensaje = f"{duracion * 1000:.1f} ms {nombre} [{nivel}] filas={filas}"
+            if EXPLAIN_LENTAS and isinstance(query, str) and query.lstrip().upper().startswith("SELECT"):
+                mensaje += "\n" + self._explicar(query, vars)
+            _log_lentas.info(mensaje)
+
+    def _explicar(self, query, vars):
+        """
+        Plan de ejecucion de una consulta con EXPLAIN (ANALYZE, BUFFERS), que la vuelve a ejecutar en la
+        misma transaccion. Si falla, la transaccion vuelve al estado anterior gracias a un SAVEPOINT.
+        """
+        if self.connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            return "    (sin plan: no hay una transaccion abierta)"
+        with self.connection.cursor() as cur:
+            try:
+                cur.execute("SAVEPOINT explicar")
+                cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + self.mogrify(query, vars))
+                plan = "\n".join("    " + fila[0] for fila in cur.fetchall())
+                cur.execute("RELEASE SAVEPOINT explicar")
+                return plan
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT explicar")
+                return f"    (sin plan: {str(e).strip()})"
@@ -1,12 +1,12 @@
 import sys
+from datetime import datetime
+
 import psycopg2
-import psycopg2.extensions
-import psycopg2.extras
-import psycopg2.errorcodes
-from psycopg2.errorcodes import SERIALIZATION_FAILURE
 
+import conexion
+import instrumentacion
+import repositorio
 
-def print_generic_error(e): print(f"\nError: {getattr(e, 'pgcode', 'Unknown')} - {getattr(e, 'pgerror', 'Unknown error')}")
 
 def press_enter_to_continue(): input("\nPresione enter para continuar...")
 
@@ -29,45 +29,97 @@ def get_parsed(prompt, datatype):
 
 
 def connect_db():
-     """
-     Establece una conexion con la base de datos predeterminada del usuario (usando DNS vacio).
-     :return: La conexion establecida con la base de datos. Si no se puede establecer, el programa termina.
-     """
-     try:
-        conn = psycopg2.connect(host='localhost', user='postgres', password='1234', dbname='biblioteca')
-        conn.autocommit = False
-        return conn
-     except psycopg2.Error:
-         print("Error de conexion")
-         sys.exit(1)
-         
-         
-def disconnect_db(conn):
-    """
-    Cierra la conexion con la base de datos, realizando antes un commit de la transaccion activa.
-    :param conn: La conexion activa con la base de datos
-    :return: None
+    """
+    Crea el pool de conexiones con la base de datos (ver conexion.py para su configuracion por entorno).
+    :return: El pool de conexiones. Si no se puede establecer la conexion, el programa termina.
     """
     try:
-        conn.commit()
+        return conexion.PoolBiblioteca()
     except psycopg2.Error:
-        conn.rollback()
-    finally:
-        conn.close()
-    
-# 1
-def anadir_libro(conn):
+        print("Error de conexion")
+        sys.exit(1)
+
+
+def disconnect_db(pool):
     """
-    Anade un nuevo libro a la biblioteca solicitando al usuario todos los datos necesarios.
-    :param conn: La conexion activa con la base de datos
+    Cierra todas las conexiones del pool. Las transacciones se confirman o deshacen al terminar cada operacion.
+    :param pool: El pool de conexiones con la base de datos
+    :return: None
+    """
+    pool.closeall()
+
+
+def ejecutar(pool, operacion, *args):
+    """
+    Ejecuta una operacion de repositorio con una conexion del pool.
+    :param pool: El pool de conexiones con la base de datos
+    :param operacion: La funcion de repositorio, que recibe la conexion y args
+    :return: Lo que devuelva la operacion
+    """
+    with pool.conexion() as conn:
+        return operacion(conn, *args)
+
+
+# Numero de filas por pagina en los listados (opcion 'p' del menu)
+TAMANO_PAGINA = 20
+
+def mostrar_paginado(pool, leer_pagina, mostrar_fila):
+    """
+    Muestra un listado por paginas de TAMANO_PAGINA filas, preguntando al usuario si quiere ver la siguiente.
+    Cada pagina se lee con una conexion del pool, asi que no se retiene ninguna mientras el usuario lee.
+    :param pool: El pool de conexiones con la base de datos
+    :param leer_pagina: Funcion de repositorio que recibe la conexion, el tamano y la clave 'despues' y devuelve una Pagina
+    :param mostrar_fila: Funcion que imprime una fila
+    :return: El numero total de filas mostradas
+    """
+    despues = None
+    total = 0
+
+    while True:
+        pagina = ejecutar(pool, leer_pagina, TAMANO_PAGINA, despues)
+
+        for fila in pagina.filas:
+            mostrar_fila(fila)
+        total += len(pagina.filas)
+
+        if pagina.siguiente is None or input("\n[s] Siguiente pagina / [enter] Terminar: ").strip().lower() != "s":
+            return total
+        despues = pagina.siguiente
+
+
+def cambiar_tamano_pagina():
+    """
+    Cambia el numero de filas por pagina de los listados.
     :return: None
     """
+    global TAMANO_PAGINA
+
+    ptitle("Cambiar tamano de pagina")
+
+    try:
+        tamano = get_parsed(f"Filas por pagina (actual: {TAMANO_PAGINA}): ", int)
+    except ValueError:
+        perror("El tamano de pagina debe ser un numero entero.")
+        press_enter_to_continue()
+        return
 
-    sql_sentence = """
-        INSERT INTO 
-            libro (titulo, autor, aniopublicacion, isbn, sinopsis, idcategoria)
-        VALUES
-            (%(t)s, %(a)s, %(ap)s, %(i)s, %(s)s, %(ic)s)
+    if tamano is None:
+        return
+    if tamano <= 0:
+        perror("El tamano de pagina debe ser mayor que cero.")
+        press_enter_to_continue()
+        return
+
+    TAMANO_PAGINA = tamano
+    pmessage(f"Tamano de pagina cambiado a {TAMANO_PAGINA}.")
+    press_enter_to_continue()
+
+# 1
+def anadir_libro(pool):
+    """
+    Anade un nuevo libro a la biblioteca solicitando al usuario todos los datos necesarios.
+    :param pool: El pool de conexiones con la base de datos
+    :return: None
     """
 
     ptitle("Anadir libro")
@@ -90,95 +142,44 @@ def anadir_libro(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
-        try:
-            cur.execute(sql_sentence, {
-                't': titulo,
-                'a': autor,
-                'ap': anio_publicacion,
-                'i': isbn,
-                's': sinopsis,
-                'ic': id_categoria
-            })
-            
-            conn.commit()
-            pmessage("Libro anadido correctamente.")
-            press_enter_to_continue()
-            
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION:
-                perror("El ISBN ya existe en otro libro.")
-            elif e.pgcode == psycopg2.errorcodes.FOREIGN_KEY_VIOLATION:
-                perror("La categoria especificada no existe.")
-            elif e.pgcode == psycopg2.errorcodes.NOT_NULL_VIOLATION:
-                perror("El titulo es obligatorio.")
-            elif e.pgcode == psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION:
-                if e.diag.column_name == "titulo":
-                    perror("El titulo es demasiado largo.")
-                elif e.diag.column_name == "autor":
-                    perror("El nombre de autor es demasiado largo.")
-                elif e.diag.column_name == "isbn":
-                    perror("El ISBN es demasiado largo.")
-                elif e.diag.column_name == "sinopsis":
-                    perror("La sinopsis es demasiado larga.")
-            else:
-                print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        id_libro = ejecutar(pool, repositorio.anadir_libro, repositorio.LibroNuevo(
+            titulo=titulo,
+            autor=autor,
+            aniopublicacion=anio_publicacion,
+            isbn=isbn,
+            sinopsis=sinopsis,
+            idcategoria=id_categoria
+        ))
+        pmessage(f"Libro anadido correctamente con id {id_libro}.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
-            
 # 2
-def buscar_libros(conn):
+def buscar_libros(pool):
     """
     Realiza una busqueda de libros en la biblioteca segun los criterios especificados por el usuario.
-    :param conn: La conexion activa con la base de datos
+    Permite elegir el modo de busqueda por titulo y autor (ver repositorio.MODOS_BUSQUEDA).
+    :param pool: El pool de conexiones con la base de datos
     :return: None
     """
 
-    sql_sentence = """
-        SELECT 
-            l.id,
-            l.titulo,
-            l.autor,
-            l.aniopublicacion,
-            l.isbn,
-            c.nombre AS nombrecategoria,
-            (
-                SELECT precio
-                FROM preciolibro
-                WHERE idlibro = l.id
-                ORDER BY fecha DESC
-                limit 1 
-            ) AS precioactual,
-            NOT EXISTS (
-                SELECT 1
-                FROM prestamo p
-                WHERE p.idlibro = l.id 
-                AND p.fechadevolucion IS NULL
-            ) AS disponible
-        FROM
-            libro l
-        LEFT JOIN
-            categoria c ON l.idcategoria = c.id
-        WHERE
-            (%(t)s IS NULL
-            OR l.titulo ilike %(t)s)
-            AND (%(a)s IS NULL
-            OR l.autor ilike %(a)s)
-            AND (%(ap)s IS NULL
-            OR l.aniopublicacion = %(ap)s)
-            AND (%(i)s IS NULL
-            OR l.isbn ilike %(i)s)
-            AND (%(ic)s IS NULL
-            OR l.idcategoria = %(ic)s) 
-    """
-
     ptitle("Buscar libros")
     pmessage("Los campos en blanco son ignorados\n")
 
-    titulo = get_string("Titulo: ")
-    autor = get_string("Autor: ")
+    modo = input("Modo de busqueda ([e]xacta, [p]refijo, [d]ifusa, [t]exto completo; enter: exacta): ").strip().lower() or 'e'
+    if modo not in repositorio.MODOS_BUSQUEDA:
+        perror("Modo de busqueda no valido.")
+        press_enter_to_continue()
+        return
+
+    if modo == 't':
+        titulo = get_string("Texto (titulo, autor o sinopsis): ")
+        autor = None
+    else:
+        titulo = get_string("Titulo: ")
+        autor = get_string("Autor: ")
     try:
         anio_publicacion = get_parsed("Anio de publicacion: ", int)
     except ValueError:
@@ -187,87 +188,51 @@ def buscar_libros(conn):
         return
     isbn = get_string("ISBN: ")
     try:
-        id_categoria = get_string("Id de categoria: ")
+        id_categoria = get_parsed("Id de categoria: ", int)
     except ValueError:
         perror("El id de categoria debe ser un numero entero.")
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        try:
-            cur.execute(sql_sentence,{
-                't': titulo,
-                'a': autor,
-                'ap': anio_publicacion,
-                'i': isbn,
-                'ic': id_categoria
-            })
-            
-            libros = cur.fetchall()
-            
-            if len(libros) == 0:
-                pmessage("No se han encontrado libros.")
-                press_enter_to_continue()
-                return
-            
-            pmessage(f"Se han encontrado {len(libros)} libros:")
-            
-            for libro in libros:
-                print(f"\nID: {libro['id']}")
-                print(f"Titulo: {libro['titulo']}")
-                print(f"Autor: {libro['autor']}")
-                print(f"Anio de publicacion: {libro['aniopublicacion']}")
-                print(f"ISBN: {libro['isbn']}")
-                print(f"Categoria: {libro['nombrecategoria']}")
-                print(f"Precio actual (€): {libro['precioactual'] if libro['precioactual'] is not None else 'Sin precio registrado'}")
-                print(f"Disponibilidad: {'Disponible' if libro['disponible'] else 'No disponible'}")
+    filtros = repositorio.FiltrosLibro(
+        modo=modo,
+        titulo=titulo,
+        autor=autor,
+        aniopublicacion=anio_publicacion,
+        isbn=isbn,
+        idcategoria=id_categoria
+    )
+
+    def mostrar_libro(libro):
+        print(f"\nID: {libro.id}")
+        print(f"Titulo: {libro.titulo}")
+        print(f"Autor: {libro.autor}")
+        print(f"Anio de publicacion: {libro.aniopublicacion}")
+        print(f"ISBN: {libro.isbn}")
+        print(f"Categoria: {libro.nombrecategoria}")
+        print(f"Precio actual (€): {libro.precioactual if libro.precioactual is not None else 'Sin precio registrado'}")
+        print(f"Disponibilidad: {'Disponible' if libro.disponible else 'No disponible'}")
 
-            press_enter_to_continue()
+    try:
+        total = mostrar_paginado(pool, lambda conn, n, despues: repositorio.buscar_libros(conn, filtros, n, despues),
+                                 mostrar_libro)
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+        if total == 0:
+            pmessage("No se han encontrado libros.")
+        else:
+            pmessage(f"Se han mostrado {total} libros.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 3
-def consultar_libro(conn):
+def consultar_libro(pool):
     """
     Muestra toda la informacion disponible de un libro especifico segun su ID.
-    :param conn: La conexion activa con la base de datos
+    :param pool: El pool de conexiones con la base de datos
     :return: None
     """
 
-    sql_sentence = """
-        SELECT 
-            l.titulo,
-            l.autor,
-            l.aniopublicacion,
-            l.isbn,
-            l.sinopsis,
-            l.idcategoria,
-            c.nombre AS nombrecategoria,
-            (
-                SELECT precio
-                FROM preciolibro
-                WHERE idlibro = l.id
-                ORDER BY fecha DESC
-                limit 1 
-            ) AS precioactual,
-            NOT EXISTS (
-                SELECT 1
-                FROM prestamo p
-                WHERE p.idlibro = l.id
-                AND p.fechadevolucion IS NULL
-            ) AS disponible
-        FROM
-            libro l
-        LEFT JOIN
-            categoria c ON l.idcategoria = c.id
-        WHERE
-            l.id = %(i)s
-    """
-
     ptitle("Consultar libro")
 
     try:
@@ -277,107 +242,31 @@ def consultar_libro(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_libro
-            })
-            
-            libro = cur.fetchone()
-            
-            if libro is None:
-                perror("No se ha encontrado el libro.")
-                press_enter_to_continue()
-                return
-            
-            print(f"\nId: {id_libro}")
-            print(f"Titulo: {libro['titulo']}")
-            print(f"Autor: {libro['autor']}")
-            print(f"Anio de publicacion: {libro['aniopublicacion']}")
-            print(f"ISBN: {libro['isbn']}")
-            print(f"Sinopsis: {libro['sinopsis']}")
-            print(f"Id de categoria: {libro['idcategoria']}")
-            print(f"Categoria: {libro['nombrecategoria']}")
-            print(f"Precio actual (€): {libro['precioactual'] if libro['precioactual'] is not None else 'Sin precio registrado'}")
-            print(f"Disponibilidad: {'Disponible' if libro['disponible'] else 'No disponible'}")
-
-            press_enter_to_continue()
-        
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        libro = ejecutar(pool, repositorio.consultar_libro, id_libro)
+
+        print(f"\nId: {libro.id}")
+        print(f"Titulo: {libro.titulo}")
+        print(f"Autor: {libro.autor}")
+        print(f"Anio de publicacion: {libro.aniopublicacion}")
+        print(f"ISBN: {libro.isbn}")
+        print(f"Sinopsis: {libro.sinopsis}")
+        print(f"Id de categoria: {libro.idcategoria}")
+        print(f"Categoria: {libro.nombrecategoria}")
+        print(f"Precio actual (€): {libro.precioactual if libro.precioactual is not None else 'Sin precio registrado'}")
+        print(f"Disponibilidad: {'Disponible' if libro.disponible else 'No disponible'}")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 4
-def modificar_libro(conn):
+def modificar_libro(pool):
     """
     Permite actualizar la informacion de un libro existente en la biblioteca.
-    :param conn: La conexion activa con la base de datos
+    :param pool: El pool de conexiones con la base de datos
     :return: None
     """
 
-    sql_update_titulo = """
-        UPDATE
-            libro
-        SET 
-            titulo = %(t)s
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_autor = """
-        UPDATE
-            libro
-        SET 
-            autor = %(a)s
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_anio_publicacion = """
-        UPDATE
-            libro
-        SET     
-            aniopublicacion = %(ap)s
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_isbn = """
-        UPDATE
-            libro
-        SET 
-            isbn = %(isbn)s
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_sinopsis = """
-        UPDATE
-            libro
-        SET
-            sinopsis = %(s)s
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_categoria = """
-        UPDATE
-            libro
-        SET 
-            idcategoria = %(ic)s
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_precio = """
-        INSERT INTO 
-            preciolibro (idlibro, precio)
-        VALUES 
-            (%(i)s, %(p)s) 
-    """
-
     ptitle("Modificar libro")
     pmessage("Los campos en blanco son ignorados\n")
 
@@ -388,130 +277,68 @@ def modificar_libro(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
-    with conn.cursor() as cur:
+    # Los cambios se aplican sobre la version leida: si otro usuario modifica el libro mientras tanto,
+    # no se sobrescriben sus cambios
+    try:
+        libro = ejecutar(pool, repositorio.consultar_libro, id_libro)
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+        press_enter_to_continue()
+        return
+    pmessage(f"Libro: {libro.titulo}\n")
+
+    cambios = {}
+    if input("Modificar titulo? (s/n): ").strip().lower() == "s":
+        cambios['titulo'] = get_string("Nuevo titulo: ")
+
+    if input("Modificar autor? (s/n): ").strip().lower() == "s":
+        cambios['autor'] = get_string("Nuevo autor: ")
+
+    if input("Modificar anio de publicacion? (s/n):").strip().lower() == "s":
         try:
-            if input("Modificar titulo? (s/n): ").strip().lower() == "s":
-                titulo = get_string("Nuevo titulo: ")
-
-                cur.execute(sql_update_titulo, {
-                    't': titulo,
-                    'i': id_libro
-                })
-
-            if input("Modificar autor? (s/n): ").strip().lower() == "s":
-                autor = get_string("Nuevo autor: ")
-
-                cur.execute(sql_update_autor, {
-                    'a': autor,
-                    'i': id_libro
-                })
-
-            if input("Modificar anio de publicacion? (s/n):").strip().lower() == "s":
-                try:
-                    anio_publicacion = get_parsed("Nuevo anio de publicacion: ", int)
-                except ValueError:
-                    perror("El anio de publicacion debe ser un numero entero.")
-                    press_enter_to_continue()
-                    return
-
-                cur.execute(sql_update_anio_publicacion, {
-                    'ap': anio_publicacion,
-                    'i': id_libro
-                })
-
-            if input("Modificar ISBN? (s/n): ").strip().lower() == "s":
-                isbn = get_string("Nuevo ISBN: ")
-
-                cur.execute(sql_update_isbn, {
-                    'isbn': isbn,
-                    'i': id_libro
-                })
-
-            if input("Modificar sinopsis? (s/n): ").strip().lower() == "s":
-                sinopsis = get_string("Nueva sinopsis: ")
-
-                cur.execute(sql_update_sinopsis, {
-                    's': sinopsis,
-                    'i': id_libro
-                })
-
-            if input("Modificar categoria? (s/n): ").strip().lower() == "s":
-                try:
-                    id_categoria = get_parsed("Nuevo id de categoria: ", int)
-                except ValueError:
-                    perror("El id de categoria debe ser un numero entero.")
-                    press_enter_to_continue()
-                    return
-
-                cur.execute(sql_update_categoria, {
-                    'ic': id_categoria,
-                    'i': id_libro
-                })
-
-            if input("Modificar precio? (s/n): ").strip().lower() == "s":
-                try:
-                    precio = get_parsed("Nuevo precio (€): ", float)
-                except ValueError:
-                    perror("El precio debe ser un numero real.")
-                    press_enter_to_continue()
-                    return
-
-                cur.execute(sql_update_precio, {
-                    'i': id_libro,
-                    'p': precio
-                })
-
-            conn.commit()
+            cambios['aniopublicacion'] = get_parsed("Nuevo anio de publicacion: ", int)
+        except ValueError:
+            perror("El anio de publicacion debe ser un numero entero.")
             press_enter_to_continue()
+            return
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.NOT_NULL_VIOLATION:
-                perror("El titulo no puede ser nulo.")
-            elif e.pgcode == psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION:
-                if e.diag.column_name == "titulo":
-                    perror("El titulo es demasiado largo.")
-                elif e.diag.column_name == "autor":
-                    perror("El nombre de autor es demasiado largo.")
-                elif e.diag.column_name == "isbn":
-                    perror("El ISBN es demasiado largo.")
-                elif e.diag.column_name == "sinopsis":
-                    perror("La sinopsis es demasiado larga.")
-            elif e.pgcode == psycopg2.errorcodes.FOREIGN_KEY_VIOLATION:
-                if e.diag.column_name == "idcategoria":
-                    perror("La categoria especificada no existe.")
-                elif e.diag.column_name == "idlibro":
-                    perror("El libro especificado no existe.")
-            elif e.pgcode == psycopg2.errorcodes.NUMERIC_VALUE_OUT_OF_RANGE:
-                perror("El precio es demasiado alto.")
-            elif e.pgcode == psycopg2.errorcodes.SERIALIZATION_FAILURE:
-                perror("Otro usuario ha modificado el libro mientras editabas.")
-                if input("Volver a intentarlo? (s/n): ").strip().lower() == "s":
-                    modificar_libro(conn)
-                    return
-                else:
-                    pmessage("No se pudo modificar el libro.")
-            else:
-                print_generic_error(e)
+    if input("Modificar ISBN? (s/n): ").strip().lower() == "s":
+        cambios['isbn'] = get_string("Nuevo ISBN: ")
+
+    if input("Modificar sinopsis? (s/n): ").strip().lower() == "s":
+        cambios['sinopsis'] = get_string("Nueva sinopsis: ")
+
+    if input("Modificar categoria? (s/n): ").strip().lower() == "s":
+        try:
+            cambios['idcategoria'] = get_parsed("Nuevo id de categoria: ", int)
+        except ValueError:
+            perror("El id de categoria debe ser un numero entero.")
+            press_enter_to_continue()
+            return
+
+    if input("Modificar precio? (s/n): ").strip().lower() == "s":
+        try:
+            cambios['precio'] = get_parsed("Nuevo precio (€): ", float)
+        except ValueError:
+            perror("El precio debe ser un numero real.")
             press_enter_to_continue()
+            return
+
+    try:
+        ejecutar(pool, repositorio.modificar_libro, id_libro, cambios, libro.version)
+        pmessage("Libro modificado correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 5
-def eliminar_libro(conn):
+def eliminar_libro(pool):
     """
     Elimina permanentemente un libro de la biblioteca segun su ID.
-    :param conn: La conexion activa con la base de datos
+    :param pool: El pool de conexiones con la base de datos
     :return: None
     """
 
-    sql_sentence = """
-        DELETE
-        FROM 
-            libro
-        WHERE 
-            id = %(i)s
-    """
-
     ptitle("Eliminar libro")
 
     try:
@@ -521,60 +348,27 @@ def eliminar_libro(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_libro
-            })
-
-            if cur.rowcount == 0:
-                conn.rollback()
-                perror("El libro con id {id_libro} no existe.")
-            else:
-                conn.commit()
-                pmessage("Libro eliminado correctamente.")
-
-            press_enter_to_continue()
-            
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        ejecutar(pool, repositorio.eliminar_libro, id_libro)
+        pmessage("Libro eliminado correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 6
-def actualizar_precio(conn):
+def actualizar_precio(pool):
     """
     Actualiza el precio de un libro, permitiendo especificar un nuevo valor o aplicar un porcentaje de variacion.
-    :param conn: La conexion activa con la base de datos
+    :param pool: El pool de conexiones con la base de datos
     :return: None
     """
 
-    sql_aumento_manual = """
-        INSERT INTO
-            preciolibro (idlibro, precio)
-        VALUES  
-            (%(i)s, %(p)s)
-    """
-
-    sql_aumento_porcentaje = """
-        INSERT INTO 
-            preciolibro (idlibro, precio)
-        SELECT 
-            %(i)s,
-            precio * (1 + %(p)s / 100.0)
-        FROM 
-            preciolibro
-        WHERE 
-            idlibro = %(i)s
-        ORDER BY 
-            fecha DESC 
-        limit 
-            1
-    """
-
     ptitle("Actualizar precio de libro")
 
+    if input("Actualizar [u]n libro o [v]arios libros? (enter: uno): ").strip().lower() == 'v':
+        revalorizar_precios(pool)
+        return
+
     try:
         id_libro = get_parsed("Id del libro: ", int)
     except ValueError:
@@ -582,73 +376,111 @@ def actualizar_precio(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
+    precio = porcentaje = None
+    if input("Aumentar precio con porcentaje? (s/n): ").lower() == "s":
         try:
-            if input("Aumentar precio con porcentaje? (s/n): ").lower() == "s":
-                try:
-                    porcentaje = get_parsed("Porcentaje de aumento/descuento (usar negativo para descuento): ", float)
-                except ValueError:
-                    perror("El porcentaje debe ser un numero real.")
-                    press_enter_to_continue()
-                    return
-
-                cur.execute(sql_aumento_porcentaje, {
-                    'i': id_libro,
-                    'p': porcentaje
-                })
-
-            else:
-                try:
-                    precio = get_parsed("Nuevo precio (€): ", float)
-                except ValueError:
-                    perror("El precio debe ser un numero real.")
-                    press_enter_to_continue()
-                    return
-
-                cur.execute(sql_aumento_manual, {
-                    'i': id_libro,
-                    'p': precio
-                })
-
-            conn.commit()
-            pmessage("Precio actualizado correctamente.")
+            porcentaje = get_parsed("Porcentaje de aumento/descuento (usar negativo para descuento): ", float)
+        except ValueError:
+            perror("El porcentaje debe ser un numero real.")
+            press_enter_to_continue()
+            return
+        if porcentaje is None:
+            perror("El porcentaje no puede ser nulo.")
             press_enter_to_continue()
+            return
+    else:
+        try:
+            precio = get_parsed("Nuevo precio (€): ", float)
+        except ValueError:
+            perror("El precio debe ser un numero real.")
+            press_enter_to_continue()
+            return
+        if precio is None:
+            perror("El precio no puede ser nulo.")
+            press_enter_to_continue()
+            return
+
+    try:
+        nuevo_precio = ejecutar(pool, repositorio.actualizar_precio, id_libro, precio, porcentaje)
+        pmessage(f"Precio actualizado correctamente a {nuevo_precio:.2f} €.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.NOT_NULL_VIOLATION:
-                perror("El precio no puede ser nulo.")
-            elif e.pgcode == psycopg2.errorcodes.NUMERIC_VALUE_OUT_OF_RANGE:
-                perror("El precio es demasiado alto.")
-            elif e.pgcode == psycopg2.errorcodes.FOREIGN_KEY_VIOLATION:
-                perror("El libro especificado no existe.")
-            elif e.pgcode == psycopg2.errorcodes.CHECK_VIOLATION:
-                perror("El precio debe ser un numero entero positivo.")
+def revalorizar_precios(pool):
+    """
+    Actualiza el precio de todos los libros de una categoria, autor, rango de anios o lista de ids. Muestra
+    antes el resumen de los cambios y pide confirmacion.
+    :param pool: El pool de conexiones con la base de datos
+    :return: None
+    """
+    pmessage("Los filtros en blanco se ignoran (al menos uno es obligatorio)\n")
+
+    try:
+        id_categoria = get_parsed("Id de la categoria: ", int)
+        autor = get_string("Autor: ")
+        anio_desde = get_parsed("Desde el anio de publicacion: ", int)
+        anio_hasta = get_parsed("Hasta el anio de publicacion: ", int)
+        ids = get_string("Ids de los libros (separados por comas): ")
+        ids = [int(i) for i in ids.split(",")] if ids else None
+    except ValueError:
+        perror("La categoria, los anios y los ids deben ser numeros enteros.")
+        press_enter_to_continue()
+        return
+    filtros = repositorio.FiltrosRevalorizacion(id_categoria, autor, anio_desde, anio_hasta, ids)
+
+    precio = porcentaje = None
+    try:
+        if input("Aumentar precio con porcentaje? (s/n): ").lower() == "s":
+            porcentaje = get_parsed("Porcentaje de aumento/descuento (usar negativo para descuento): ", float)
+        else:
+            precio = get_parsed("Nuevo precio (€): ", float)
+    except ValueError:
+        perror("El precio y el porcentaje deben ser numeros reales.")
+        press_enter_to_continue()
+        return
+
+    try:
+        resumen = ejecutar(pool, repositorio.revalorizar_precios, filtros, precio, porcentaje, True)
+        mostrar_resumen_revalorizacion(resumen)
+        if resumen.libros == 0 or input("\nAplicar los cambios? (s/n): ").strip().lower() != "s":
             press_enter_to_continue()
+            return
+        resumen = ejecutar(pool, repositorio.revalorizar_precios, filtros, precio, porcentaje)
+        mostrar_resumen_revalorizacion(resumen)
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
+
+def mostrar_resumen_revalorizacion(resumen):
+    """
+    Muestra el resumen (o la prevision) de una revalorizacion de precios.
+    :param resumen: El ResumenRevalorizacion
+    :return: Nada
+    """
+    if resumen.simulacion:
+        pmessage(f"Se actualizara el precio de {resumen.libros} libros.")
+    else:
+        pmessage(f"Precio actualizado correctamente en {resumen.libros} libros.")
+    if resumen.sinprecio:
+        print(f"{resumen.sinprecio} libros no tienen precio y no cambian.")
+    if resumen.libros:
+        print(f"Suma de precios: {resumen.totalanterior or 0:.2f} € -> {resumen.totalnuevo:.2f} €")
 
 # 7
-def ver_historial_precios(conn):
+def ver_historial_precios(pool):
     """
     Muestra un listado cronologico de todos los precios que ha tenido un libro especifico.
-    :param conn: La conexion activa con la base de datos
+    :param pool: El pool de conexiones con la base de datos
     :return: None
     """
 
-    sql_sentence = """
-        SELECT 
-            precio,
-            fecha
-        FROM 
-            preciolibro
-        WHERE 
-            idlibro = %(i)s
-        ORDER BY
-            fecha DESC
-    """
-
     ptitle("Ver historial de precios de libro")
 
+    if input("Ver el [h]istorial o el precio en una [f]echa? (enter: historial): ").strip().lower() == 'f':
+        ver_precios_en_fecha(pool)
+        return
+
     try:
         id_libro = get_parsed("Id del libro: ", int)
     except ValueError:
@@ -656,106 +488,82 @@ def ver_historial_precios(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_libro,
-            })
-
-            precios = cur.fetchall()
-
-            if not precios:
-                perror("El libro no tiene un precio registrado.")
-                return
+    try:
+        print()
+        total = mostrar_paginado(pool, lambda conn, n, despues: repositorio.historial_precios(conn, id_libro, n, despues),
+                                 lambda precio: print(f"{precio.fecha.date()} -> {precio.precio:.2f} €"))
 
-            print()
-            for precio in precios:
-                print(f"{precio['fecha'].date()} -> {precio['precio']:.2f} €")
+        if total == 0:
+            perror("El libro no tiene un precio registrado.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
-            press_enter_to_continue()
+def ver_precios_en_fecha(pool):
+    """
+    Muestra el precio que tenian uno o varios libros en una fecha. Pide al usuario los ids y la fecha.
+    :param pool: El pool de conexiones con la base de datos
+    :return: None
+    """
+    try:
+        ids = [int(i) for i in input("Ids de los libros (separados por comas): ").split(",")]
+    except ValueError:
+        perror("Los ids de los libros deben ser numeros enteros.")
+        press_enter_to_continue()
+        return
+    try:
+        fecha = datetime.strptime(input("Fecha (AAAA-MM-DD): ").strip(), "%Y-%m-%d").date()
+    except ValueError:
+        perror("La fecha debe tener el formato AAAA-MM-DD.")
+        press_enter_to_continue()
+        return
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
+    try:
+        print()
+        for precio in ejecutar(pool, repositorio.precios_en_fecha, [(id_libro, fecha) for id_libro in ids]):
+            if precio.precio is None:
+                print(f"Libro {precio.idlibro}: sin precio en esa fecha")
+            else:
+                print(f"Libro {precio.idlibro}: {precio.precio:.2f} € (desde {precio.desde.date()})")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 8
-def anadir_categoria(conn):
+def anadir_categoria(pool):
     """
     Anade una categoria a la base de datos. Pide al usuario los datos necesarios.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        INSERT INTO
-            categoria (nombre, descripcion)
-        VALUES 
-            (%(n)s, %(d)s)
-    """
-
     ptitle("Anadir categoria")
     pmessage("*: Obligatorio\n")
 
     nombre = get_string("Nombre*: ")
     descripcion = get_string("Descripcion*: ")
+    try:
+        dias_prestamo = get_parsed(f"Dias de prestamo (enter: {repositorio.DIAS_PRESTAMO_POR_DEFECTO}): ", int)
+    except ValueError:
+        perror("Los dias de prestamo deben ser un numero entero.")
+        press_enter_to_continue()
+        return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'n': nombre,
-                'd': descripcion,
-            })
-
-            conn.commit()
-            pmessage("Categoria anadida correctamente.")
-            press_enter_to_continue()
-
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION:
-                perror("Una categoria con ese nombre ya existe.")
-            elif e.pgcode == psycopg2.errorcodes.NOT_NULL_VIOLATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre no puede ser nulo.")
-                elif e.diag.column_name == "descripcion":
-                    perror("La descripcion no puede ser nula.")
-            elif e.pgcode == psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre es demasiado largo.")
-                elif e.diag.column_name == "descripcion":
-                    perror("La descripcion es demasiado larga.")
-            else:
-                print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        id_categoria = ejecutar(pool, repositorio.anadir_categoria, nombre, descripcion, dias_prestamo)
+        pmessage(f"Categoria anadida correctamente con id {id_categoria}.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 9
-def modificar_categoria(conn):
+def modificar_categoria(pool):
     """
     Modifica los atributos de una categoria en la base de datos. Pide al usuario el id de la categoria y los atributos a modificar.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_update_nombre = """
-        UPDATE 
-            categoria 
-        SET 
-            nombre = %(n)s 
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_descripcion = """
-        UPDATE 
-            categoria  
-        SET 
-            descripcion = %(d)s 
-        WHERE 
-            id = %(i)s
-    """
-
     ptitle("Modificar categoria")
     pmessage("Los campos en blanco son ignorados\n")
 
@@ -766,67 +574,36 @@ def modificar_categoria(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
-    with conn.cursor() as cur:
-        try:
-            if input("Modificar nombre? (s/n): ").strip().lower() == "s":
-                nombre = get_string("Nuevo nombre: ")
-
-                cur.execute(sql_update_nombre, {
-                    'n': nombre,
-                    'i': id_categoria
-                })
+    cambios = {}
+    if input("Modificar nombre? (s/n): ").strip().lower() == "s":
+        cambios['nombre'] = get_string("Nuevo nombre: ")
 
-            if input("Modificar descripcion? (s/n): ").strip().lower() == "s":
-                descripcion = get_string("Nueva descripcion: ")
+    if input("Modificar descripcion? (s/n): ").strip().lower() == "s":
+        cambios['descripcion'] = get_string("Nueva descripcion: ")
 
-                cur.execute(sql_update_descripcion, {
-                    'd': descripcion,
-                    'i': id_categoria
-                })
-
-            conn.commit()
-            pmessage("Categoria modificada correctamente.")
+    if input("Modificar dias de prestamo? (s/n): ").strip().lower() == "s":
+        try:
+            cambios['diasprestamo'] = get_parsed("Nuevos dias de prestamo: ", int)
+        except ValueError:
+            perror("Los dias de prestamo deben ser un numero entero.")
             press_enter_to_continue()
+            return
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.NOT_NULL_VIOLATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre no puede ser nulo.")
-                elif e.diag.column_name == "descripcion":
-                    perror("La descripcion no puede ser nula.")
-            elif e.pgcode == psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre es demasiado largo.")
-                elif e.diag.column_name == "descripcion":
-                    perror("La descripcion es demasiado larga.")
-            elif e.pgcode == psycopg2.errorcodes.SERIALIZATION_FAILURE:
-                perror("Otro usuario ha modificado la categoria mientras editabas.")
-                if input("Volver a intentarlo? (s/n): ").strip().lower() == "s":
-                    modificar_categoria(conn)
-                    return
-                else:
-                    pmessage("No se pudo modificar la categoria.")
-            else:
-                print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        ejecutar(pool, repositorio.modificar_categoria, id_categoria, cambios)
+        pmessage("Categoria modificada correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 10
-def eliminar_categoria(conn):
+def eliminar_categoria(pool):
     """
     Elimina una categoria de la base de datos. Pide al usuario el id de la categoria.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        DELETE FROM
-            categoria 
-        WHERE
-            id = %(i)s
-    """
-
     ptitle("Eliminar categoria")
 
     try:
@@ -836,110 +613,102 @@ def eliminar_categoria(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_categoria
-            })
-
-            if cur.rowcount == 0:
-                conn.rollback()
-                pmessage(f"La categoria con id {id_categoria} no existe.")
-            else:
-                conn.commit()
-                pmessage("Categoria eliminada correctamente.")
-
-            press_enter_to_continue()
-
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        ejecutar(pool, repositorio.eliminar_categoria, id_categoria)
+        pmessage("Categoria eliminada correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 11
-def efectuar_prestamo(conn):
+def efectuar_prestamo(pool):
     """
     Anade un prestamo a la base de datos. Pide al usuario los datos necesarios.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        INSERT INTO 
-            prestamo (fechaprestamo, comentarios, idlibro, idestudiante)
-        VALUES 
-            (NOW(), %(c)s, %(il)s, %(ie)s)
-    """
-
     ptitle("Efectuar prestamo")
+
+    if input("Prestar [u]n libro o un [l]ote de libros? (enter: uno): ").strip().lower() == 'l':
+        efectuar_prestamos(pool)
+        return
+
     pmessage("*: Obligatorio\n")
 
     comentarios = get_string("Comentarios: ")
     try:
-        id_libro = get_parsed("Id del libro: ", int)
+        id_libro = get_parsed("Id del libro*: ", int)
     except ValueError:
         perror("El id del libro debe ser un numero entero.")
         press_enter_to_continue()
         return
     try:
-        id_estudiante = get_parsed("Id del estudiante: ", int)
+        id_estudiante = get_parsed("Id del estudiante*: ", int)
     except ValueError:
         perror("El id del estudiante debe ser un numero entero.")
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
+    try:
+        id_prestamo = ejecutar(pool, repositorio.efectuar_prestamo, id_libro, id_estudiante, comentarios)
+        pmessage(f"Prestamo efectuado correctamente con id {id_prestamo}.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
+
+def mostrar_resultados_lote(resultados, hecho):
+    """
+    Muestra el resultado de un prestamo o una devolucion en lote: los elementos no procesados con su motivo
+    y el numero de elementos procesados.
+    :param resultados: Los ResultadoLote de la operacion
+    :param hecho: Participio para el mensaje final ('efectuados', 'finalizados')
+    :return: Nada
+    """
+    for resultado in resultados:
+        if resultado.motivo is not None:
+            elemento = (f"Prestamo {resultado.idprestamo}" if resultado.idprestamo is not None
+                        else f"Libro {resultado.idlibro}, estudiante {resultado.idestudiante}")
+            print(f"  {resultado.posicion}. {elemento}: {resultado.motivo}")
+    procesados = [r for r in resultados if r.motivo is None]
+    pmessage(f"{len(procesados)} de {len(resultados)} prestamos {hecho} correctamente.")
+
+
+def efectuar_prestamos(pool):
+    """
+    Presta varios libros en una sola operacion. Pide al usuario pares de id de libro e id de estudiante.
+    :param pool: El pool de conexiones a la BD
+    :return: Nada
+    """
+
+    comentarios = get_string("Comentarios (de todos los prestamos): ")
+    prestamos = []
+    while True:
+        linea = input("Id del libro e id del estudiante, separados por un espacio (o 'enter' para terminar): ").split()
+        if not linea:
+            break
         try:
-            cur.execute(sql_sentence, {
-                'c': comentarios,
-                'il': id_libro,
-                'ie': id_estudiante,
-            })
-
-            conn.commit()
-            pmessage("Prestamo efectuado correctamente.")
-            press_enter_to_continue()
+            id_libro, id_estudiante = map(int, linea)
+        except ValueError:
+            perror("Se deben indicar dos numeros enteros.")
+            continue
+        prestamos.append((id_libro, id_estudiante))
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.FOREIGN_KEY_VIOLATION:
-                if e.diag.column_name == "idlibro":
-                    perror("Libro especificado no existe.")
-                elif e.diag.column_name == "idestudiante":
-                    perror("Estudiante especificado no existe.")
-            elif e.pgcode == psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION:
-                perror("El comentario es demasiado largo.")
-            else:
-                print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        resultados = ejecutar(pool, repositorio.efectuar_prestamos, prestamos, comentarios)
+        mostrar_resultados_lote(resultados, "efectuados")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 12
-def ver_historial_prestamos_libro(conn):
+def ver_historial_prestamos_libro(pool):
     """
     Muestra el historial de prestamos de un libro. Pide al usuario el id del libro.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        SELECT 
-            p.fechaprestamo, 
-            p.fechadevolucion, 
-            p.comentarios, 
-            p.idestudiante,
-            e.nombre AS nombreestudiante
-        FROM 
-            prestamo p
-        JOIN 
-            estudiante e ON e.id = p.idestudiante
-        WHERE   
-            p.idlibro = %(i)s
-        ORDER BY
-            p.fechaprestamo DESC
-    """
-
     ptitle("Ver historial de prestamos de libro")
 
     try:
@@ -949,59 +718,32 @@ def ver_historial_prestamos_libro(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_libro,
-            })
+    def mostrar_prestamo(prestamo):
+        print(f"\nFecha de prestamo: {prestamo.fechaprestamo.date()}")
+        print(f"Fecha limite: {prestamo.fechalimite.date()}")
+        print(f"Fecha de devolucion: {prestamo.fechadevolucion.date() if prestamo.fechadevolucion else 'No devuelto'}")
+        print(f"Comentarios: {prestamo.comentarios}")
+        print(f"Id del estudiante: {prestamo.idestudiante}")
+        print(f"Estudiante: {prestamo.nombreestudiante}")
 
-            prestamos = cur.fetchall()
-
-            if not prestamos:
-                perror("El libro no tiene prestamos registrados.")
-                press_enter_to_continue()
-                return
-
-            for prestamo in prestamos:
-                print(f"\nFecha de prestamo: {prestamo['fechaprestamo'].date()}")
-                print(f"Fecha de devolucion: {prestamo['fechadevolucion'].date() if prestamo['fechadevolucion'] else 'No devuelto'}")
-                print(f"Comentarios: {prestamo['comentarios']}")
-                print(f"Id del estudiante: {prestamo['idestudiante']}")
-                print(f"Estudiante: {prestamo['nombreestudiante']}")
-
-            press_enter_to_continue()
+    try:
+        total = mostrar_paginado(pool, lambda conn, n, despues: repositorio.historial_prestamos_libro(conn, id_libro, n, despues),
+                                 mostrar_prestamo)
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+        if total == 0:
+            perror("El libro no tiene prestamos registrados.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 13
-def ver_historial_prestamos_estudiante(conn):
+def ver_historial_prestamos_estudiante(pool):
     """
     Muestra el historial de prestamos de un estudiante. Pide al usuario el id del estudiante.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        SELECT 
-            p.fechaprestamo, 
-            p.fechadevolucion, 
-            p.comentarios, 
-            p.idlibro,
-            l.titulo AS nombrelibro
-        FROM 
-            prestamo p
-        JOIN 
-            libro l ON l.id = p.idlibro
-        WHERE   
-            p.idestudiante = %(i)s
-        ORDER BY
-            p.fechaprestamo DESC
-    """
-
     ptitle("Ver historial de prestamos de estudiante")
 
     try:
@@ -1011,61 +753,32 @@ def ver_historial_prestamos_estudiante(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_estudiante,
-            })
-
-            prestamos = cur.fetchall()
-
-            if not prestamos:
-                perror("El estudiante no tiene prestamos registrados.")
-                press_enter_to_continue()
-                return
+    def mostrar_prestamo(prestamo):
+        print(f"\nFecha de prestamo: {prestamo.fechaprestamo.date()}")
+        print(f"Fecha limite: {prestamo.fechalimite.date()}")
+        print(f"Fecha de devolucion: {prestamo.fechadevolucion.date() if prestamo.fechadevolucion else 'No devuelto'}")
+        print(f"Comentarios: {prestamo.comentarios}")
+        print(f"Id del libro: {prestamo.idlibro}")
+        print(f"Libro: {prestamo.nombrelibro}")
 
-            for prestamo in prestamos:
-                print(f"\nFecha de prestamo: {prestamo['fechaprestamo'].date()}")
-                print(f"Fecha de devolucion: {prestamo['fechadevolucion'].date() if prestamo['fechadevolucion'] else 'No devuelto'}")
-                print(f"Comentarios: {prestamo['comentarios']}")
-                print(f"Id del libro: {prestamo['idlibro']}")
-                print(f"Libro: {prestamo['nombrelibro']}")
-
-            press_enter_to_continue()
+    try:
+        total = mostrar_paginado(pool, lambda conn, n, despues: repositorio.historial_prestamos_estudiante(conn, id_estudiante, n, despues),
+                                 mostrar_prestamo)
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+        if total == 0:
+            perror("El estudiante no tiene prestamos registrados.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 14
-def consultar_prestamo(conn):
+def consultar_prestamo(pool):
     """
     Consulta un prestamo en la base de datos. Pide al usuario el id del prestamo.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        SELECT 
-            p.fechaprestamo, 
-            p.fechadevolucion, 
-            p.comentarios, 
-            p.idlibro,
-            l.titulo AS nombrelibro,
-            p.idestudiante,
-            e.nombre AS nombreestudiante
-        FROM 
-            prestamo p
-        JOIN 
-            libro l ON l.id = p.idlibro
-        JOIN 
-            estudiante e ON e.id = p.idestudiante
-        WHERE 
-            p.id = %(i)s
-    """
-
     ptitle("Consultar prestamo")
 
     try:
@@ -1075,53 +788,36 @@ def consultar_prestamo(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_prestamo,
-            })
-
-            prestamo = cur.fetchone()
-
-            if prestamo is None:
-                perror("No se ha encontrado el prestamo.")
-                press_enter_to_continue()
-                return
-
-            print(f"\nId: {id_prestamo}")
-            print(f"Fecha del prestamo: {prestamo['fechaprestamo'].date()}")
-            print(f"Fecha de devolucion: {prestamo['fechadevolucion'].date() if prestamo['fechadevolucion'] else 'No devuelto'}")
-            print(f"Comentarios: {prestamo['comentarios']}")
-            print(f"Id del libro: {prestamo['idlibro']}")
-            print(f"Libro: {prestamo['nombrelibro']}")
-            print(f"Id del estudiante: {prestamo['idestudiante']}")
-            print(f"Estudiante: {prestamo['nombreestudiante']}")
-
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        prestamo = ejecutar(pool, repositorio.consultar_prestamo, id_prestamo)
+
+        print(f"\nId: {prestamo.id}")
+        print(f"Fecha del prestamo: {prestamo.fechaprestamo.date()}")
+        print(f"Fecha limite: {prestamo.fechalimite.date()}")
+        print(f"Fecha de devolucion: {prestamo.fechadevolucion.date() if prestamo.fechadevolucion else 'No devuelto'}")
+        print(f"Comentarios: {prestamo.comentarios}")
+        print(f"Id del libro: {prestamo.idlibro}")
+        print(f"Libro: {prestamo.nombrelibro}")
+        print(f"Id del estudiante: {prestamo.idestudiante}")
+        print(f"Estudiante: {prestamo.nombreestudiante}")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 15
-def finalizar_prestamo(conn):
+def finalizar_prestamo(pool):
     """
     Finaliza un prestamo en la base de datos. Pide al usuario el id del prestamo.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        UPDATE 
-            prestamo
-        SET
-            fechadevolucion = NOW()
-        WHERE
-            id = %(i)s
-    """
-
     ptitle("Finalizar prestamo")
 
+    if input("Finalizar [u]n prestamo o un [l]ote de prestamos? (enter: uno): ").strip().lower() == 'l':
+        finalizar_prestamos(pool)
+        return
+
     try:
         id_prestamo = get_parsed("Id del prestamo: ", int)
     except ValueError:
@@ -1129,50 +825,46 @@ def finalizar_prestamo(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
-    with conn.cursor() as cur:
+    try:
+        ejecutar(pool, repositorio.finalizar_prestamo, id_prestamo)
+        pmessage("Prestamo finalizado correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
+
+def finalizar_prestamos(pool):
+    """
+    Finaliza varios prestamos en una sola operacion. Pide al usuario los ids de los prestamos.
+    :param pool: El pool de conexiones a la BD
+    :return: Nada
+    """
+
+    ids_prestamos = []
+    while True:
         try:
-            cur.execute(sql_sentence, {
-                'i': id_prestamo,
-            })
-
-            if cur.rowcount == 0:
-                conn.rollback()
-                perror("No se ha encontrado el prestamo.")
-                press_enter_to_continue()
-                return
-
-            conn.commit()
-            pmessage("Prestamo finalizado correctamente.")
-
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.SERIALIZATION_FAILURE:
-                perror("Otro usuario ha modificado el prestamo mientras editabas.")
-                if input("Volver a intentarlo? (s/n): ").strip().lower() == "s":
-                    finalizar_prestamo(conn)
-                    return
-                else:
-                    pmessage("No se pudo finalizar el prestamo.")
-            else:
-                print_generic_error(e)
-            press_enter_to_continue()
+            id_prestamo = get_parsed("Id del prestamo (o 'enter' para terminar): ", int)
+        except ValueError:
+            perror("El id del prestamo debe ser un numero entero.")
+            continue
+        if id_prestamo is None:
+            break
+        ids_prestamos.append(id_prestamo)
+
+    try:
+        resultados = ejecutar(pool, repositorio.finalizar_prestamos, ids_prestamos)
+        mostrar_resultados_lote(resultados, "finalizados")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 16
-def eliminar_prestamo(conn):
+def eliminar_prestamo(pool):
     """
     Elimina un prestamo de la base de datos. Pide al usuario el id del prestamo.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        DELETE FROM
-            prestamo 
-        WHERE 
-            id = %(i)s
-    """
-
     ptitle("Eliminar prestamo")
 
     try:
@@ -1182,42 +874,21 @@ def eliminar_prestamo(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_prestamo,
-            })
-
-            if cur.rowcount == 0:
-                conn.rollback()
-                perror(f"El prestamo con id {id_prestamo} no existe.")
-            else:
-                conn.commit()
-                pmessage("Prestamo eliminado correctamente.")
-
-            press_enter_to_continue()
-
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        ejecutar(pool, repositorio.eliminar_prestamo, id_prestamo)
+        pmessage("Prestamo eliminado correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 17
-def anadir_estudiante(conn):
+def anadir_estudiante(pool):
     """
     Anade un estudiante a la base de datos. Pide al usuario los datos necesarios.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        INSERT INTO
-            estudiante (nombre, apellidos, curso, email, telefono)
-        VALUES 
-            (%(n)s, %(a)s, %(c)s, %(e)s, %(t)s)
-    """
-
     ptitle("Anadir estudiante")
     pmessage("*: Obligatorio\n")
 
@@ -1232,233 +903,143 @@ def anadir_estudiante(conn):
     email = get_string("Email*: ")
     telefono = get_string("Telefono (+XX XXX XX XX XX): ")
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'n': nombre,
-                'a': apellidos,
-                'c': curso,
-                'e': email,
-                't': telefono,
-            })
-
-            conn.commit()
-            pmessage("Estudiante anadido correctamente.")
-            press_enter_to_continue()
-
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION:
-                if e.diag.column_name == "email":
-                    perror("El email ya existe.")
-                elif e.diag.column_name == "telefono":
-                    perror("El telefono ya existe.")
-            elif e.pgcode == psycopg2.errorcodes.NOT_NULL_VIOLATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre no puede ser nulo.")
-                elif e.diag.column_name == "apellidos":
-                    perror("Los apellidos no pueden ser nulos.")
-                elif e.diag.column_name == "curso":
-                    perror("El curso no puede ser nulo.")
-                elif e.diag.column_name == "email":
-                    perror("El email no puede ser nulo.")
-            elif e.pgcode == psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre es demasiado largo.")
-                elif e.diag.column_name == "apellidos":
-                    perror("Los apellidos son demasiado largos.")
-                elif e.diag.column_name == "email":
-                    perror("El email es demasiado largo.")
-                elif e.diag.column_name == "telefono":
-                    perror("El telefono es demasiado largo.")
-            elif e.pgcode == psycopg2.errorcodes.CHECK_VIOLATION:
-                perror("El curso debe ser un numero entero mayor que cero.")
-            else:
-                print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        id_estudiante = ejecutar(pool, repositorio.anadir_estudiante, repositorio.EstudianteNuevo(
+            nombre=nombre,
+            apellidos=apellidos,
+            curso=curso,
+            email=email,
+            telefono=telefono
+        ))
+        pmessage(f"Estudiante anadido correctamente con id {id_estudiante}.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 18
-def consultar_estudiante(conn):
+def consultar_estudiante(pool):
     """
     Consulta un estudiante en la base de datos. Pide al usuario el id del estudiante.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        SELECT 
-            e.nombre,
-            e.apellidos,
-            e.curso,
-            e.email,
-            e.telefono,
-            (
-                SELECT count(*) 
-                FROM prestamo p 
-                WHERE p.idestudiante = e.id
-                AND p.fechadevolucion IS NULL
-            ) AS librosenposesion
-        FROM
-            estudiante e
-        WHERE
-             e.id = %(i)s
-    """
-
     ptitle("Consultar estudiante")
 
     try:
-        id_estudiante = get_parsed(f"Id del estudiante: ", int)
+        id_estudiante = get_parsed("Id del estudiante: ", int)
     except ValueError:
         perror("El id del estudiante debe ser un numero entero.")
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_estudiante,
-            })
-
-            estudiante = cur.fetchone()
-
-            if estudiante is None:
-                perror("No se ha encontrado el estudiante.")
-                press_enter_to_continue()
-                return
-
-            print(f"\nId: {id_estudiante}")
-            print(f"Nombre: {estudiante['nombre']}")
-            print(f"Apellidos: {estudiante['apellidos']}")
-            print(f"Curso: {estudiante['curso']}")
-            print(f"Email: {estudiante['email']}")
-            print(f"Telefono: {estudiante['telefono']}")
-            print(f"Libros en posesion: {estudiante['librosenposesion']}")
-
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        estudiante = ejecutar(pool, repositorio.consultar_estudiante, id_estudiante)
+
+        print(f"\nId: {estudiante.id}")
+        print(f"Nombre: {estudiante.nombre}")
+        print(f"Apellidos: {estudiante.apellidos}")
+        print(f"Curso: {estudiante.curso}")
+        print(f"Email: {estudiante.email}")
+        print(f"Telefono: {estudiante.telefono}")
+        print(f"Libros en posesion: {estudiante.librosenposesion}")
+        for prestado in estudiante.prestados:
+            print(f"  - [{prestado.idlibro}] {prestado.titulo} (prestamo {prestado.idprestamo}, "
+                  f"{prestado.fechaprestamo.date()}, hace {prestado.dias} dias)")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 19
-def aumentar_curso(conn):
+def leer_ids_fichero(ruta):
     """
-    Aumenta el curso de uno o varios estudiantes. Pide al usuario los datos necesarios.
-    :param conn: La conexion abierta a la BD
-    :return: Nada
+    Lee ids de estudiantes de un fichero de texto, uno por linea. Se ignoran las lineas vacias.
+    :param ruta: La ruta del fichero
+    :return: La lista de ids
+    :raise ValueError: Si alguna linea no es un numero entero
     """
+    with open(ruta, encoding="utf-8") as fichero:
+        return [int(linea) for linea in fichero if linea.strip() != ""]
 
-    sql_sentence = """
-        UPDATE
-            estudiante
-        SET 
-            curso = curso + 1
-        WHERE 
-            id = %(i)s
+
+def aumentar_curso(pool):
+    """
+    Aumenta el curso de varios estudiantes: todos los de un curso, los ids que indique el usuario
+    o los de un fichero con un id por linea.
+    :param pool: El pool de conexiones a la BD
+    :return: Nada
     """
 
     ptitle("Aumentar curso de estudiantes")
 
-    id_estudiantes = []
-    while True:
+    modo = input("Promocionar [c]urso completo, [i]ds o ids de [f]ichero? (enter: ids): ").strip().lower() or 'i'
+
+    if modo == 'c':
         try:
-            id_estudiante = get_parsed("Id del estudiante (o 'enter' para terminar): ", int)
-            if id_estudiante is None:
-                break
+            curso = get_parsed("Curso a promocionar: ", int)
         except ValueError:
-            perror("El id del estudiante debe ser un numero entero.")
-            continue
+            perror("El curso debe ser un numero entero.")
+            press_enter_to_continue()
+            return
+        if curso is None:
+            perror("El curso no puede ser nulo.")
+            press_enter_to_continue()
+            return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
-    with conn.cursor() as cur:
         try:
-            actualizados = 0
-
-            print()
-            for id_estudiante in id_estudiantes:
-                cur.execute(sql_sentence, {
-                    'i': id_estudiante,
-                })
-
-                if cur.rowcount == 1:
-                    actualizados += 1
-                    print(f"El curso de la estudiante con id {id_estudiante} ha sido actualizado correctamente.")
-                else:
-                    print(f"El estudiante con id {id_estudiante} no existe.")  # Continuamos igualmente
-
-            conn.commit()
-            pmessage(f"Curso aumentado correctamente a {actualizados} estudiantes.")
-            press_enter_to_continue()
+            promocionados = ejecutar(pool, repositorio.aumentar_curso_completo, curso)
+            pmessage(f"Curso aumentado a {len(promocionados)} estudiantes de {curso}o.")
+        except repositorio.ErrorBiblioteca as e:
+            perror(str(e))
+        press_enter_to_continue()
+        return
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.CHECK_VIOLATION:
-                perror("El curso debe ser un numero entero mayor que cero.")
-            elif e.pgcode == psycopg2.errorcodes.SERIALIZATION_FAILURE:
-                perror("Otro usuario ha modificado el estudiante mientras editabas.")
-                if input("Volver a intentarlo? (s/n): ").strip().lower() == "s":
-                    aumentar_curso(conn)
-                    return
-                else:
-                    pmessage("No se pudo aumentar el curso.")
-            else:
-                print_generic_error(e)
+    if modo == 'f':
+        ruta = get_string("Fichero de ids (uno por linea): ")
+        try:
+            id_estudiantes = leer_ids_fichero(ruta)
+        except (OSError, TypeError):
+            perror("No se puede leer el fichero.")
+            press_enter_to_continue()
+            return
+        except ValueError:
+            perror("El fichero solo puede contener ids de estudiantes (numeros enteros).")
             press_enter_to_continue()
+            return
+    elif modo == 'i':
+        id_estudiantes = []
+        while True:
+            try:
+                id_estudiante = get_parsed("Id del estudiante (o 'enter' para terminar): ", int)
+            except ValueError:
+                perror("El id del estudiante debe ser un numero entero.")
+                continue
+            if id_estudiante is None:
+                break
+            id_estudiantes.append(id_estudiante)
+    else:
+        perror("Modo no valido.")
+        press_enter_to_continue()
+        return
+
+    try:
+        actualizados, no_encontrados = ejecutar(pool, repositorio.aumentar_curso, id_estudiantes)
+
+        if no_encontrados:
+            pmessage(f"No existen los estudiantes con id: {', '.join(map(str, no_encontrados))}")
+        pmessage(f"Curso aumentado a {len(actualizados)} estudiantes.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 20
-def modificar_estudiante(conn):
+def modificar_estudiante(pool):
     """
     Modifica los atributos de un estudiante en la base de datos. Pide al usuario el id del estudiante y los atributos a modificar.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_update_nombre = """
-        UPDATE 
-            estudiante 
-        SET 
-            nombre = %(n)s 
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_apellidos = """
-        UPDATE 
-            estudiante 
-        SET 
-            apellidos = %(a)s 
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_curso = """
-        UPDATE 
-            estudiante 
-        SET 
-            curso = %(c)s 
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_email = """
-        UPDATE 
-            estudiante 
-        SET 
-            email = %(e)s 
-        WHERE 
-            id = %(i)s
-    """
-
-    sql_update_telefono = """
-        UPDATE 
-            estudiante  
-        SET 
-            telefono = %(t)s 
-        WHERE 
-            id = %(i)s
-    """
-
     ptitle("Modificar estudiante")
     pmessage("Los campos en blanco son ignorados\n")
 
@@ -1469,107 +1050,50 @@ def modificar_estudiante(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
-    with conn.cursor() as cur:
+    try:
+        estudiante = ejecutar(pool, repositorio.consultar_estudiante, id_estudiante)
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+        press_enter_to_continue()
+        return
+    pmessage(f"Estudiante: {estudiante.nombre} {estudiante.apellidos}\n")
+
+    cambios = {}
+    if input("Modificar nombre? (s/n): ").strip().lower() == "s":
+        cambios['nombre'] = get_string("Nuevo nombre: ")
+
+    if input("Modificar apellidos? (s/n): ").strip().lower() == "s":
+        cambios['apellidos'] = get_string("Nuevos apellidos: ")
+
+    if input("Modificar curso? (s/n): ").strip().lower() == "s":
         try:
-            if input("Modificar nombre? (s/n): ").strip().lower() == "s":
-                nombre = get_string("Nuevo nombre: ")
-
-                cur.execute(sql_update_nombre, {
-                    'n': nombre,
-                    'i': id_estudiante,
-                })
-
-            if input("Modificar apellidos? (s/n): ").strip().lower() == "s":
-                apellidos = get_string("Nuevos apellidos: ")
-
-                cur.execute(sql_update_apellidos, {
-                    'a': apellidos,
-                    'i': id_estudiante,
-                })
-
-            if input("Modificar curso? (s/n):").strip().lower() == "s":
-                try:
-                    curso = get_parsed("Nuevo curso: ", int)
-                except ValueError:
-                    perror("El curso debe ser un numero entero.")
-                    return
-
-                cur.execute(sql_update_curso, {
-                    'c': curso,
-                    'i': id_estudiante,
-                })
-
-            if input("Modificar email? (s/n): ").strip().lower() == "s":
-                email = get_string("Nuevo email: ")
-
-                cur.execute(sql_update_email, {
-                    'e': email,
-                    'i': id_estudiante,
-                })
-
-            if input("Modificar telefono? (s/n): ").strip().lower() == "s":
-                telefono = get_string("Nuevo telefono: ")
-
-                cur.execute(sql_update_telefono, {
-                    't': telefono,
-                    'i': id_estudiante,
-                })
-
-            conn.commit()
+            cambios['curso'] = get_parsed("Nuevo curso: ", int)
+        except ValueError:
+            perror("El curso debe ser un numero entero.")
             press_enter_to_continue()
+            return
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            if e.pgcode == psycopg2.errorcodes.NOT_NULL_VIOLATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre no puede ser nulo.")
-                elif e.diag.column_name == "apellidos":
-                    perror("Los apellidos no pueden ser nulos.")
-                elif e.diag.column_name == "curso":
-                    perror("El curso no puede ser nulo.")
-                elif e.diag.column_name == "email":
-                    perror("El email no puede ser nulo.")
-            elif e.pgcode == psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION:
-                if e.diag.column_name == "nombre":
-                    perror("El nombre es demasiado largo.")
-                elif e.diag.column_name == "apellidos":
-                    perror("Los apellidos son demasiado largos.")
-                elif e.diag.column_name == "email":
-                    perror("El email es demasiado largo.")
-                elif e.diag.column_name == "telefono":
-                    perror("El telefono es demasiado largo.")
-            elif e.pgcode == psycopg2.errorcodes.NUMERIC_VALUE_OUT_OF_RANGE:
-                perror("El curso es demasiado grande.")
-            elif e.pgcode == psycopg2.errorcodes.CHECK_VIOLATION:
-                perror("El curso debe ser un numero entero mayo que cero.")
-            elif e.pgcode == psycopg2.errorcodes.SERIALIZATION_FAILURE:
-                perror("Otro usuario ha modificado el estudiante mientras editabas.")
-                if input("Volver a intentarlo? (s/n): ").strip().lower() == "s":
-                    modificar_estudiante(conn)
-                    return
-                else:
-                    pmessage("No se pudo modificar el estudiante.")
-            else:
-                print_generic_error(e)
-            press_enter_to_continue()
+    if input("Modificar email? (s/n): ").strip().lower() == "s":
+        cambios['email'] = get_string("Nuevo email: ")
+
+    if input("Modificar telefono? (s/n): ").strip().lower() == "s":
+        cambios['telefono'] = get_string("Nuevo telefono: ")
+
+    try:
+        ejecutar(pool, repositorio.modificar_estudiante, id_estudiante, cambios, estudiante.version)
+        pmessage("Estudiante modificado correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
 # 21
-def eliminar_estudiante(conn):
+def eliminar_estudiante(pool):
     """
     Elimina un estudiante de la base de datos. Pide al usuario el id del estudiante.
-    :param conn: La conexion abierta a la BD
+    :param pool: El pool de conexiones a la BD
     :return: Nada
     """
 
-    sql_sentence = """
-        DELETE
-        FROM 
-            estudiante
-        WHERE 
-            id = %(i)s
-    """
-
     ptitle("Eliminar estudiante")
 
     try:
@@ -1579,29 +1103,113 @@ def eliminar_estudiante(conn):
         press_enter_to_continue()
         return
 
-    conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED
-    with conn.cursor() as cur:
-        try:
-            cur.execute(sql_sentence, {
-                'i': id_estudiante,
-            })
+    try:
+        ejecutar(pool, repositorio.eliminar_estudiante, id_estudiante)
+        pmessage("Estudiante eliminado correctamente.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
 
-            if cur.rowcount == 0:
-                conn.rollback()
-                perror(f"El estudiante con id {id_estudiante} no existe.")
-            else:
-                conn.commit()
-                pmessage("Estudiante eliminado correctamente.")
+# 22
+def informe_vencidos(pool):
+    """
+    Muestra los prestamos vencidos agrupados por curso y estudiante. Pide al usuario el curso (opcional).
+    :param pool: El pool de conexiones a la BD
+    :return: Nada
+    """
 
-            press_enter_to_continue()
+    ptitle("Informe de prestamos vencidos")
 
-        except psycopg2.Error as e:
-            conn.rollback()
-            print_generic_error(e)
-            press_enter_to_continue()
+    try:
+        curso = get_parsed("Curso (enter: todos): ", int)
+    except ValueError:
+        perror("El curso debe ser un numero entero.")
+        press_enter_to_continue()
+        return
 
+    try:
+        vencidos = ejecutar(pool, repositorio.informe_vencidos, curso)
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+        press_enter_to_continue()
+        return
 
-def menu(conn):
+    if not vencidos:
+        pmessage("No hay prestamos vencidos.")
+    for estudiante in vencidos:
+        print(f"\nCurso {estudiante.curso} - {estudiante.apellidos}, {estudiante.nombre} (id {estudiante.idestudiante})")
+        for prestamo in estudiante.prestamos:
+            print(f"  Prestamo {prestamo.idprestamo}: {prestamo.titulo} - fecha limite {prestamo.fechalimite.date()} "
+                  f"({prestamo.diasretraso} dias de retraso)")
+    press_enter_to_continue()
+
+# 23
+def estadisticas_circulacion(pool):
+    """
+    Muestra las estadisticas de circulacion: libros mas prestados por categoria en un mes, duracion media de
+    los prestamos o libros que no se han prestado nunca. Pide al usuario el informe y sus datos.
+    :param pool: El pool de conexiones a la BD
+    :return: Nada
+    """
+
+    ptitle("Estadisticas de circulacion")
+
+    try:
+        actualizadas = ejecutar(pool, repositorio.fecha_estadisticas)
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+        press_enter_to_continue()
+        return
+    pmessage(f"Datos a {actualizadas or 'ninguna fecha (sin refrescar)'} (python informes.py refrescar)\n")
+
+    informe = input("[m]as prestados del mes, [d]uracion media o [n]unca prestados? ").strip().lower()
+    try:
+        if informe == 'm':
+            mes = datetime.strptime(input("Mes (AAAA-MM): ").strip(), "%Y-%m").date()
+            id_categoria = get_parsed("Id de la categoria (enter: todas): ", int)
+        elif informe == 'd':
+            desde = get_string("Desde el mes (AAAA-MM, enter: el primero): ")
+            hasta = get_string("Hasta el mes (AAAA-MM, enter: el ultimo): ")
+            desde = datetime.strptime(desde, "%Y-%m").date() if desde else None
+            hasta = datetime.strptime(hasta, "%Y-%m").date() if hasta else None
+        elif informe == 'n':
+            id_categoria = get_parsed("Id de la categoria (enter: todas): ", int)
+        else:
+            perror("Opcion no valida.")
+            press_enter_to_continue()
+            return
+    except ValueError:
+        perror("Los meses deben tener el formato AAAA-MM y el id de la categoria debe ser un numero entero.")
+        press_enter_to_continue()
+        return
+
+    try:
+        if informe == 'm':
+            libros = ejecutar(pool, repositorio.libros_mas_prestados, mes, id_categoria)
+            categoria = None
+            for i, libro in enumerate(libros):
+                if i == 0 or libro.idcategoria != categoria:
+                    categoria = libro.idcategoria
+                    print(f"\n[{libro.nombrecategoria or 'Sin categoria'}]")
+                print(f"  {libro.posicion}. {libro.titulo} (id {libro.idlibro}): {libro.prestamos} prestamos")
+            if not libros:
+                pmessage("No hay prestamos en ese mes.")
+        elif informe == 'd':
+            for duracion in ejecutar(pool, repositorio.duracion_prestamos, desde, hasta):
+                nombre = "TOTAL" if duracion.total else duracion.nombrecategoria or "Sin categoria"
+                media = f"{duracion.diasmedios:.1f} dias" if duracion.diasmedios is not None else "-"
+                print(f"{nombre}: {duracion.prestamos} prestamos, duracion media {media}")
+        else:
+            total = mostrar_paginado(pool, lambda conn, n, despues: repositorio.libros_nunca_prestados(conn, n, despues, id_categoria),
+                                     lambda libro: print(f"{libro.id}: {libro.titulo} ({libro.nombrecategoria or 'Sin categoria'})"))
+            if total == 0:
+                pmessage("Todos los libros se han prestado alguna vez.")
+    except repositorio.ErrorBiblioteca as e:
+        perror(str(e))
+    press_enter_to_continue()
+
+
+def menu(pool):
     """
     Imprime un menu de opciones, solicita la opcion y ejecuta la funcion asociada.
     'q' para salir.
@@ -1638,6 +1246,11 @@ def menu(conn):
     20 - Modificar estudiante
     21 - Eliminar estudiante
     
+    [INFORMES]
+    22 - Informe de prestamos vencidos
+    23 - Estadisticas de circulacion
+    
+    p - Cambiar tamano de pagina de los listados
     q - Salir
     """
     
@@ -1650,59 +1263,68 @@ def menu(conn):
             print("\nHasta pronto!\n")
             break
         elif tecla == '1':
-            anadir_libro(conn)
+            anadir_libro(pool)
         elif tecla == '2':
-            buscar_libros(conn)
+            buscar_libros(pool)
         elif tecla == '3':
-            consultar_libro(conn)
+            consultar_libro(pool)
         elif tecla == '4':
-            modificar_libro(conn)
+            modificar_libro(pool)
         elif tecla == '5':
-            eliminar_libro(conn)
+            eliminar_libro(pool)
         elif tecla == '6':
-            actualizar_precio(conn)
+            actualizar_precio(pool)
         elif tecla == '7':
-            ver_historial_precios(conn)
+            ver_historial_precios(pool)
         elif tecla == '8':
-            anadir_categoria(conn)
+            anadir_categoria(pool)
         elif tecla == '9':
-            modificar_categoria(conn)
+            modificar_categoria(pool)
         elif tecla == '10':
-            eliminar_categoria(conn)
+            eliminar_categoria(pool)
         elif tecla == '11':
-            efectuar_prestamo(conn)
+            efectuar_prestamo(pool)
         elif tecla == '12':
-            ver_historial_prestamos_libro(conn)
+            ver_historial_prestamos_libro(pool)
         elif tecla == '13':
-            ver_historial_prestamos_estudiante(conn)
+            ver_historial_prestamos_estudiante(pool)
         elif tecla == '14':
-            consultar_prestamo(conn)
+            consultar_prestamo(pool)
         elif tecla == '15':
-            finalizar_prestamo(conn)
+            finalizar_prestamo(pool)
         elif tecla == '16':
-            eliminar_prestamo(conn)
+            eliminar_prestamo(pool)
         elif tecla == '17':
-            anadir_estudiante(conn)
+            anadir_estudiante(pool)
         elif tecla == '18':
-            consultar_estudiante(conn)
+            consultar_estudiante(pool)
         elif tecla == '19':
-            aumentar_curso(conn)
+            aumentar_curso(pool)
         elif tecla == '20':
-            modificar_estudiante(conn)
+            modificar_estudiante(pool)
         elif tecla == '21':
-            eliminar_estudiante(conn)
+            eliminar_estudiante(pool)
+        elif tecla == '22':
+            informe_vencidos(pool)
+        elif tecla == '23':
+            estadisticas_circulacion(pool)
+        elif tecla == 'p':
+            cambiar_tamano_pagina()
 
 
 def main():
     """
     Funcion principal. Conecta a la bd y ejecuta el menu.
-    Cando sale del menu, desconecta da bd y termina el programa.
+    Cuando sale del menu, desconecta de la bd, vuelca las estadisticas de las sentencias (si
+    BIBLIOTECA_ESTADISTICAS esta definida) y termina el programa.
     """
     print('Conectando a PosgreSQL...')
-    conn = connect_db()
+    pool = connect_db()
+    repositorio.escuchar_invalidaciones(pool.dsn)
     print('Conectado.')
-    menu(conn)
-    disconnect_db(conn)
+    menu(pool)
+    disconnect_db(pool)
+    instrumentacion.volcar_estadisticas()
 
 
 if __name__ == '__main__':
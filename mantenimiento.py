@@ -0,0 +1,55 @@
+"""
+Tareas de mantenimiento de la base de datos, para ejecutar desde la linea de comandos o una tarea programada.
+
+Uso:
+    python mantenimiento.py compactar-precios [--libro 12]
+    python mantenimiento.py particion-precios 2031
+
+'compactar-precios' elimina del historial de precios los precios iguales al anterior del mismo libro (ver
+repositorio.compactar_historial_precios), sin cambiar el precio de ningun libro en ninguna fecha.
+'particion-precios' crea la particion de preciolibro de un anio (ver repositorio.crear_particion_precios).
+La conexion se configura como en el resto de la aplicacion (ver conexion.py).
+"""
+
+import argparse
+import sys
+
+import psycopg2
+
+import conexion
+import repositorio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tareas de mantenimiento de la base de datos.")
+    subparsers = parser.add_subparsers(dest="tarea", required=True)
+    parser_compactar = subparsers.add_parser("compactar-precios", help="Elimina los precios repetidos del historial")
+    parser_compactar.add_argument("--libro", type=int, help="Id del libro (por defecto, todos)")
+    parser_particion = subparsers.add_parser("particion-precios", help="Crea la particion de precios de un anio")
+    parser_particion.add_argument("anio", type=int, help="Anio de la particion")
+    args = parser.parse_args()
+
+    try:
+        pool = conexion.PoolBiblioteca(minconn=1, maxconn=1)
+    except psycopg2.Error:
+        print("Error de conexion")
+        sys.exit(1)
+
+    try:
+        with pool.conexion() as conn:
+            if args.tarea == "compactar-precios":
+                eliminados = repositorio.compactar_historial_precios(conn, args.libro)
+                print(f"Precios repetidos eliminados: {eliminados}.")
+            elif repositorio.crear_particion_precios(conn, args.anio):
+                print(f"Particion de precios de {args.anio} creada.")
+            else:
+                print(f"La particion de precios de {args.anio} ya existe.")
+    except repositorio.ErrorBiblioteca as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        pool.closeall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Sentencias preparadas: las sentencias registradas se preparan con PREPARE la primera vez que se usan en
+cada conexion y despues se ejecutan por su nombre con EXECUTE, de modo que PostgreSQL analiza su texto
+una sola vez por sesion y puede reutilizar el plan.
+
+Las sentencias se escriben como el resto, con parametros %(nombre)s de psycopg2; al registrarlas se
+convierten a parametros $1, $2... PostgreSQL deduce el tipo de cada parametro por el contexto, salvo el de
+los que solo se comparan con NULL antes de usarse (%(x)s IS NULL OR ...), que se indica al registrarlas.
+"""
+
+import re
+import threading
+import weakref
+
+import psycopg2.extras
+
+
+_PARAMETRO = re.compile(r"%%|%\((\w+)\)s")
+
+
+class Preparada:
+    """Una sentencia registrada: su nombre en PostgreSQL y el texto de PREPARE y de EXECUTE."""
+
+    def __init__(self, nombre: str, sql: str, tipos: dict[str, str] | None = None):
+        """
+        :param nombre: El nombre de la sentencia (un identificador de PostgreSQL)
+        :param sql: La sentencia, con parametros %(nombre)s
+        :param tipos: Tipo de PostgreSQL de los parametros que no se pueden deducir, por nombre
+        """
+        parametros = []
+
+        def numerar(coincidencia):
+            if coincidencia.group(1) is None:
+                return "%"
+            if coincidencia.group(1) not in parametros:
+                parametros.append(coincidencia.group(1))
+            return f"${parametros.index(coincidencia.group(1)) + 1}"
+
+        texto = _PARAMETRO.sub(numerar, sql)
+        tipos = tipos or {}
+        self.nombre = nombre
+        self.prepare = f"PREPARE {nombre}" + (
+            f" ({', '.join(tipos.get(p, 'UNKNOWN') for p in parametros)})" if parametros else "") + f" AS {texto}"
+        self.execute = f"EXECUTE {nombre}" + (
+            f" ({', '.join(f'%({p})s' for p in parametros)})" if parametros else "")
+
+
+_preparadas = {}
+# Nombres de las sentencias ya preparadas en cada conexion
+_conexiones = weakref.WeakKeyDictionary()
+_cerrojo = threading.Lock()
+
+
+def registrar_sentencias(espacio, tipos: dict[str, dict[str, str]]) -> None:
+    """
+    Registra para su preparacion las constantes indicadas de un modulo. En las constantes que son
+    diccionarios de sentencias se registran todas.
+    :param espacio: Las variables globales del modulo (globals())
+    :param tipos: Para cada constante (SQL_*) a registrar, el tipo de los parametros que PostgreSQL no
+                  puede deducir (ver Preparada)
+    :return: None
+    """
+    for nombre, tipos_sentencia in tipos.items():
+        valor = espacio[nombre]
+        sentencias = valor.items() if isinstance(valor, dict) else [(None, valor)]
+        for clave, sentencia in sentencias:
+            nombre_preparada = nombre.lower() if clave is None else f"{nombre.lower()}_{clave}"
+            _preparadas[sentencia] = Preparada(nombre_preparada, sentencia, tipos_sentencia)
+
+
+def preparadas(conn) -> set[str]:
+    """
+    Devuelve los nombres de las sentencias preparadas en una conexion.
+    :param conn: La conexion
+    :return: Conjunto con los nombres
+    """
+    with _cerrojo:
+        return set(_conexiones.get(conn, ()))
+
+
+class CursorPreparado(psycopg2.extras.DictCursor):
+    """
+    DictCursor que ejecuta por su nombre las sentencias registradas, preparandolas antes si aun no lo estan
+    en la conexion del cursor. El resto de sentencias, y las de los cursores con nombre (DECLARE no admite
+    EXECUTE), se ejecutan normalmente.
+    """
+
+    def execute(self, query, vars=None):
+        preparada = _preparadas.get(query) if isinstance(query, str) and self.name is None else None
+        if preparada is None:
+            return super().execute(query, vars)
+
+        with _cerrojo:
+            hechas = _conexiones.setdefault(self.connection, set())
+            pendiente = preparada.nombre not in hechas
+        if pendiente:
+            # PREPARE no es transaccional: la sentencia sigue preparada aunque se deshaga la transaccion
+            super().execute(preparada.prepare)
+            with _cerrojo:
+                hechas.add(preparada.nombre)
+        return super().execute(preparada.execute, vars)
@@ -0,0 +1,2898 @@
+"""
+Operaciones de la biblioteca sobre la base de datos, sin entrada ni salida por consola.
+
+Cada funcion recibe una conexion (normalmente prestada por conexion.PoolBiblioteca), ejecuta su propia
+transaccion con el nivel de aislamiento que necesita y la confirma. Si la operacion no se puede realizar,
+la transaccion se deshace y se lanza una ErrorBiblioteca con un mensaje para el usuario. Las transacciones
+SERIALIZABLE que chocan con otra se repiten automaticamente (ver _ejecutar_serializable); sus contadores
+se consultan con estadisticas_transacciones().
+
+El detalle de los libros y los nombres de las categorias se guardan en caches del proceso (CACHE_LIBROS y
+CACHE_CATEGORIAS), que invalidan las operaciones que modifican esos datos.
+
+Los listados devuelven una Pagina: se leen con paginacion por clave (keyset), pasando en 'despues' la
+clave 'siguiente' de la pagina anterior.
+"""
+
+import csv
+import io
+import random
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime
+from typing import Any, Callable, Iterable, Iterator
+
+import psycopg2
+import psycopg2.errorcodes
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.sql
+
+import cache
+import instrumentacion
+import preparadas
+
+
+# ------------------------------------------------------------
+# Errores
+
+class ErrorBiblioteca(Exception):
+    """Una operacion no se ha podido realizar. El mensaje se puede mostrar al usuario."""
+
+
+class NoEncontrado(ErrorBiblioteca):
+    """El libro, categoria, prestamo o estudiante de la operacion no existe."""
+
+
+class Duplicado(ErrorBiblioteca):
+    """Los datos repiten un valor que debe ser unico (ISBN, nombre de categoria, email, telefono)."""
+
+
+class DatosNoValidos(ErrorBiblioteca):
+    """Los datos no cumplen las restricciones de la base de datos."""
+
+
+class ConflictoConcurrencia(ErrorBiblioteca):
+    """Otra transaccion ha modificado los mismos datos a la vez."""
+
+
+# Errores de PostgreSQL con mensaje propio, por codigo y restriccion (o columna, en los NOT NULL)
+MENSAJES_ERROR = {
+    (psycopg2.errorcodes.UNIQUE_VIOLATION, "libroisbnuq"): (Duplicado, "El ISBN ya existe en otro libro."),
+    (psycopg2.errorcodes.UNIQUE_VIOLATION, "categorianombreuq"): (Duplicado, "Una categoria con ese nombre ya existe."),
+    (psycopg2.errorcodes.UNIQUE_VIOLATION, "estudianteemailuq"): (Duplicado, "El email ya existe."),
+    (psycopg2.errorcodes.UNIQUE_VIOLATION, "estudiantetelefonouq"): (Duplicado, "El telefono ya existe."),
+    (psycopg2.errorcodes.UNIQUE_VIOLATION, "prestamolibroabiertouq"): (Duplicado, "El libro ya esta prestado."),
+    (psycopg2.errorcodes.FOREIGN_KEY_VIOLATION, "librocategoriafk"): (NoEncontrado, "La categoria especificada no existe."),
+    (psycopg2.errorcodes.FOREIGN_KEY_VIOLATION, "prestamolibrofk"): (NoEncontrado, "El libro especificado no existe."),
+    (psycopg2.errorcodes.FOREIGN_KEY_VIOLATION, "prestamoestudiantefk"): (NoEncontrado, "El estudiante especificado no existe."),
+    (psycopg2.errorcodes.FOREIGN_KEY_VIOLATION, "preciolibro_idlibro_fkey"): (NoEncontrado, "El libro especificado no existe."),
+    (psycopg2.errorcodes.NOT_NULL_VIOLATION, "titulo"): (DatosNoValidos, "El titulo es obligatorio."),
+    (psycopg2.errorcodes.NOT_NULL_VIOLATION, "precio"): (DatosNoValidos, "El precio no puede ser nulo."),
+    (psycopg2.errorcodes.NOT_NULL_VIOLATION, "nombre"): (DatosNoValidos, "El nombre no puede ser nulo."),
+    (psycopg2.errorcodes.NOT_NULL_VIOLATION, "descripcion"): (DatosNoValidos, "La descripcion no puede ser nula."),
+    (psycopg2.errorcodes.NOT_NULL_VIOLATION, "apellidos"): (DatosNoValidos, "Los apellidos no pueden ser nulos."),
+    (psycopg2.errorcodes.NOT_NULL_VIOLATION, "curso"): (DatosNoValidos, "El curso no puede ser nulo."),
+    (psycopg2.errorcodes.NOT_NULL_VIOLATION, "email"): (DatosNoValidos, "El email no puede ser nulo."),
+    (psycopg2.errorcodes.CHECK_VIOLATION, "precionn"): (DatosNoValidos, "El precio debe ser un numero positivo."),
+    (psycopg2.errorcodes.CHECK_VIOLATION, "libroprecionn"): (DatosNoValidos, "El precio debe ser un numero positivo."),
+    (psycopg2.errorcodes.CHECK_VIOLATION, "cursogtz"): (DatosNoValidos, "El curso debe ser un numero entero mayor que cero."),
+    (psycopg2.errorcodes.CHECK_VIOLATION, "diasprestamogtz"): (DatosNoValidos, "Los dias de prestamo deben ser un numero entero mayor que cero."),
+}
+
+# Errores con mensaje propio sin importar la restriccion o columna
+MENSAJES_ERROR_CODIGO = {
+    # PostgreSQL no indica la columna en los errores de longitud de VARCHAR
+    psycopg2.errorcodes.STRING_DATA_RIGHT_TRUNCATION: (DatosNoValidos, "Alguno de los datos es demasiado largo."),
+    psycopg2.errorcodes.NUMERIC_VALUE_OUT_OF_RANGE: (DatosNoValidos, "Alguno de los valores numericos es demasiado grande."),
+    psycopg2.errorcodes.SERIALIZATION_FAILURE: (ConflictoConcurrencia, "Otro usuario ha modificado los datos a la vez."),
+    psycopg2.errorcodes.DEADLOCK_DETECTED: (ConflictoConcurrencia, "Otro usuario ha modificado los datos a la vez."),
+}
+
+
+def traducir_error(e):
+    """
+    Convierte un error de PostgreSQL en la ErrorBiblioteca correspondiente. Admite errores de psycopg2
+    (pgcode) y de psycopg 3 (sqlstate), que comparten diag.
+    :param e: El error del driver
+    :return: La ErrorBiblioteca a lanzar
+    """
+    codigo = getattr(e, "pgcode", None) or getattr(e, "sqlstate", None)
+    diag = getattr(e, "diag", None)
+    nombre = None
+    if diag is not None:
+        nombre = diag.column_name if codigo == psycopg2.errorcodes.NOT_NULL_VIOLATION else diag.constraint_name
+
+    tipo, mensaje = MENSAJES_ERROR.get((codigo, nombre)) or MENSAJES_ERROR_CODIGO.get(codigo) or (
+        ErrorBiblioteca, f"{codigo or 'Unknown'} - {(getattr(e, 'pgerror', None) or str(e)).strip()}")
+    return tipo(mensaje)
+
+
+class _Cursor(instrumentacion.CursorInstrumentado, preparadas.CursorPreparado):
+    """Cursor de las transacciones: mide cada sentencia y ejecuta por su nombre las sentencias preparadas."""
+
+
+def _ejecutar(conn, nivel, cuerpo):
+    """
+    Ejecuta cuerpo(cur) en una transaccion con el nivel de aislamiento indicado y la confirma.
+    Si cuerpo o la base de datos fallan, deshace la transaccion; los errores de PostgreSQL se lanzan
+    traducidos a ErrorBiblioteca.
+    :param conn: La conexion con la base de datos (sin transaccion abierta)
+    :param nivel: El nivel de aislamiento (psycopg2.extensions.ISOLATION_LEVEL_*)
+    :param cuerpo: Funcion que recibe un DictCursor (instrumentado y con sentencias preparadas) y hace el
+                   trabajo de la transaccion
+    :return: Lo que devuelva cuerpo
+    """
+    conn.isolation_level = nivel
+    try:
+        with conn.cursor(cursor_factory=_Cursor) as cur:
+            resultado = cuerpo(cur)
+        conn.commit()
+        return resultado
+    except psycopg2.Error as e:
+        conn.rollback()
+        raise traducir_error(e) from e
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+# Reintentos de las transacciones SERIALIZABLE: numero maximo de intentos y espera antes de cada
+# reintento, que se dobla en cada uno (sin pasar de la maxima) y se elige al azar entre 0 y ese valor
+# para que las transacciones que han chocado no vuelvan a coincidir.
+INTENTOS_SERIALIZABLE = 5
+ESPERA_INICIAL_REINTENTO = 0.05
+ESPERA_MAXIMA_REINTENTO = 2.0
+
+
+@dataclass
+class EstadisticasTransaccion:
+    """Contadores de una operacion: transacciones intentadas, reintentos tras un conflicto y abandonos."""
+    intentos: int = 0
+    reintentos: int = 0
+    abandonos: int = 0
+
+
+_estadisticas_transacciones = {}
+_cerrojo_estadisticas = threading.Lock()
+
+
+def _contar(operacion, campo):
+    """Suma uno al contador campo de la operacion."""
+    with _cerrojo_estadisticas:
+        estadisticas = _estadisticas_transacciones.setdefault(operacion, EstadisticasTransaccion())
+        setattr(estadisticas, campo, getattr(estadisticas, campo) + 1)
+
+
+def estadisticas_transacciones() -> dict[str, EstadisticasTransaccion]:
+    """
+    Devuelve una copia de los contadores de las operaciones con reintentos, por nombre de operacion.
+    :return: Diccionario con las estadisticas de cada operacion
+    """
+    with _cerrojo_estadisticas:
+        return {operacion: replace(estadisticas) for operacion, estadisticas in _estadisticas_transacciones.items()}
+
+
+def reiniciar_estadisticas_transacciones() -> None:
+    """
+    Pone a cero los contadores de todas las operaciones.
+    :return: None
+    """
+    with _cerrojo_estadisticas:
+        _estadisticas_transacciones.clear()
+
+
+def _ejecutar_serializable(conn, operacion, cuerpo):
+    """
+    Ejecuta cuerpo(cur) en una transaccion SERIALIZABLE como _ejecutar. Si falla por un conflicto con otra
+    transaccion, espera un tiempo aleatorio creciente y la repite desde el principio, hasta
+    INTENTOS_SERIALIZABLE veces. Solo vale para cuerpos que se pueden repetir.
+    :param conn: La conexion con la base de datos (sin transaccion abierta)
+    :param operacion: El nombre de la operacion en las estadisticas
+    :param cuerpo: Funcion que recibe un DictCursor y hace el trabajo de la transaccion
+    :return: Lo que devuelva cuerpo
+    :raise ConflictoConcurrencia: Si la transaccion falla INTENTOS_SERIALIZABLE veces
+    """
+    espera = ESPERA_INICIAL_REINTENTO
+    for intento in range(1, INTENTOS_SERIALIZABLE + 1):
+        _contar(operacion, 'intentos')
+        try:
+            return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE, cuerpo)
+        except ConflictoConcurrencia:
+            if intento == INTENTOS_SERIALIZABLE:
+                _contar(operacion, 'abandonos')
+                raise
+        _contar(operacion, 'reintentos')
+        time.sleep(random.uniform(0, espera))
+        espera = min(espera * 2, ESPERA_MAXIMA_REINTENTO)
+
+
+# ------------------------------------------------------------
+# Caches
+
+# Detalle de los libros (consultar_libro) y nombre de cada categoria. Los nombres de las categorias se
+# anaden a los libros despues de leerlos, en lugar de unir categoria en cada consulta. Las operaciones que
+# modifican estos datos invalidan sus entradas despues de confirmar la transaccion, y las envian a los
+# demas procesos con cache.notificar dentro de la transaccion.
+CACHE_LIBROS = cache.CacheLRU("libros")
+CACHE_CATEGORIAS = cache.CacheLRU("categorias")
+CACHES = {c.nombre: c for c in (CACHE_LIBROS, CACHE_CATEGORIAS)}
+
+
+def estadisticas_caches() -> dict[str, cache.EstadisticasCache]:
+    """
+    Devuelve una copia de los aciertos, fallos, invalidaciones y expulsiones de cada cache, por nombre.
+    :return: Diccionario con las estadisticas de cada cache
+    """
+    return {nombre: c.estadisticas() for nombre, c in CACHES.items()}
+
+
+def escuchar_invalidaciones(dsn: str) -> cache.EscuchaInvalidaciones | None:
+    """
+    Si BIBLIOTECA_CACHE_NOTIFY esta activado, arranca el hilo que aplica a las caches de este proceso las
+    invalidaciones enviadas por los demas.
+    :param dsn: El DSN de la base de datos
+    :return: El hilo, o None si no esta activado
+    """
+    if not cache.NOTIFY_CACHE:
+        return None
+    escucha = cache.EscuchaInvalidaciones(dsn, CACHES)
+    escucha.start()
+    return escucha
+
+
+# ------------------------------------------------------------
+# Tipos
+
+@dataclass
+class Pagina:
+    """Una pagina de un listado. 'siguiente' es la clave para pedir la pagina siguiente, o None si es la ultima."""
+    filas: list
+    siguiente: tuple | None
+
+
+@dataclass
+class LibroNuevo:
+    titulo: str
+    autor: str | None = None
+    aniopublicacion: int | None = None
+    isbn: str | None = None
+    sinopsis: str | None = None
+    idcategoria: int | None = None
+
+
+@dataclass
+class FiltrosLibro:
+    """Filtros de busqueda de libros. Los campos a None se ignoran. 'modo' es una clave de MODOS_BUSQUEDA."""
+    modo: str = "e"
+    titulo: str | None = None
+    autor: str | None = None
+    aniopublicacion: int | None = None
+    isbn: str | None = None
+    idcategoria: int | None = None
+
+
+@dataclass
+class FiltrosRevalorizacion:
+    """
+    Libros a los que se aplica una revalorizacion de precios. Los campos a None se ignoran; los anios son
+    inclusivos y 'ids' es una lista de ids de libros.
+    """
+    idcategoria: int | None = None
+    autor: str | None = None
+    aniodesde: int | None = None
+    aniohasta: int | None = None
+    ids: list[int] | None = None
+
+
+@dataclass
+class ResumenRevalorizacion:
+    """
+    Resultado (o prevision, si 'simulacion' es True) de una revalorizacion: libros con nuevo precio, libros
+    seleccionados que no tienen precio (y no cambian con un porcentaje) y suma de sus precios antes y despues.
+    """
+    simulacion: bool
+    libros: int
+    sinprecio: int
+    totalanterior: float | None
+    totalnuevo: float | None
+
+
+@dataclass
+class LibroResumen:
+    id: int
+    titulo: str
+    autor: str | None
+    aniopublicacion: int | None
+    isbn: str | None
+    idcategoria: int | None
+    nombrecategoria: str | None
+    precioactual: float | None
+    disponible: bool
+    rango: float
+
+    @property
+    def clave(self):
+        return (self.rango, self.id)
+
+
+@dataclass
+class Libro:
+    """Un libro. 'version' aumenta con cada modificacion de sus datos o de su precio (ver modificar_libro)."""
+    id: int
+    titulo: str
+    autor: str | None
+    aniopublicacion: int | None
+    isbn: str | None
+    sinopsis: str | None
+    idcategoria: int | None
+    nombrecategoria: str | None
+    precioactual: float | None
+    disponible: bool
+    version: int
+
+
+@dataclass
+class Precio:
+    id: int
+    precio: float
+    fecha: datetime
+
+    @property
+    def clave(self):
+        return (self.fecha, self.id)
+
+
+@dataclass
+class PrecioEnFecha:
+    """
+    Precio de un libro en una fecha: el ultimo registrado hasta esa fecha, desde la fecha 'desde'. 'precio' y
+    'desde' son None si el libro no tenia precio (o no existe).
+    """
+    idlibro: int
+    fecha: datetime
+    precio: float | None
+    desde: datetime | None
+
+
+@dataclass
+class Categoria:
+    id: int
+    nombre: str
+    descripcion: str
+    diasprestamo: int
+
+    @property
+    def clave(self):
+        return (self.nombre, self.id)
+
+
+@dataclass
+class Prestamo:
+    id: int
+    fechaprestamo: datetime
+    fechadevolucion: datetime | None
+    fechalimite: datetime
+    comentarios: str | None
+    idlibro: int | None
+    nombrelibro: str | None
+    idestudiante: int | None
+    nombreestudiante: str | None
+
+    @property
+    def clave(self):
+        return (self.fechaprestamo, self.id)
+
+
+@dataclass
+class ResultadoLote:
+    """
+    Resultado de un elemento de un prestamo o una devolucion en lote. 'motivo' es None si se ha procesado;
+    si no, explica por que no.
+    """
+    posicion: int
+    idprestamo: int | None
+    idlibro: int | None
+    idestudiante: int | None
+    motivo: str | None
+
+
+@dataclass
+class EstudianteNuevo:
+    nombre: str
+    apellidos: str
+    curso: int
+    email: str
+    telefono: str | None = None
+
+
+@dataclass
+class LibroEnPosesion:
+    """Un libro prestado a un estudiante y no devuelto, con los dias que han pasado desde el prestamo."""
+    idprestamo: int
+    idlibro: int | None
+    titulo: str | None
+    fechaprestamo: datetime
+    dias: int
+
+
+@dataclass
+class Estudiante:
+    """
+    Un estudiante. 'version' aumenta con cada modificacion de sus datos (ver modificar_estudiante); 'prestados'
+    son sus libros en posesion, del prestamo mas antiguo al mas reciente.
+    """
+    id: int
+    nombre: str
+    apellidos: str
+    curso: int
+    email: str
+    telefono: str | None
+    librosenposesion: int
+    version: int
+    prestados: list[LibroEnPosesion] = field(default_factory=list)
+
+    def __post_init__(self):
+        # La consulta devuelve los libros en posesion como JSON, con las fechas en texto
+        self.prestados = [
+            LibroEnPosesion(**{**p, 'fechaprestamo': datetime.fromisoformat(p['fechaprestamo'])})
+            if isinstance(p, dict) else p
+            for p in self.prestados
+        ]
+
+
+def _leer_pagina(conn, sql_sentence, params, limite, despues, tipo):
+    """
+    Lee una pagina de un listado paginado por clave. La consulta recibe la clave de la ultima fila de la
+    pagina anterior en %(k1)s y %(k2)s y el numero de filas a leer en %(n)s, asi que nunca se cargan mas de
+    limite + 1 filas. Se usa un cursor normal y no uno con nombre porque DECLARE no admite las sentencias
+    preparadas.
+    :param tipo: La clase de las filas devueltas (con propiedad clave)
+    :return: La Pagina leida
+    """
+    k1, k2 = despues if despues is not None else (None, None)
+
+    def cuerpo(cur):
+        cur.execute(sql_sentence, {**params, 'k1': k1, 'k2': k2, 'n': limite + 1})
+        return [tipo(**fila) for fila in cur]
+
+    filas = _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    if len(filas) > limite:
+        return Pagina(filas[:limite], filas[limite - 1].clave)
+    return Pagina(filas, None)
+
+
+def recorrer(leer_pagina: Callable[[int, tuple | None], Pagina], tamano_pagina: int = 500) -> Iterator[Any]:
+    """
+    Recorre todas las filas de un listado paginado, pagina a pagina.
+    Ejemplo: recorrer(lambda n, despues: buscar_libros(conn, filtros, n, despues))
+    :param leer_pagina: Funcion que recibe el tamano de pagina y la clave 'despues' y devuelve una Pagina
+    :param tamano_pagina: Numero de filas de cada pagina
+    :return: Iterador sobre las filas
+    """
+    despues = None
+    while True:
+        pagina = leer_pagina(tamano_pagina, despues)
+        yield from pagina.filas
+        if pagina.siguiente is None:
+            return
+        despues = pagina.siguiente
+
+
+# ------------------------------------------------------------
+# Libros
+
+SQL_ANADIR_LIBRO = """
+    INSERT INTO
+        libro (titulo, autor, aniopublicacion, isbn, sinopsis, idcategoria)
+    VALUES
+        (%(titulo)s, %(autor)s, %(aniopublicacion)s, %(isbn)s, %(sinopsis)s, %(idcategoria)s)
+    RETURNING
+        id
+"""
+
+# Modos de busqueda de libros: nombre, condicion sobre titulo y autor, y relevancia
+# de cada resultado (0 en los modos sin ordenacion por relevancia).
+# Los modos prefijo y difuso usan los indices de trigramas (pg_trgm) y el de texto
+# completo el indice GIN sobre libro.busqueda.
+MODOS_BUSQUEDA = {
+    'e': (
+        "exacta",
+        """
+            (%(titulo)s IS NULL
+            OR l.titulo ILIKE %(titulo)s)
+            AND (%(autor)s IS NULL
+            OR l.autor ILIKE %(autor)s)
+        """,
+        "0"
+    ),
+    'p': (
+        "prefijo",
+        """
+            (%(titulo)s IS NULL
+            OR l.titulo ILIKE %(titulo)s || '%%')
+            AND (%(autor)s IS NULL
+            OR l.autor ILIKE %(autor)s || '%%')
+        """,
+        "0"
+    ),
+    'd': (
+        "difusa",
+        """
+            (%(titulo)s IS NULL
+            OR %(titulo)s <%% l.titulo)
+            AND (%(autor)s IS NULL
+            OR %(autor)s <%% l.autor)
+        """,
+        """
+            coalesce(word_similarity(%(titulo)s, l.titulo), 0)
+            + coalesce(word_similarity(%(autor)s, l.autor), 0)
+        """
+    ),
+    't': (
+        "texto completo",
+        """
+            (%(titulo)s IS NULL
+            OR l.busqueda @@ websearch_to_tsquery('spanish', %(titulo)s))
+        """,
+        """
+            coalesce(ts_rank(l.busqueda, websearch_to_tsquery('spanish', %(titulo)s)), 0)
+        """
+    ),
+}
+
+# Se completa con la condicion y la relevancia del modo de busqueda
+SQL_BUSCAR_LIBROS = """
+    SELECT
+        l.id,
+        l.titulo,
+        l.autor,
+        l.aniopublicacion,
+        l.isbn,
+        l.idcategoria,
+        NULL AS nombrecategoria,
+        l.precioactual,
+        NOT l.prestado AS disponible,
+        CAST({rango} AS FLOAT) AS rango
+    FROM
+        libro l
+    WHERE
+        {condicion}
+        AND (%(aniopublicacion)s IS NULL
+        OR l.aniopublicacion = %(aniopublicacion)s)
+        AND (%(isbn)s IS NULL
+        OR l.isbn ilike %(isbn)s)
+        AND (%(idcategoria)s IS NULL
+        OR l.idcategoria = %(idcategoria)s)
+        AND (%(k1)s IS NULL
+        OR CAST({rango} AS FLOAT) < %(k1)s
+        OR (CAST({rango} AS FLOAT) = %(k1)s AND l.id > %(k2)s))
+    ORDER BY
+        rango DESC,
+        l.id
+    LIMIT
+        %(n)s
+"""
+
+# Sentencia completa de cada modo de busqueda
+SQL_BUSCAR_LIBROS_MODO = {
+    modo: SQL_BUSCAR_LIBROS.format(condicion=condicion, rango=rango)
+    for modo, (_, condicion, rango) in MODOS_BUSQUEDA.items()
+}
+
+SQL_CONSULTAR_LIBRO = """
+    SELECT
+        l.id,
+        l.titulo,
+        l.autor,
+        l.aniopublicacion,
+        l.isbn,
+        l.sinopsis,
+        l.idcategoria,
+        NULL AS nombrecategoria,
+        l.precioactual,
+        NOT l.prestado AS disponible,
+        l.version
+    FROM
+        libro l
+    WHERE
+        l.id = %(i)s
+"""
+
+# Campos modificables de un libro y columna de cada uno. Los cambios de un libro se aplican con una sola
+# sentencia que asigna solo las columnas modificadas ({asignaciones}) y suma uno a la version; si se indica
+# la version leida, la fila solo se modifica si sigue en esa version (control de concurrencia optimista).
+# Un cambio de precio se anade tambien al historial.
+COLUMNAS_MODIFICAR_LIBRO = {
+    'titulo': "titulo",
+    'autor': "autor",
+    'aniopublicacion': "aniopublicacion",
+    'isbn': "isbn",
+    'sinopsis': "sinopsis",
+    'idcategoria': "idcategoria",
+    'precio': "precioactual",
+}
+
+SQL_MODIFICAR_LIBRO = """
+    WITH modificado AS (
+        UPDATE
+            libro
+        SET
+            {asignaciones}
+            version = version + 1
+        WHERE
+            id = %(i)s
+            AND (%(version)s IS NULL
+            OR version = %(version)s)
+        RETURNING
+            id, version, precioactual
+    ), precio AS (
+        INSERT INTO
+            preciolibro (idlibro, precio)
+        SELECT
+            id, precioactual
+        FROM
+            modificado
+        WHERE
+            %(cambia_precio)s
+    )
+    SELECT
+        version
+    FROM
+        modificado
+"""
+
+SQL_VERSION_LIBRO = """
+    SELECT
+        version
+    FROM
+        libro
+    WHERE
+        id = %(i)s
+"""
+
+SQL_ELIMINAR_LIBRO = """
+    DELETE
+    FROM
+        libro
+    WHERE
+        id = %(i)s
+"""
+
+
+def anadir_libro(conn, libro: LibroNuevo) -> int:
+    """
+    Anade un nuevo libro a la biblioteca.
+    :param conn: La conexion con la base de datos
+    :param libro: Los datos del libro
+    :return: El id del libro anadido
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_ANADIR_LIBRO, vars(libro))
+        return cur.fetchone()['id']
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def buscar_libros(conn, filtros: FiltrosLibro, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Busca libros segun los filtros, ordenados por relevancia (en los modos que la calculan) y por id.
+    En el modo de texto completo, filtros.titulo es el texto a buscar en titulo, autor y sinopsis.
+    :param conn: La conexion con la base de datos
+    :param filtros: Los filtros de la busqueda
+    :param limite: El numero maximo de libros de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de LibroResumen
+    """
+    if filtros.modo not in MODOS_BUSQUEDA:
+        raise DatosNoValidos("Modo de busqueda no valido.")
+    params = vars(filtros).copy()
+    del params['modo']
+    if filtros.modo == 't':
+        params['autor'] = None
+
+    pagina = _leer_pagina(conn, SQL_BUSCAR_LIBROS_MODO[filtros.modo], params, limite, despues, LibroResumen)
+    nombres = nombres_categorias(conn, [libro.idcategoria for libro in pagina.filas])
+    for libro in pagina.filas:
+        libro.nombrecategoria = nombres.get(libro.idcategoria)
+    return pagina
+
+
+def consultar_libro(conn, id_libro: int) -> Libro:
+    """
+    Obtiene toda la informacion de un libro, con el nombre de su categoria, su precio actual y su disponibilidad.
+    El libro se guarda en CACHE_LIBROS.
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :return: El libro
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_CONSULTAR_LIBRO, {'i': id_libro})
+        fila = cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("No se ha encontrado el libro.")
+        return Libro(**fila)
+
+    libro = CACHE_LIBROS.obtener(
+        id_libro, lambda: _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo))
+    return replace(libro, nombrecategoria=nombres_categorias(conn, [libro.idcategoria]).get(libro.idcategoria))
+
+
+def _asignaciones(columnas, cambios):
+    """
+    Texto SET de las columnas modificadas, para SQL_MODIFICAR_LIBRO y SQL_MODIFICAR_ESTUDIANTE. Los nombres
+    de columna salen de la lista de campos modificables y los valores van como parametros %(campo)s.
+    """
+    return "".join(f"{columnas[campo]} = %({campo})s,\n            " for campo in columnas if campo in cambios)
+
+
+def modificar_libro(conn, id_libro: int, cambios: dict, version: int | None = None) -> int:
+    """
+    Modifica los campos indicados de un libro con una sola sentencia. La clave 'precio' cambia el precio
+    actual y lo anade al historial. Si se indica la version del libro leida antes de preparar los cambios
+    (Libro.version) y el libro se ha modificado despues, no se cambia nada y se lanza ConflictoConcurrencia.
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :param cambios: Nuevo valor de cada campo a modificar (claves de COLUMNAS_MODIFICAR_LIBRO)
+    :param version: La version del libro leida, o None para modificarlo sin comprobarla
+    :return: La nueva version del libro
+    """
+    for campo in cambios:
+        if campo not in COLUMNAS_MODIFICAR_LIBRO:
+            raise DatosNoValidos(f"El campo {campo} no se puede modificar.")
+
+    def cuerpo(cur):
+        cur.execute(SQL_MODIFICAR_LIBRO.format(asignaciones=_asignaciones(COLUMNAS_MODIFICAR_LIBRO, cambios)),
+                    {**cambios, 'i': id_libro, 'version': version, 'cambia_precio': 'precio' in cambios})
+        fila = cur.fetchone()
+        if fila is None:
+            cur.execute(SQL_VERSION_LIBRO, {'i': id_libro})
+            if cur.fetchone() is None:
+                raise NoEncontrado("El libro especificado no existe.")
+            raise ConflictoConcurrencia("Otro usuario ha modificado el libro despues de consultarlo.")
+        cache.notificar(cur, CACHE_LIBROS.nombre, id_libro)
+        return fila['version']
+
+    try:
+        return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    finally:
+        # Tambien si hay conflicto: la version guardada en la cache puede ser la que ha quedado obsoleta
+        CACHE_LIBROS.invalidar(id_libro)
+
+
+def eliminar_libro(conn, id_libro: int) -> None:
+    """
+    Elimina permanentemente un libro de la biblioteca.
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :return: None
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_ELIMINAR_LIBRO, {'i': id_libro})
+        if cur.rowcount == 0:
+            raise NoEncontrado(f"El libro con id {id_libro} no existe.")
+        cache.notificar(cur, CACHE_LIBROS.nombre, id_libro)
+
+    _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    CACHE_LIBROS.invalidar(id_libro)
+
+
+# ------------------------------------------------------------
+# Precios
+
+# El precio actual se guarda en libro.precioactual y se mantiene en la misma
+# sentencia que anade la fila al historial, sin recorrer preciolibro.
+SQL_PRECIO_MANUAL = """
+    WITH actual AS (
+        UPDATE
+            libro
+        SET
+            precioactual = %(p)s,
+            version = version + 1
+        WHERE
+            id = %(i)s
+        RETURNING
+            id, precioactual
+    )
+    INSERT INTO
+        preciolibro (idlibro, precio)
+    SELECT
+        id, precioactual
+    FROM
+        actual
+    RETURNING
+        precio
+"""
+
+SQL_PRECIO_PORCENTAJE = """
+    WITH actual AS (
+        UPDATE
+            libro
+        SET
+            precioactual = precioactual * (1 + %(p)s / 100.0),
+            version = version + 1
+        WHERE
+            id = %(i)s
+            AND precioactual IS NOT NULL
+        RETURNING
+            id, precioactual
+    )
+    INSERT INTO
+        preciolibro (idlibro, precio)
+    SELECT
+        id, precioactual
+    FROM
+        actual
+    RETURNING
+        precio
+"""
+
+# La condicion fecha <= k1 es redundante con la de la clave, pero a diferencia de la comparacion de
+# filas permite descartar las particiones de preciolibro posteriores a la pagina anterior.
+SQL_HISTORIAL_PRECIOS = """
+    SELECT
+        id,
+        precio,
+        fecha
+    FROM
+        preciolibro
+    WHERE
+        idlibro = %(i)s
+        AND (%(k1)s IS NULL
+        OR fecha <= %(k1)s)
+        AND (%(k1)s IS NULL
+        OR (fecha, id) < (%(k1)s, %(k2)s))
+    ORDER BY
+        fecha DESC,
+        id DESC
+    LIMIT
+        %(n)s
+"""
+
+
+# Precio de cada libro en su fecha: el ultimo precio hasta esa fecha, que se lee solo de PrecioLibroFechaIDX
+# (sin visitar la tabla) y de las particiones de preciolibro hasta ese anio
+SQL_PRECIOS_EN_FECHA = """
+    SELECT
+        c.idlibro,
+        c.fecha,
+        p.precio,
+        p.fecha AS desde
+    FROM
+        unnest(CAST(%(libros)s AS BIGINT[]), CAST(%(fechas)s AS TIMESTAMP[]))
+        WITH ORDINALITY AS c (idlibro, fecha, posicion)
+    LEFT JOIN LATERAL (
+        SELECT
+            precio,
+            fecha
+        FROM
+            preciolibro
+        WHERE
+            idlibro = c.idlibro
+            AND fecha <= c.fecha
+        ORDER BY
+            fecha DESC
+        LIMIT
+            1
+    ) p ON TRUE
+    ORDER BY
+        c.posicion
+"""
+
+# Precios iguales al anterior del mismo libro (en orden de fecha). Al borrarlos el precio en cada fecha no
+# cambia, y libro.precioactual sigue siendo el del ultimo precio que queda.
+SQL_COMPACTAR_HISTORIAL_PRECIOS = """
+    WITH repetidos AS (
+        SELECT
+            id,
+            fecha
+        FROM (
+            SELECT
+                id,
+                fecha,
+                precio,
+                lag(precio) OVER (PARTITION BY idlibro ORDER BY fecha, id) AS anterior
+            FROM
+                preciolibro
+            WHERE
+                CAST(%(i)s AS BIGINT) IS NULL
+                OR idlibro = %(i)s
+        ) h
+        WHERE
+            precio = anterior
+    )
+    DELETE FROM
+        preciolibro p
+    USING
+        repetidos r
+    WHERE
+        p.id = r.id
+        AND p.fecha = r.fecha
+"""
+
+
+def actualizar_precio(conn, id_libro: int, precio: float | None = None, porcentaje: float | None = None) -> float:
+    """
+    Registra un nuevo precio para un libro: el precio indicado o el actual con un porcentaje de variacion
+    (negativo para descuentos).
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :param precio: El nuevo precio
+    :param porcentaje: El porcentaje de variacion, si no se indica precio
+    :return: El nuevo precio del libro
+    """
+    if (precio is None) == (porcentaje is None):
+        raise DatosNoValidos("Se debe indicar un precio o un porcentaje.")
+
+    def cuerpo(cur):
+        if porcentaje is not None:
+            cur.execute(SQL_PRECIO_PORCENTAJE, {'i': id_libro, 'p': porcentaje})
+        else:
+            cur.execute(SQL_PRECIO_MANUAL, {'i': id_libro, 'p': precio})
+        fila = cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("El libro especificado no existe o no tiene un precio registrado.")
+        cache.notificar(cur, CACHE_LIBROS.nombre, id_libro)
+        return fila['precio']
+
+    nuevo_precio = _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    CACHE_LIBROS.invalidar(id_libro)
+    return nuevo_precio
+
+
+# Revalorizacion de precios en bloque: los libros que cumplen los filtros, con su precio actual y el nuevo
+# (el indicado o el actual con el porcentaje; NULL si el libro no tiene precio y se indica un porcentaje).
+# La prevision solo lee; la revalorizacion bloquea los libros en orden de id y anade todas las filas del
+# historial en la misma sentencia, como SQL_PRECIO_MANUAL y SQL_PRECIO_PORCENTAJE.
+_SQL_NUEVOS_PRECIOS = """
+        SELECT
+            id,
+            precioactual AS anterior,
+            coalesce(CAST(%(precio)s AS FLOAT), precioactual * (1 + CAST(%(porcentaje)s AS FLOAT) / 100.0)) AS nuevo
+        FROM
+            libro
+        WHERE
+            (CAST(%(ic)s AS BIGINT) IS NULL OR idcategoria = %(ic)s)
+            AND (CAST(%(autor)s AS TEXT) IS NULL OR autor = %(autor)s)
+            AND (CAST(%(desde)s AS INTEGER) IS NULL OR aniopublicacion >= %(desde)s)
+            AND (CAST(%(hasta)s AS INTEGER) IS NULL OR aniopublicacion <= %(hasta)s)
+            AND (CAST(%(ids)s AS BIGINT[]) IS NULL OR id = ANY(%(ids)s))
+"""
+
+_SQL_RESUMEN_REVALORIZACION = """
+    SELECT
+        count(nuevo) AS libros,
+        count(*) - count(nuevo) AS sinprecio,
+        sum(anterior) FILTER (WHERE nuevo IS NOT NULL) AS totalanterior,
+        sum(nuevo) AS totalnuevo
+    FROM
+        nuevos
+"""
+
+SQL_PREVISUALIZAR_REVALORIZACION = f"""
+    WITH nuevos AS ({_SQL_NUEVOS_PRECIOS}
+    )
+    {_SQL_RESUMEN_REVALORIZACION}
+"""
+
+SQL_REVALORIZAR = f"""
+    WITH nuevos AS ({_SQL_NUEVOS_PRECIOS}
+        ORDER BY
+            id
+        FOR UPDATE
+    ), actualizados AS (
+        UPDATE
+            libro l
+        SET
+            precioactual = n.nuevo,
+            version = l.version + 1
+        FROM
+            nuevos n
+        WHERE
+            l.id = n.id
+            AND n.nuevo IS NOT NULL
+        RETURNING
+            l.id, l.precioactual
+    ), historial AS (
+        INSERT INTO
+            preciolibro (idlibro, precio)
+        SELECT
+            id, precioactual
+        FROM
+            actualizados
+    )
+    {_SQL_RESUMEN_REVALORIZACION}
+"""
+
+
+def _parametros_revalorizacion(filtros, precio, porcentaje):
+    """
+    Comprueba los datos de una revalorizacion y devuelve los parametros de SQL_REVALORIZAR.
+    :return: Diccionario de parametros
+    """
+    if (precio is None) == (porcentaje is None):
+        raise DatosNoValidos("Se debe indicar un precio o un porcentaje.")
+    if all(valor is None for valor in (filtros.idcategoria, filtros.autor, filtros.aniodesde, filtros.aniohasta,
+                                       filtros.ids)):
+        raise DatosNoValidos("Se debe indicar al menos un filtro de libros.")
+
+    return {
+        'precio': precio,
+        'porcentaje': porcentaje,
+        'ic': filtros.idcategoria,
+        'autor': filtros.autor,
+        'desde': filtros.aniodesde,
+        'hasta': filtros.aniohasta,
+        'ids': list(filtros.ids) if filtros.ids is not None else None,
+    }
+
+
+def revalorizar_precios(conn, filtros: FiltrosRevalorizacion, precio: float | None = None,
+                        porcentaje: float | None = None, simular: bool = False) -> ResumenRevalorizacion:
+    """
+    Registra un nuevo precio para todos los libros que cumplen los filtros, en una sola sentencia y
+    transaccion: el precio indicado o el actual de cada libro con un porcentaje de variacion (los libros sin
+    precio no cambian). Con simular=True solo calcula el resumen, sin modificar nada.
+    :param conn: La conexion con la base de datos
+    :param filtros: Los libros a revalorizar (al menos un filtro)
+    :param precio: El nuevo precio
+    :param porcentaje: El porcentaje de variacion, si no se indica precio
+    :param simular: Si es True, no se modifica ningun precio
+    :return: El resumen de la revalorizacion
+    """
+    params = _parametros_revalorizacion(filtros, precio, porcentaje)
+
+    def cuerpo(cur):
+        cur.execute(SQL_PREVISUALIZAR_REVALORIZACION if simular else SQL_REVALORIZAR, params)
+        resumen = ResumenRevalorizacion(simular, **cur.fetchone())
+        if not simular and resumen.libros > 0:
+            cache.notificar(cur, CACHE_LIBROS.nombre)
+        return resumen
+
+    resumen = _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    if not simular and resumen.libros > 0:
+        CACHE_LIBROS.invalidar()
+    return resumen
+
+
+def historial_precios(conn, id_libro: int, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Obtiene los precios que ha tenido un libro, del mas reciente al mas antiguo.
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :param limite: El numero maximo de precios de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de Precio
+    """
+    return _leer_pagina(conn, SQL_HISTORIAL_PRECIOS, {'i': id_libro}, limite, despues, Precio)
+
+
+def precios_en_fecha(conn, consultas: Iterable[tuple[int, datetime | date]]) -> list[PrecioEnFecha]:
+    """
+    Obtiene el precio que tenian varios libros en una fecha (cada uno en la suya), en una sola consulta.
+    :param conn: La conexion con la base de datos
+    :param consultas: Pares (id del libro, fecha); una fecha sin hora (date) es el final de ese dia
+    :return: El PrecioEnFecha de cada consulta, en el mismo orden
+    """
+    consultas = [(id_libro, fecha if isinstance(fecha, datetime) else datetime.combine(fecha, datetime.max.time()))
+                 for id_libro, fecha in consultas]
+    if not consultas:
+        return []
+
+    def cuerpo(cur):
+        cur.execute(SQL_PRECIOS_EN_FECHA, {
+            'libros': [id_libro for id_libro, _ in consultas],
+            'fechas': [fecha for _, fecha in consultas],
+        })
+        return [PrecioEnFecha(**fila) for fila in cur]
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def precio_en_fecha(conn, id_libro: int, fecha: datetime | date) -> PrecioEnFecha:
+    """
+    Obtiene el precio que tenia un libro en una fecha.
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :param fecha: La fecha (un date es el final de ese dia)
+    :return: El PrecioEnFecha del libro
+    """
+    return precios_en_fecha(conn, [(id_libro, fecha)])[0]
+
+
+def compactar_historial_precios(conn, id_libro: int | None = None) -> int:
+    """
+    Elimina del historial los precios iguales al anterior del mismo libro, que no cambian el precio en
+    ninguna fecha. Pensado para ejecutarse de vez en cuando (mantenimiento.py compactar-precios).
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro (None para todos)
+    :return: El numero de precios eliminados
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_COMPACTAR_HISTORIAL_PRECIOS, {'i': id_libro})
+        return cur.rowcount
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def crear_particion_precios(conn, anio: int) -> bool:
+    """
+    Crea la particion de preciolibro de un anio (preciolibro_AAAA) si no existe. Los precios de ese anio
+    que ya estuvieran en la particion por defecto se mueven a la nueva en la misma transaccion.
+    :param conn: La conexion con la base de datos
+    :param anio: El anio de la particion
+    :return: True si se ha creado la particion, False si ya existia
+    """
+    tabla = psycopg2.sql.Identifier(f"preciolibro_{anio}")
+    limites = {'desde': date(anio, 1, 1), 'hasta': date(anio + 1, 1, 1)}
+
+    def cuerpo(cur):
+        cur.execute("SELECT to_regclass(%(t)s) IS NOT NULL AS existe", {'t': f"preciolibro_{anio}"})
+        if cur.fetchone()['existe']:
+            return False
+
+        # Se bloquea la tabla para que no se inserten precios de ese anio en la particion por defecto
+        # mientras se mueven
+        cur.execute("LOCK TABLE preciolibro IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute(psycopg2.sql.SQL(
+            "CREATE TABLE {} (LIKE preciolibro INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(tabla))
+        cur.execute(psycopg2.sql.SQL("""
+            WITH movidos AS (
+                DELETE FROM
+                    preciolibro_defecto
+                WHERE
+                    fecha >= %(desde)s
+                    AND fecha < %(hasta)s
+                RETURNING
+                    *
+            )
+            INSERT INTO
+                {}
+            SELECT
+                *
+            FROM
+                movidos
+        """).format(tabla), limites)
+        cur.execute(psycopg2.sql.SQL(
+            "ALTER TABLE preciolibro ATTACH PARTITION {} FOR VALUES FROM (%(desde)s) TO (%(hasta)s)").format(tabla),
+            limites)
+        return True
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+# ------------------------------------------------------------
+# Categorias
+
+SQL_ANADIR_CATEGORIA = """
+    INSERT INTO
+        categoria (nombre, descripcion, diasprestamo)
+    VALUES
+        (%(n)s, %(d)s, coalesce(%(dp)s, %(dias)s))
+    RETURNING
+        id
+"""
+
+# Una sentencia por cada campo modificable de una categoria
+SQL_MODIFICAR_CATEGORIA = {
+    'nombre': """
+        UPDATE
+            categoria
+        SET
+            nombre = %(v)s
+        WHERE
+            id = %(i)s
+    """,
+    'descripcion': """
+        UPDATE
+            categoria
+        SET
+            descripcion = %(v)s
+        WHERE
+            id = %(i)s
+    """,
+    'diasprestamo': """
+        UPDATE
+            categoria
+        SET
+            diasprestamo = %(v)s
+        WHERE
+            id = %(i)s
+    """,
+}
+
+SQL_ELIMINAR_CATEGORIA = """
+    DELETE FROM
+        categoria
+    WHERE
+        id = %(i)s
+"""
+
+SQL_LISTAR_CATEGORIAS = """
+    SELECT
+        id,
+        nombre,
+        descripcion,
+        diasprestamo
+    FROM
+        categoria
+    WHERE
+        (%(k1)s IS NULL
+        OR (nombre, id) > (%(k1)s, %(k2)s))
+    ORDER BY
+        nombre,
+        id
+    LIMIT
+        %(n)s
+"""
+
+SQL_NOMBRES_CATEGORIAS = """
+    SELECT
+        id,
+        nombre
+    FROM
+        categoria
+    WHERE
+        id = ANY(CAST(%(ids)s AS BIGINT[]))
+"""
+
+
+def anadir_categoria(conn, nombre: str, descripcion: str, dias_prestamo: int | None = None) -> int:
+    """
+    Anade una categoria.
+    :param conn: La conexion con la base de datos
+    :param nombre: El nombre de la categoria (unico)
+    :param descripcion: La descripcion de la categoria
+    :param dias_prestamo: Los dias de prestamo de sus libros (None para DIAS_PRESTAMO_POR_DEFECTO)
+    :return: El id de la categoria anadida
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_ANADIR_CATEGORIA, {
+            'n': nombre, 'd': descripcion, 'dp': dias_prestamo, 'dias': DIAS_PRESTAMO_POR_DEFECTO,
+        })
+        return cur.fetchone()['id']
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def listar_categorias(conn, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Obtiene las categorias, por orden alfabetico.
+    :param conn: La conexion con la base de datos
+    :param limite: El numero maximo de categorias de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de Categoria
+    """
+    return _leer_pagina(conn, SQL_LISTAR_CATEGORIAS, {}, limite, despues, Categoria)
+
+
+def modificar_categoria(conn, id_categoria: int, cambios: dict) -> None:
+    """
+    Modifica los campos indicados de una categoria en una transaccion SERIALIZABLE.
+    :param conn: La conexion con la base de datos
+    :param id_categoria: El id de la categoria
+    :param cambios: Nuevo valor de cada campo a modificar (claves de SQL_MODIFICAR_CATEGORIA)
+    :return: None
+    """
+    for campo in cambios:
+        if campo not in SQL_MODIFICAR_CATEGORIA:
+            raise DatosNoValidos(f"El campo {campo} no se puede modificar.")
+
+    def cuerpo(cur):
+        for campo, valor in cambios.items():
+            cur.execute(SQL_MODIFICAR_CATEGORIA[campo], {'i': id_categoria, 'v': valor})
+            if cur.rowcount == 0:
+                raise NoEncontrado(f"La categoria con id {id_categoria} no existe.")
+        cache.notificar(cur, CACHE_CATEGORIAS.nombre, id_categoria)
+
+    _ejecutar_serializable(conn, 'modificar_categoria', cuerpo)
+    CACHE_CATEGORIAS.invalidar(id_categoria)
+
+
+def eliminar_categoria(conn, id_categoria: int) -> None:
+    """
+    Elimina una categoria. Sus libros quedan sin categoria, asi que se vacia tambien CACHE_LIBROS.
+    :param conn: La conexion con la base de datos
+    :param id_categoria: El id de la categoria
+    :return: None
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_ELIMINAR_CATEGORIA, {'i': id_categoria})
+        if cur.rowcount == 0:
+            raise NoEncontrado(f"La categoria con id {id_categoria} no existe.")
+        cache.notificar(cur, CACHE_CATEGORIAS.nombre, id_categoria)
+        cache.notificar(cur, CACHE_LIBROS.nombre)
+
+    _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    CACHE_CATEGORIAS.invalidar(id_categoria)
+    CACHE_LIBROS.invalidar()
+
+
+def nombres_categorias(conn, ids_categorias: Iterable[int | None]) -> dict[int, str]:
+    """
+    Obtiene el nombre de varias categorias, de CACHE_CATEGORIAS o, las que no esten, con una sola consulta.
+    :param conn: La conexion con la base de datos
+    :param ids_categorias: Los ids de las categorias (los None se ignoran)
+    :return: Diccionario con el nombre de cada categoria existente, por id
+    """
+    def cargar(faltan):
+        def cuerpo(cur):
+            cur.execute(SQL_NOMBRES_CATEGORIAS, {'ids': faltan})
+            return {fila['id']: fila['nombre'] for fila in cur}
+
+        return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+    return CACHE_CATEGORIAS.obtener_varios((i for i in ids_categorias if i is not None), cargar)
+
+
+# ------------------------------------------------------------
+# Prestamos
+
+# Dias de prestamo de los libros sin categoria (el mismo que el valor por defecto de categoria.diasprestamo)
+DIAS_PRESTAMO_POR_DEFECTO = 14
+
+# Ademas del prestamo, marca el libro como prestado y suma uno a los libros en posesion del estudiante.
+# El libro se bloquea (con la actualizacion) antes de insertar el prestamo, en el mismo orden que los
+# prestamos en lote; si ya tiene un prestamo abierto, la insercion falla por PrestamoLibroAbiertoUQ.
+# Si el libro no existe no se inserta nada. La fecha limite depende de los dias de prestamo de la categoria
+# del libro (DIAS_PRESTAMO_POR_DEFECTO si no tiene).
+SQL_EFECTUAR_PRESTAMO = """
+    WITH libro_prestado AS (
+        UPDATE
+            libro
+        SET
+            prestado = TRUE
+        WHERE
+            id = %(il)s
+        RETURNING
+            id, idcategoria
+    ), nuevo AS (
+        INSERT INTO
+            prestamo (fechaprestamo, fechalimite, comentarios, idlibro, idestudiante)
+        SELECT
+            NOW(), NOW() + make_interval(days => coalesce(c.diasprestamo, %(dias)s)), %(c)s, lp.id, %(ie)s
+        FROM
+            libro_prestado lp
+        LEFT JOIN
+            categoria c ON c.id = lp.idcategoria
+        RETURNING
+            id, idlibro, idestudiante
+    ), estudiante_prestado AS (
+        UPDATE
+            estudiante
+        SET
+            librosenposesion = librosenposesion + 1
+        WHERE
+            id IN (SELECT idestudiante FROM nuevo)
+    )
+    SELECT
+        id
+    FROM
+        nuevo
+"""
+
+SQL_HISTORIAL_PRESTAMOS_LIBRO = """
+    SELECT
+        p.id,
+        p.fechaprestamo,
+        p.fechadevolucion,
+        p.fechalimite,
+        p.comentarios,
+        p.idlibro,
+        NULL AS nombrelibro,
+        p.idestudiante,
+        e.nombre AS nombreestudiante
+    FROM
+        prestamo p
+    JOIN
+        estudiante e ON e.id = p.idestudiante
+    WHERE
+        p.idlibro = %(i)s
+        AND (%(k1)s IS NULL
+        OR (p.fechaprestamo, p.id) < (%(k1)s, %(k2)s))
+    ORDER BY
+        p.fechaprestamo DESC,
+        p.id DESC
+    LIMIT
+        %(n)s
+"""
+
+SQL_HISTORIAL_PRESTAMOS_ESTUDIANTE = """
+    SELECT
+        p.id,
+        p.fechaprestamo,
+        p.fechadevolucion,
+        p.fechalimite,
+        p.comentarios,
+        p.idlibro,
+        l.titulo AS nombrelibro,
+        p.idestudiante,
+        NULL AS nombreestudiante
+    FROM
+        prestamo p
+    JOIN
+        libro l ON l.id = p.idlibro
+    WHERE
+        p.idestudiante = %(i)s
+        AND (%(k1)s IS NULL
+        OR (p.fechaprestamo, p.id) < (%(k1)s, %(k2)s))
+    ORDER BY
+        p.fechaprestamo DESC,
+        p.id DESC
+    LIMIT
+        %(n)s
+"""
+
+SQL_CONSULTAR_PRESTAMO = """
+    SELECT
+        p.id,
+        p.fechaprestamo,
+        p.fechadevolucion,
+        p.fechalimite,
+        p.comentarios,
+        p.idlibro,
+        l.titulo AS nombrelibro,
+        p.idestudiante,
+        e.nombre AS nombreestudiante
+    FROM
+        prestamo p
+    JOIN
+        libro l ON l.id = p.idlibro
+    JOIN
+        estudiante e ON e.id = p.idestudiante
+    WHERE
+        p.id = %(i)s
+"""
+
+# Solo se finalizan prestamos abiertos. El libro vuelve a estar disponible si no
+# tiene otro prestamo abierto y el estudiante tiene un libro menos en posesion.
+SQL_FINALIZAR_PRESTAMO = """
+    WITH finalizado AS (
+        UPDATE
+            prestamo
+        SET
+            fechadevolucion = NOW()
+        WHERE
+            id = %(i)s
+            AND fechadevolucion IS NULL
+        RETURNING
+            id, idlibro, idestudiante
+    ), libro_devuelto AS (
+        UPDATE
+            libro l
+        SET
+            prestado = EXISTS (
+                SELECT 1
+                FROM prestamo p
+                WHERE p.idlibro = l.id
+                AND p.fechadevolucion IS NULL
+                AND p.id <> f.id
+            )
+        FROM
+            finalizado f
+        WHERE
+            l.id = f.idlibro
+    ), estudiante_devuelto AS (
+        UPDATE
+            estudiante
+        SET
+            librosenposesion = librosenposesion - 1
+        WHERE
+            id IN (SELECT idestudiante FROM finalizado)
+    )
+    SELECT
+        idlibro
+    FROM
+        finalizado
+"""
+
+# Si el prestamo estaba abierto, se actualizan tambien la disponibilidad del
+# libro y los libros en posesion del estudiante
+SQL_ELIMINAR_PRESTAMO = """
+    WITH eliminado AS (
+        DELETE FROM
+            prestamo
+        WHERE
+            id = %(i)s
+        RETURNING
+            id, idlibro, idestudiante, fechadevolucion
+    ), libro_devuelto AS (
+        UPDATE
+            libro l
+        SET
+            prestado = EXISTS (
+                SELECT 1
+                FROM prestamo p
+                WHERE p.idlibro = l.id
+                AND p.fechadevolucion IS NULL
+                AND p.id <> e.id
+            )
+        FROM
+            eliminado e
+        WHERE
+            l.id = e.idlibro
+            AND e.fechadevolucion IS NULL
+    ), estudiante_devuelto AS (
+        UPDATE
+            estudiante
+        SET
+            librosenposesion = librosenposesion - 1
+        WHERE
+            id IN (
+                SELECT idestudiante
+                FROM eliminado
+                WHERE fechadevolucion IS NULL
+            )
+    )
+    SELECT
+        idlibro
+    FROM
+        eliminado
+"""
+
+
+# Prestamos y devoluciones en lote: los elementos se validan todos a la vez, con los libros (o los
+# prestamos) bloqueados en orden de id para que dos lotes simultaneos no se crucen, y los validos se
+# procesan en la misma sentencia. Cada fila del resultado corresponde a un elemento del lote, en el orden
+# en que se indicaron; 'motivo' es NULL si se ha procesado. De un libro o prestamo repetido en el lote
+# solo se procesa el primer elemento que se puede procesar: en los prestamos, un elemento rechazado por otro
+# motivo no cuenta como anterior, asi que queda como mucho un elemento valido por libro.
+SQL_EFECTUAR_PRESTAMOS_LOTE = """
+    WITH solicitud AS (
+        SELECT
+            posicion, idlibro, idestudiante
+        FROM
+            unnest(CAST(%(libros)s AS BIGINT[]), CAST(%(estudiantes)s AS BIGINT[]))
+            WITH ORDINALITY AS s (idlibro, idestudiante, posicion)
+    ), libros AS (
+        SELECT
+            id, prestado, idcategoria
+        FROM
+            libro
+        WHERE
+            id IN (SELECT idlibro FROM solicitud)
+        ORDER BY
+            id
+        FOR UPDATE
+    ), comprobada AS (
+        SELECT
+            s.posicion,
+            s.idlibro,
+            s.idestudiante,
+            CASE
+                WHEN l.id IS NULL THEN 'El libro no existe.'
+                WHEN NOT EXISTS (SELECT 1 FROM estudiante e WHERE e.id = s.idestudiante)
+                    THEN 'El estudiante no existe.'
+                WHEN l.prestado THEN 'El libro ya esta prestado.'
+            END AS motivo
+        FROM
+            solicitud s
+        LEFT JOIN
+            libros l ON l.id = s.idlibro
+    ), validada AS (
+        SELECT
+            posicion,
+            idlibro,
+            idestudiante,
+            CASE
+                WHEN motivo IS NULL
+                    AND row_number() OVER (PARTITION BY idlibro, motivo IS NULL ORDER BY posicion) > 1
+                    THEN 'El libro esta repetido en el lote.'
+                ELSE motivo
+            END AS motivo
+        FROM
+            comprobada
+    ), nuevos AS (
+        INSERT INTO
+            prestamo (fechaprestamo, fechalimite, comentarios, idlibro, idestudiante)
+        SELECT
+            NOW(), NOW() + make_interval(days => coalesce(c.diasprestamo, %(dias)s)), %(c)s, v.idlibro, v.idestudiante
+        FROM
+            validada v
+        JOIN
+            libros l ON l.id = v.idlibro
+        LEFT JOIN
+            categoria c ON c.id = l.idcategoria
+        WHERE
+            v.motivo IS NULL
+        ORDER BY
+            v.posicion
+        RETURNING
+            id, idlibro, idestudiante
+    ), libros_prestados AS (
+        UPDATE
+            libro
+        SET
+            prestado = TRUE
+        WHERE
+            id IN (SELECT idlibro FROM nuevos)
+    ), estudiantes_prestados AS (
+        UPDATE
+            estudiante e
+        SET
+            librosenposesion = librosenposesion + n.libros
+        FROM (
+            SELECT idestudiante, count(*) AS libros
+            FROM nuevos
+            GROUP BY idestudiante
+        ) n
+        WHERE
+            e.id = n.idestudiante
+    )
+    SELECT
+        v.posicion,
+        n.id AS idprestamo,
+        v.idlibro,
+        v.idestudiante,
+        v.motivo
+    FROM
+        validada v
+    LEFT JOIN
+        nuevos n ON n.idlibro = v.idlibro AND v.motivo IS NULL
+    ORDER BY
+        v.posicion
+"""
+
+SQL_FINALIZAR_PRESTAMOS_LOTE = """
+    WITH solicitud AS (
+        SELECT
+            posicion, idprestamo
+        FROM
+            unnest(CAST(%(ids)s AS BIGINT[])) WITH ORDINALITY AS s (idprestamo, posicion)
+    ), prestamos AS (
+        SELECT
+            id, idlibro, idestudiante, fechadevolucion
+        FROM
+            prestamo
+        WHERE
+            id IN (SELECT idprestamo FROM solicitud)
+        ORDER BY
+            id
+        FOR UPDATE
+    ), validada AS (
+        SELECT
+            s.posicion,
+            s.idprestamo,
+            p.idlibro,
+            p.idestudiante,
+            CASE
+                WHEN p.id IS NULL THEN 'El prestamo no existe.'
+                WHEN p.fechadevolucion IS NOT NULL THEN 'El prestamo ya estaba finalizado.'
+                WHEN EXISTS (
+                    SELECT 1
+                    FROM solicitud o
+                    WHERE o.idprestamo = s.idprestamo
+                    AND o.posicion < s.posicion
+                ) THEN 'El prestamo esta repetido en el lote.'
+            END AS motivo
+        FROM
+            solicitud s
+        LEFT JOIN
+            prestamos p ON p.id = s.idprestamo
+    ), finalizados AS (
+        UPDATE
+            prestamo
+        SET
+            fechadevolucion = NOW()
+        WHERE
+            id IN (SELECT idprestamo FROM validada WHERE motivo IS NULL)
+        RETURNING
+            id, idlibro, idestudiante
+    ), libros_devueltos AS (
+        UPDATE
+            libro l
+        SET
+            prestado = EXISTS (
+                SELECT 1
+                FROM prestamo p
+                WHERE p.idlibro = l.id
+                AND p.fechadevolucion IS NULL
+                AND p.id NOT IN (SELECT id FROM finalizados)
+            )
+        WHERE
+            l.id IN (SELECT idlibro FROM finalizados)
+    ), estudiantes_devueltos AS (
+        UPDATE
+            estudiante e
+        SET
+            librosenposesion = librosenposesion - f.libros
+        FROM (
+            SELECT idestudiante, count(*) AS libros
+            FROM finalizados
+            GROUP BY idestudiante
+        ) f
+        WHERE
+            e.id = f.idestudiante
+    )
+    SELECT
+        posicion,
+        idprestamo,
+        idlibro,
+        idestudiante,
+        motivo
+    FROM
+        validada
+    ORDER BY
+        posicion
+"""
+
+
+def efectuar_prestamo(conn, id_libro: int, id_estudiante: int, comentarios: str | None = None) -> int:
+    """
+    Presta un libro a un estudiante con fecha de hoy. Si el libro ya tiene un prestamo abierto, falla con
+    Duplicado; dos prestamos simultaneos del mismo libro se hacen uno detras de otro, asi que solo uno de
+    los dos se efectua.
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :param id_estudiante: El id del estudiante
+    :param comentarios: Comentarios sobre el prestamo
+    :return: El id del prestamo
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_EFECTUAR_PRESTAMO, {
+            'c': comentarios, 'il': id_libro, 'ie': id_estudiante, 'dias': DIAS_PRESTAMO_POR_DEFECTO,
+        })
+        fila = cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("El libro especificado no existe.")
+        id_prestamo = fila['id']
+        cache.notificar(cur, CACHE_LIBROS.nombre, id_libro)
+        return id_prestamo
+
+    id_prestamo = _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    CACHE_LIBROS.invalidar(id_libro)
+    return id_prestamo
+
+
+def efectuar_prestamos(conn, prestamos: Iterable[tuple[int, int]], comentarios: str | None = None) -> list[ResultadoLote]:
+    """
+    Presta varios libros con fecha de hoy en una sola transaccion (por ejemplo, los ejemplares de un libro de
+    texto a los estudiantes de una clase). Los elementos que no se pueden prestar (libro o estudiante
+    inexistente, libro ya prestado o repetido en el lote) se devuelven con su motivo y no impiden prestar
+    el resto.
+    :param conn: La conexion con la base de datos
+    :param prestamos: Pares (id del libro, id del estudiante)
+    :param comentarios: Comentarios de todos los prestamos
+    :return: El resultado de cada elemento, en el orden en que se indicaron
+    """
+    prestamos = list(prestamos)
+    if not prestamos:
+        return []
+
+    def cuerpo(cur):
+        cur.execute(SQL_EFECTUAR_PRESTAMOS_LOTE, {
+            'libros': [id_libro for id_libro, _ in prestamos],
+            'estudiantes': [id_estudiante for _, id_estudiante in prestamos],
+            'c': comentarios,
+            'dias': DIAS_PRESTAMO_POR_DEFECTO,
+        })
+        resultados = [ResultadoLote(**fila) for fila in cur]
+        for resultado in resultados:
+            if resultado.idprestamo is not None:
+                cache.notificar(cur, CACHE_LIBROS.nombre, resultado.idlibro)
+        return resultados
+
+    resultados = _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    for resultado in resultados:
+        if resultado.idprestamo is not None:
+            CACHE_LIBROS.invalidar(resultado.idlibro)
+    return resultados
+
+
+def historial_prestamos_libro(conn, id_libro: int, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Obtiene los prestamos de un libro, del mas reciente al mas antiguo.
+    :param conn: La conexion con la base de datos
+    :param id_libro: El id del libro
+    :param limite: El numero maximo de prestamos de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de Prestamo
+    """
+    return _leer_pagina(conn, SQL_HISTORIAL_PRESTAMOS_LIBRO, {'i': id_libro}, limite, despues, Prestamo)
+
+
+def historial_prestamos_estudiante(conn, id_estudiante: int, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Obtiene los prestamos de un estudiante, del mas reciente al mas antiguo.
+    :param conn: La conexion con la base de datos
+    :param id_estudiante: El id del estudiante
+    :param limite: El numero maximo de prestamos de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de Prestamo
+    """
+    return _leer_pagina(conn, SQL_HISTORIAL_PRESTAMOS_ESTUDIANTE, {'i': id_estudiante}, limite, despues, Prestamo)
+
+
+def consultar_prestamo(conn, id_prestamo: int) -> Prestamo:
+    """
+    Obtiene un prestamo con el titulo del libro y el nombre del estudiante.
+    :param conn: La conexion con la base de datos
+    :param id_prestamo: El id del prestamo
+    :return: El prestamo
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_CONSULTAR_PRESTAMO, {'i': id_prestamo})
+        fila = cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("No se ha encontrado el prestamo.")
+        return Prestamo(**fila)
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def finalizar_prestamo(conn, id_prestamo: int) -> None:
+    """
+    Da por finalizado un prestamo abierto con fecha de devolucion de hoy.
+    :param conn: La conexion con la base de datos
+    :param id_prestamo: El id del prestamo
+    :return: None
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_FINALIZAR_PRESTAMO, {'i': id_prestamo})
+        fila = cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("No se ha encontrado el prestamo o ya estaba finalizado.")
+        if fila['idlibro'] is not None:
+            cache.notificar(cur, CACHE_LIBROS.nombre, fila['idlibro'])
+        return fila['idlibro']
+
+    id_libro = _ejecutar_serializable(conn, 'finalizar_prestamo', cuerpo)
+    if id_libro is not None:
+        CACHE_LIBROS.invalidar(id_libro)
+
+
+def finalizar_prestamos(conn, ids_prestamos: Iterable[int]) -> list[ResultadoLote]:
+    """
+    Da por finalizados varios prestamos abiertos con fecha de devolucion de hoy, en una sola transaccion.
+    Los que no se pueden finalizar (inexistentes, ya finalizados o repetidos en el lote) se devuelven con su
+    motivo y no impiden finalizar el resto.
+    :param conn: La conexion con la base de datos
+    :param ids_prestamos: Los ids de los prestamos
+    :return: El resultado de cada prestamo, en el orden en que se indicaron
+    """
+    ids = list(ids_prestamos)
+    if not ids:
+        return []
+
+    def cuerpo(cur):
+        cur.execute(SQL_FINALIZAR_PRESTAMOS_LOTE, {'ids': ids})
+        resultados = [ResultadoLote(**fila) for fila in cur]
+        for resultado in resultados:
+            if resultado.motivo is None and resultado.idlibro is not None:
+                cache.notificar(cur, CACHE_LIBROS.nombre, resultado.idlibro)
+        return resultados
+
+    resultados = _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    for resultado in resultados:
+        if resultado.motivo is None and resultado.idlibro is not None:
+            CACHE_LIBROS.invalidar(resultado.idlibro)
+    return resultados
+
+
+def eliminar_prestamo(conn, id_prestamo: int) -> None:
+    """
+    Elimina el registro de un prestamo.
+    :param conn: La conexion con la base de datos
+    :param id_prestamo: El id del prestamo
+    :return: None
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_ELIMINAR_PRESTAMO, {'i': id_prestamo})
+        fila = cur.fetchone()
+        if fila is None:
+            raise NoEncontrado(f"El prestamo con id {id_prestamo} no existe.")
+        if fila['idlibro'] is not None:
+            cache.notificar(cur, CACHE_LIBROS.nombre, fila['idlibro'])
+        return fila['idlibro']
+
+    id_libro = _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+    if id_libro is not None:
+        CACHE_LIBROS.invalidar(id_libro)
+
+
+# ------------------------------------------------------------
+# Estudiantes
+
+SQL_ANADIR_ESTUDIANTE = """
+    INSERT INTO
+        estudiante (nombre, apellidos, curso, email, telefono)
+    VALUES
+        (%(nombre)s, %(apellidos)s, %(curso)s, %(email)s, %(telefono)s)
+    RETURNING
+        id
+"""
+
+# Los libros en posesion se agregan en JSON en la misma consulta; la subconsulta usa el indice
+# de prestamos abiertos por estudiante (PrestamoEstudianteAbiertoIDX)
+SQL_CONSULTAR_ESTUDIANTE = """
+    SELECT
+        e.id,
+        e.nombre,
+        e.apellidos,
+        e.curso,
+        e.email,
+        e.telefono,
+        e.librosenposesion,
+        e.version,
+        coalesce((
+            SELECT
+                json_agg(json_build_object(
+                    'idprestamo', p.id,
+                    'idlibro', p.idlibro,
+                    'titulo', l.titulo,
+                    'fechaprestamo', p.fechaprestamo,
+                    'dias', CURRENT_DATE - CAST(p.fechaprestamo AS DATE)
+                ) ORDER BY p.fechaprestamo, p.id)
+            FROM
+                prestamo p
+            LEFT JOIN
+                libro l ON l.id = p.idlibro
+            WHERE
+                p.idestudiante = e.id
+                AND p.fechadevolucion IS NULL
+        ), '[]') AS prestados
+    FROM
+        estudiante e
+    WHERE
+         e.id = %(i)s
+"""
+
+# Promocion de estudiantes en una sola sentencia, por lista de ids o por curso
+SQL_AUMENTAR_CURSO = """
+    UPDATE
+        estudiante
+    SET
+        curso = curso + 1,
+        version = version + 1
+    WHERE
+        id = ANY(CAST(%(ids)s AS BIGINT[]))
+    RETURNING
+        id
+"""
+
+SQL_AUMENTAR_CURSO_COMPLETO = """
+    UPDATE
+        estudiante
+    SET
+        curso = curso + 1,
+        version = version + 1
+    WHERE
+        curso = %(c)s
+    RETURNING
+        id
+"""
+
+# Campos modificables de un estudiante y columna de cada uno (ver SQL_MODIFICAR_LIBRO)
+COLUMNAS_MODIFICAR_ESTUDIANTE = {
+    'nombre': "nombre",
+    'apellidos': "apellidos",
+    'curso': "curso",
+    'email': "email",
+    'telefono': "telefono",
+}
+
+SQL_MODIFICAR_ESTUDIANTE = """
+    UPDATE
+        estudiante
+    SET
+        {asignaciones}
+        version = version + 1
+    WHERE
+        id = %(i)s
+        AND (%(version)s IS NULL
+        OR version = %(version)s)
+    RETURNING
+        version
+"""
+
+SQL_VERSION_ESTUDIANTE = """
+    SELECT
+        version
+    FROM
+        estudiante
+    WHERE
+        id = %(i)s
+"""
+
+SQL_ELIMINAR_ESTUDIANTE = """
+    DELETE
+    FROM
+        estudiante
+    WHERE
+        id = %(i)s
+"""
+
+
+def anadir_estudiante(conn, estudiante: EstudianteNuevo) -> int:
+    """
+    Anade un estudiante.
+    :param conn: La conexion con la base de datos
+    :param estudiante: Los datos del estudiante
+    :return: El id del estudiante anadido
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_ANADIR_ESTUDIANTE, vars(estudiante))
+        return cur.fetchone()['id']
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def consultar_estudiante(conn, id_estudiante: int) -> Estudiante:
+    """
+    Obtiene los datos de un estudiante y los libros que tiene en posesion, en una sola consulta.
+    :param conn: La conexion con la base de datos
+    :param id_estudiante: El id del estudiante
+    :return: El estudiante
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_CONSULTAR_ESTUDIANTE, {'i': id_estudiante})
+        fila = cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("No se ha encontrado el estudiante.")
+        return Estudiante(**fila)
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def aumentar_curso(conn, ids_estudiantes: list[int]) -> tuple[list[int], list[int]]:
+    """
+    Aumenta en uno el curso de varios estudiantes con una sola sentencia, en una transaccion SERIALIZABLE
+    que se repite automaticamente si falla por un conflicto con otra transaccion.
+    :param conn: La conexion con la base de datos
+    :param ids_estudiantes: Los ids de los estudiantes (los repetidos se promocionan una sola vez)
+    :return: Los ids actualizados y los ids que no existen, en el orden en que se indicaron
+    """
+    ids = list(dict.fromkeys(ids_estudiantes))
+
+    def cuerpo(cur):
+        cur.execute(SQL_AUMENTAR_CURSO, {'ids': ids})
+        return {fila['id'] for fila in cur}
+
+    promocionados = _ejecutar_serializable(conn, 'aumentar_curso', cuerpo)
+    return ([id_estudiante for id_estudiante in ids if id_estudiante in promocionados],
+            [id_estudiante for id_estudiante in ids if id_estudiante not in promocionados])
+
+
+def aumentar_curso_completo(conn, curso: int) -> list[int]:
+    """
+    Aumenta en uno el curso de todos los estudiantes de un curso con una sola sentencia, en una transaccion
+    SERIALIZABLE que se repite automaticamente si falla por un conflicto con otra transaccion.
+    :param conn: La conexion con la base de datos
+    :param curso: El curso a promocionar
+    :return: Los ids de los estudiantes promocionados
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_AUMENTAR_CURSO_COMPLETO, {'c': curso})
+        return sorted(fila['id'] for fila in cur)
+
+    return _ejecutar_serializable(conn, 'aumentar_curso_completo', cuerpo)
+
+
+def modificar_estudiante(conn, id_estudiante: int, cambios: dict, version: int | None = None) -> int:
+    """
+    Modifica los campos indicados de un estudiante con una sola sentencia. Si se indica la version del
+    estudiante leida antes de preparar los cambios (Estudiante.version) y el estudiante se ha modificado
+    despues, no se cambia nada y se lanza ConflictoConcurrencia.
+    :param conn: La conexion con la base de datos
+    :param id_estudiante: El id del estudiante
+    :param cambios: Nuevo valor de cada campo a modificar (claves de COLUMNAS_MODIFICAR_ESTUDIANTE)
+    :param version: La version del estudiante leida, o None para modificarlo sin comprobarla
+    :return: La nueva version del estudiante
+    """
+    for campo in cambios:
+        if campo not in COLUMNAS_MODIFICAR_ESTUDIANTE:
+            raise DatosNoValidos(f"El campo {campo} no se puede modificar.")
+
+    def cuerpo(cur):
+        cur.execute(SQL_MODIFICAR_ESTUDIANTE.format(
+            asignaciones=_asignaciones(COLUMNAS_MODIFICAR_ESTUDIANTE, cambios)),
+            {**cambios, 'i': id_estudiante, 'version': version})
+        fila = cur.fetchone()
+        if fila is None:
+            cur.execute(SQL_VERSION_ESTUDIANTE, {'i': id_estudiante})
+            if cur.fetchone() is None:
+                raise NoEncontrado(f"El estudiante con id {id_estudiante} no existe.")
+            raise ConflictoConcurrencia("Otro usuario ha modificado el estudiante despues de consultarlo.")
+        return fila['version']
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def eliminar_estudiante(conn, id_estudiante: int) -> None:
+    """
+    Elimina un estudiante. Sus prestamos se conservan sin estudiante asociado.
+    :param conn: La conexion con la base de datos
+    :param id_estudiante: El id del estudiante
+    :return: None
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_ELIMINAR_ESTUDIANTE, {'i': id_estudiante})
+        if cur.rowcount == 0:
+            raise NoEncontrado(f"El estudiante con id {id_estudiante} no existe.")
+
+    _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+# ------------------------------------------------------------
+# Informes
+
+@dataclass
+class PrestamoVencido:
+    """Un prestamo abierto que ha pasado su fecha limite, con los dias de retraso."""
+    idprestamo: int
+    idlibro: int | None
+    titulo: str | None
+    fechaprestamo: datetime
+    fechalimite: datetime
+    diasretraso: int
+
+
+@dataclass
+class VencidosEstudiante:
+    """Un estudiante con prestamos vencidos, de la fecha limite mas antigua a la mas reciente."""
+    idestudiante: int
+    nombre: str
+    apellidos: str
+    curso: int
+    email: str
+    prestamos: list[PrestamoVencido]
+
+    def __post_init__(self):
+        # La consulta devuelve los prestamos como JSON, con las fechas en texto
+        self.prestamos = [
+            PrestamoVencido(**{**p, 'fechaprestamo': datetime.fromisoformat(p['fechaprestamo']),
+                               'fechalimite': datetime.fromisoformat(p['fechalimite'])})
+            if isinstance(p, dict) else p
+            for p in self.prestamos
+        ]
+
+
+# Proceso incremental de informes.py que envia los recordatorios de prestamos vencidos
+PROCESO_RECORDATORIOS = 'recordatorios'
+
+# Prestamos abiertos con la fecha limite entre %(desde)s (NULL: sin limite) y ahora, agrupados por
+# estudiante y ordenados por curso. Los vencidos se leen como un rango de PrestamoVencimientoIDX.
+SQL_INFORME_VENCIDOS = """
+    SELECT
+        e.id AS idestudiante,
+        e.nombre,
+        e.apellidos,
+        e.curso,
+        e.email,
+        json_agg(json_build_object(
+            'idprestamo', p.id,
+            'idlibro', p.idlibro,
+            'titulo', l.titulo,
+            'fechaprestamo', p.fechaprestamo,
+            'fechalimite', p.fechalimite,
+            'diasretraso', CURRENT_DATE - CAST(p.fechalimite AS DATE)
+        ) ORDER BY p.fechalimite, p.id) AS prestamos
+    FROM
+        prestamo p
+    JOIN
+        estudiante e ON e.id = p.idestudiante
+    LEFT JOIN
+        libro l ON l.id = p.idlibro
+    WHERE
+        p.fechadevolucion IS NULL
+        AND p.fechalimite < NOW()
+        AND (CAST(%(desde)s AS TIMESTAMP) IS NULL OR p.fechalimite >= %(desde)s)
+        AND (CAST(%(curso)s AS SMALLINT) IS NULL OR e.curso = %(curso)s)
+    GROUP BY
+        e.id
+    ORDER BY
+        e.curso,
+        e.apellidos,
+        e.nombre,
+        e.id
+"""
+
+# Lee el instante hasta el que se ha procesado un proceso incremental (o lo crea, con NULL porque aun no
+# ha procesado nada) y bloquea su fila, de modo que dos ejecuciones simultaneas del mismo proceso se hacen una detras de otra
+SQL_BLOQUEAR_MARCA = """
+    INSERT INTO
+        marcainforme (nombre, hasta)
+    VALUES
+        (%(n)s, NULL)
+    ON CONFLICT (nombre) DO UPDATE SET
+        hasta = marcainforme.hasta
+    RETURNING
+        hasta
+"""
+
+SQL_AVANZAR_MARCA = """
+    UPDATE
+        marcainforme
+    SET
+        hasta = NOW()
+    WHERE
+        nombre = %(n)s
+"""
+
+
+def informe_vencidos(conn, curso: int | None = None) -> list[VencidosEstudiante]:
+    """
+    Obtiene los prestamos vencidos (abiertos y con la fecha limite ya pasada), agrupados por estudiante.
+    :param conn: La conexion con la base de datos
+    :param curso: El curso de los estudiantes (None para todos)
+    :return: Los estudiantes con prestamos vencidos, por curso, apellidos y nombre
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_INFORME_VENCIDOS, {'desde': None, 'curso': curso})
+        return [VencidosEstudiante(**fila) for fila in cur]
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def vencidos_desde_ultima_vez(conn, proceso: str = PROCESO_RECORDATORIOS) -> list[VencidosEstudiante]:
+    """
+    Obtiene los prestamos abiertos que han vencido desde la ultima ejecucion del proceso y la marca como
+    hecha hasta ahora, en la misma transaccion: si falla, la siguiente ejecucion vuelve a incluirlos. La
+    primera ejecucion de un proceso incluye todos los vencidos.
+    :param conn: La conexion con la base de datos
+    :param proceso: El nombre del proceso incremental
+    :return: Los estudiantes con prestamos vencidos desde la ultima ejecucion, por curso, apellidos y nombre
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_BLOQUEAR_MARCA, {'n': proceso})
+        desde = cur.fetchone()['hasta']
+        cur.execute(SQL_INFORME_VENCIDOS, {'desde': desde, 'curso': None})
+        vencidos = [VencidosEstudiante(**fila) for fila in cur]
+        cur.execute(SQL_AVANZAR_MARCA, {'n': proceso})
+        return vencidos
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+@dataclass
+class LibroMasPrestado:
+    """Un libro de los mas prestados de su categoria en un mes. 'posicion' empieza en 1 en cada categoria."""
+    idcategoria: int | None
+    nombrecategoria: str | None
+    posicion: int
+    idlibro: int
+    titulo: str
+    autor: str | None
+    prestamos: int
+
+
+@dataclass
+class DuracionPrestamos:
+    """
+    Numero de prestamos de una categoria (o de todas, si 'total' es True) y duracion media en dias de los
+    que ya se han devuelto (None si no hay ninguno).
+    """
+    idcategoria: int | None
+    nombrecategoria: str | None
+    total: bool
+    prestamos: int
+    devueltos: int
+    diasmedios: float | None
+
+
+@dataclass
+class LibroNuncaPrestado:
+    id: int
+    titulo: str
+    autor: str | None
+    idcategoria: int | None
+    nombrecategoria: str | None
+
+    @property
+    def clave(self):
+        return (self.id, None)
+
+
+# Marca de marcainforme con el instante de los datos de las estadisticas de circulacion
+PROCESO_ESTADISTICAS = 'estadisticas'
+
+# Vistas materializadas de las estadisticas de circulacion (ver create_tables.sql), en el orden en que se
+# refrescan: circulacioncategoria se calcula a partir de circulacionmensual
+VISTAS_ESTADISTICAS = ('circulacionmensual', 'circulacioncategoria', 'libronuncaprestado')
+
+SQL_REFRESCAR_ESTADISTICAS = {
+    vista: f"REFRESH MATERIALIZED VIEW CONCURRENTLY {vista}" for vista in VISTAS_ESTADISTICAS
+}
+
+SQL_MARCAR_ESTADISTICAS = """
+    INSERT INTO
+        marcainforme (nombre, hasta)
+    VALUES
+        (%(n)s, NOW())
+    ON CONFLICT (nombre) DO UPDATE SET
+        hasta = EXCLUDED.hasta
+    RETURNING
+        hasta
+"""
+
+SQL_FECHA_ESTADISTICAS = """
+    SELECT
+        hasta
+    FROM
+        marcainforme
+    WHERE
+        nombre = %(n)s
+"""
+
+# Para cada categoria con prestamos en el mes se leen sus primeros libros en el orden de
+# CirculacionMensualCategoriaIDX; los libros sin categoria (idcategoria NULL) se leen en la segunda rama
+SQL_LIBROS_MAS_PRESTADOS = """
+    SELECT
+        cc.idcategoria,
+        c.nombre AS nombrecategoria,
+        row_number() OVER (PARTITION BY cc.idcategoria ORDER BY m.prestamos DESC, m.idlibro) AS posicion,
+        m.idlibro,
+        l.titulo,
+        l.autor,
+        m.prestamos
+    FROM
+        circulacioncategoria cc
+    CROSS JOIN LATERAL (
+        (SELECT
+            idlibro, prestamos
+        FROM
+            circulacionmensual
+        WHERE
+            mes = cc.mes
+            AND idcategoria = cc.idcategoria
+        ORDER BY
+            prestamos DESC,
+            idlibro
+        LIMIT
+            %(n)s)
+        UNION ALL
+        (SELECT
+            idlibro, prestamos
+        FROM
+            circulacionmensual
+        WHERE
+            cc.idcategoria IS NULL
+            AND mes = cc.mes
+            AND idcategoria IS NULL
+        ORDER BY
+            prestamos DESC,
+            idlibro
+        LIMIT
+            %(n)s)
+    ) m
+    JOIN
+        libro l ON l.id = m.idlibro
+    LEFT JOIN
+        categoria c ON c.id = cc.idcategoria
+    WHERE
+        cc.mes = %(mes)s
+        AND (CAST(%(ic)s AS BIGINT) IS NULL OR cc.idcategoria = %(ic)s)
+    ORDER BY
+        c.nombre NULLS LAST,
+        cc.idcategoria,
+        posicion
+"""
+
+# Una fila por categoria y otra con el total (GROUPING), para los prestamos hechos entre los meses indicados
+SQL_DURACION_PRESTAMOS = """
+    SELECT
+        cc.idcategoria,
+        c.nombre AS nombrecategoria,
+        GROUPING(cc.idcategoria) = 1 AS total,
+        CAST(sum(cc.prestamos) AS BIGINT) AS prestamos,
+        CAST(sum(cc.devueltos) AS BIGINT) AS devueltos,
+        sum(cc.diasprestado) / nullif(sum(cc.devueltos), 0) AS diasmedios
+    FROM
+        circulacioncategoria cc
+    LEFT JOIN
+        categoria c ON c.id = cc.idcategoria
+    WHERE
+        (CAST(%(desde)s AS DATE) IS NULL OR cc.mes >= %(desde)s)
+        AND (CAST(%(hasta)s AS DATE) IS NULL OR cc.mes <= %(hasta)s)
+    GROUP BY
+        GROUPING SETS ((cc.idcategoria, c.nombre), ())
+    ORDER BY
+        total,
+        c.nombre NULLS LAST
+"""
+
+SQL_LIBROS_NUNCA_PRESTADOS = """
+    SELECT
+        n.id,
+        l.titulo,
+        l.autor,
+        l.idcategoria,
+        c.nombre AS nombrecategoria
+    FROM
+        libronuncaprestado n
+    JOIN
+        libro l ON l.id = n.id
+    LEFT JOIN
+        categoria c ON c.id = l.idcategoria
+    WHERE
+        (CAST(%(ic)s AS BIGINT) IS NULL OR l.idcategoria = %(ic)s)
+        AND (CAST(%(k1)s AS BIGINT) IS NULL OR n.id > %(k1)s)
+    ORDER BY
+        n.id
+    LIMIT
+        %(n)s
+"""
+
+
+def refrescar_estadisticas(conn) -> datetime:
+    """
+    Vuelve a calcular las estadisticas de circulacion. Las vistas se refrescan CONCURRENTLY, asi que se
+    pueden seguir consultando mientras tanto. Pensado para ejecutarse periodicamente (informes.py refrescar).
+    :param conn: La conexion con la base de datos
+    :return: El instante de los datos de las estadisticas
+    """
+    def cuerpo(cur):
+        for vista in VISTAS_ESTADISTICAS:
+            cur.execute(SQL_REFRESCAR_ESTADISTICAS[vista])
+        cur.execute(SQL_MARCAR_ESTADISTICAS, {'n': PROCESO_ESTADISTICAS})
+        return cur.fetchone()['hasta']
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def fecha_estadisticas(conn) -> datetime | None:
+    """
+    Obtiene el instante de los datos de las estadisticas de circulacion.
+    :param conn: La conexion con la base de datos
+    :return: El instante del ultimo refresco, o None si no se han refrescado nunca
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_FECHA_ESTADISTICAS, {'n': PROCESO_ESTADISTICAS})
+        fila = cur.fetchone()
+        return fila['hasta'] if fila is not None else None
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def libros_mas_prestados(conn, mes: date, id_categoria: int | None = None,
+                         limite: int = 5) -> list[LibroMasPrestado]:
+    """
+    Obtiene los libros mas prestados de cada categoria en un mes, segun las estadisticas de circulacion.
+    :param conn: La conexion con la base de datos
+    :param mes: Cualquier dia del mes
+    :param id_categoria: El id de la categoria (None para todas)
+    :param limite: El numero de libros de cada categoria
+    :return: Los libros, por categoria y de mas a menos prestamos
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_LIBROS_MAS_PRESTADOS, {'mes': mes.replace(day=1), 'ic': id_categoria, 'n': limite})
+        return [LibroMasPrestado(**fila) for fila in cur]
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def duracion_prestamos(conn, desde: date | None = None, hasta: date | None = None) -> list[DuracionPrestamos]:
+    """
+    Obtiene la duracion media de los prestamos por categoria y en total, segun las estadisticas de circulacion.
+    :param conn: La conexion con la base de datos
+    :param desde: Cualquier dia del primer mes (None: desde el principio)
+    :param hasta: Cualquier dia del ultimo mes (None: hasta el final)
+    :return: Una fila por categoria, por nombre, y la fila del total al final
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_DURACION_PRESTAMOS, {
+            'desde': desde.replace(day=1) if desde is not None else None,
+            'hasta': hasta.replace(day=1) if hasta is not None else None,
+        })
+        return [DuracionPrestamos(**fila) for fila in cur]
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def libros_nunca_prestados(conn, limite: int, despues: tuple | None = None,
+                           id_categoria: int | None = None) -> Pagina:
+    """
+    Obtiene los libros que no se han prestado nunca, segun las estadisticas de circulacion, por id.
+    :param conn: La conexion con la base de datos
+    :param limite: El numero maximo de libros de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :param id_categoria: El id de la categoria (None para todas)
+    :return: Una Pagina de LibroNuncaPrestado
+    """
+    return _leer_pagina(conn, SQL_LIBROS_NUNCA_PRESTADOS, {'ic': id_categoria}, limite, despues, LibroNuncaPrestado)
+
+
+# ------------------------------------------------------------
+# Importacion masiva
+
+# Columnas de los ficheros de importacion de libros. 'categoria' es el nombre de la categoria.
+COLUMNAS_IMPORTACION = ("titulo", "autor", "aniopublicacion", "isbn", "sinopsis", "categoria", "precio")
+
+
+@dataclass
+class Rechazado:
+    """Un registro de un fichero de importacion que no se ha importado."""
+    linea: int
+    isbn: str | None
+    titulo: str | None
+    motivo: str
+
+
+@dataclass
+class ResultadoImportacion:
+    """Resultado de importar_libros: libros y precios anadidos y registros rechazados."""
+    importados: int
+    precios: int
+    rechazados: list[Rechazado]
+
+
+# Los registros se cargan como texto en una tabla temporal, de modo que COPY nunca falla por los datos;
+# la validacion se hace despues con SQL sobre todos los registros a la vez.
+SQL_CREAR_IMPORTACION = """
+    CREATE TEMPORARY TABLE importacion (
+        linea INTEGER NOT NULL,
+        titulo TEXT,
+        autor TEXT,
+        aniopublicacion TEXT,
+        isbn TEXT,
+        sinopsis TEXT,
+        categoria TEXT,
+        precio TEXT,
+        idcategoria BIGINT,
+        motivo TEXT
+    ) ON COMMIT DROP
+"""
+
+SQL_COPIAR_IMPORTACION = """
+    COPY importacion (linea, titulo, autor, aniopublicacion, isbn, sinopsis, categoria, precio)
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+# Las tablas temporales no las analiza autovacuum: sin estadisticas, las comprobaciones de ISBN
+# repetidos se planificarian como si la tabla estuviera vacia.
+SQL_PREPARAR_IMPORTACION = """
+    CREATE INDEX ON importacion (isbn, linea);
+    ANALYZE importacion;
+"""
+
+SQL_RESOLVER_CATEGORIAS = """
+    UPDATE
+        importacion i
+    SET
+        idcategoria = c.id
+    FROM
+        categoria c
+    WHERE
+        c.nombre = i.categoria
+"""
+
+# Las longitudes maximas son las de las columnas de libro en create_tables.sql
+SQL_VALIDAR_IMPORTACION = """
+    UPDATE
+        importacion i
+    SET
+        motivo = CASE
+            WHEN titulo IS NULL THEN 'El titulo es obligatorio.'
+            WHEN length(titulo) > 200 THEN 'El titulo es demasiado largo (maximo 200 caracteres).'
+            WHEN length(autor) > 150 THEN 'El autor es demasiado largo (maximo 150 caracteres).'
+            WHEN length(isbn) > 20 THEN 'El ISBN es demasiado largo (maximo 20 caracteres).'
+            WHEN aniopublicacion !~ '^-?[0-9]{1,4}$' THEN 'El anio de publicacion debe ser un numero entero.'
+            WHEN precio !~ '^[0-9]{1,15}([.][0-9]+)?$' THEN 'El precio debe ser un numero positivo.'
+            WHEN categoria IS NOT NULL AND idcategoria IS NULL THEN 'La categoria especificada no existe.'
+            WHEN EXISTS (SELECT 1 FROM libro l WHERE l.isbn = i.isbn) THEN 'El ISBN ya existe en otro libro.'
+        END
+"""
+
+# Se ejecuta despues de SQL_VALIDAR_IMPORTACION: de un ISBN repetido se importa la primera linea valida
+SQL_VALIDAR_ISBN_REPETIDOS = """
+    UPDATE
+        importacion i
+    SET
+        motivo = 'El ISBN esta repetido en el fichero.'
+    WHERE
+        motivo IS NULL
+        AND EXISTS (
+            SELECT 1
+            FROM importacion o
+            WHERE o.isbn = i.isbn
+            AND o.linea < i.linea
+            AND o.motivo IS NULL
+        )
+"""
+
+SQL_RECHAZADOS_IMPORTACION = """
+    SELECT
+        linea,
+        isbn,
+        titulo,
+        motivo
+    FROM
+        importacion
+    WHERE
+        motivo IS NOT NULL
+    ORDER BY
+        linea
+"""
+
+SQL_FUSIONAR_IMPORTACION = """
+    WITH nuevos AS (
+        INSERT INTO
+            libro (titulo, autor, aniopublicacion, isbn, sinopsis, idcategoria, precioactual)
+        SELECT
+            titulo,
+            autor,
+            CAST(aniopublicacion AS SMALLINT),
+            isbn,
+            sinopsis,
+            idcategoria,
+            CAST(precio AS FLOAT)
+        FROM
+            importacion
+        WHERE
+            motivo IS NULL
+        ORDER BY
+            linea
+        RETURNING
+            id, precioactual
+    ), precios AS (
+        INSERT INTO
+            preciolibro (idlibro, precio)
+        SELECT
+            id, precioactual
+        FROM
+            nuevos
+        WHERE
+            precioactual IS NOT NULL
+        RETURNING
+            idlibro
+    )
+    SELECT
+        (SELECT count(*) FROM nuevos) AS importados,
+        (SELECT count(*) FROM precios) AS precios
+"""
+
+
+class FlujoCSV:
+    """
+    Fichero de solo lectura con las filas de un iterador en CSV, para pasarlo a COPY FROM STDIN
+    sin tener todo el fichero en memoria.
+    """
+
+    def __init__(self, filas):
+        self._filas = iter(filas)
+        self._buffer = io.StringIO()
+        self._escritor = csv.writer(self._buffer, lineterminator="\n")
+        # psycopg2 convierte los errores de read() en un error de COPY; se guardan para relanzarlos tal cual
+        self.error = None
+
+    def read(self, size=-1):
+        while size < 0 or self._buffer.tell() < size:
+            try:
+                fila = next(self._filas, None)
+            except Exception as e:
+                self.error = e
+                raise
+            if fila is None:
+                break
+            self._escritor.writerow(fila)
+
+        datos = self._buffer.getvalue()
+        if size < 0 or len(datos) <= size:
+            resto = ""
+        else:
+            datos, resto = datos[:size], datos[size:]
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._buffer.write(resto)
+        return datos
+
+
+def _fila_importacion(linea, registro, precios):
+    """
+    Convierte un registro de importacion en una fila de la tabla temporal. Los valores vacios son NULL.
+    """
+    valores = []
+    for columna in COLUMNAS_IMPORTACION:
+        valor = registro.get(columna)
+        if valor is not None:
+            valor = str(valor).strip() or None
+        valores.append(valor)
+    if not precios:
+        valores[-1] = None
+    return (linea, *valores)
+
+
+def importar_libros(conn, registros: Iterable[tuple[int, dict]], precios: bool = True) -> ResultadoImportacion:
+    """
+    Importa libros en bloque con COPY. Los registros que no cumplen las restricciones de libro (titulo vacio,
+    datos demasiado largos, categoria desconocida, ISBN existente o repetido en el fichero...) se devuelven
+    como rechazados; el resto se anade en una sola transaccion, junto con su precio si lo tienen.
+    :param conn: La conexion con la base de datos
+    :param registros: Pares (numero de linea, diccionario con claves de COLUMNAS_IMPORTACION)
+    :param precios: Si es False, se ignora la columna precio
+    :return: El numero de libros y precios anadidos y los registros rechazados
+    :raise Exception: Los errores al leer los registros se relanzan sin traducir
+    """
+    def cuerpo(cur):
+        cur.execute(SQL_CREAR_IMPORTACION)
+        flujo = FlujoCSV(_fila_importacion(linea, registro, precios) for linea, registro in registros)
+        try:
+            cur.copy_expert(SQL_COPIAR_IMPORTACION, flujo)
+        except psycopg2.Error:
+            if flujo.error is not None:
+                raise flujo.error
+            raise
+        cur.execute(SQL_PREPARAR_IMPORTACION)
+        cur.execute(SQL_RESOLVER_CATEGORIAS)
+        cur.execute(SQL_VALIDAR_IMPORTACION)
+        cur.execute(SQL_VALIDAR_ISBN_REPETIDOS)
+
+        cur.execute(SQL_RECHAZADOS_IMPORTACION)
+        rechazados = [Rechazado(**fila) for fila in cur]
+
+        cur.execute(SQL_FUSIONAR_IMPORTACION)
+        fila = cur.fetchone()
+        return ResultadoImportacion(fila['importados'], fila['precios'], rechazados)
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+# ------------------------------------------------------------
+# Exportacion
+
+@dataclass
+class FiltrosExportacion:
+    """
+    Filtros de una exportacion. Los campos a None se ignoran. 'idcategoria' filtra los libros; 'desde'
+    (incluida) y 'hasta' (excluida) filtran la fecha de los prestamos y de los precios.
+    """
+    idcategoria: int | None = None
+    desde: datetime | None = None
+    hasta: datetime | None = None
+
+
+# Consultas de cada exportacion (la clave es el nombre de la exportacion). No se ordenan, para que las
+# filas se envien segun se leen sin esperar a tenerlas todas; los filtros de fecha de precios descartan
+# las particiones de preciolibro fuera del rango.
+SQL_EXPORTAR = {
+    'libros': """
+        SELECT
+            l.id,
+            l.titulo,
+            l.autor,
+            l.aniopublicacion,
+            l.isbn,
+            l.sinopsis,
+            l.idcategoria,
+            c.nombre AS categoria,
+            l.precioactual,
+            l.prestado
+        FROM
+            libro l
+        LEFT JOIN
+            categoria c ON c.id = l.idcategoria
+        WHERE
+            CAST(%(ic)s AS BIGINT) IS NULL
+            OR l.idcategoria = %(ic)s
+    """,
+    'prestamos': """
+        SELECT
+            id,
+            fechaprestamo,
+            fechalimite,
+            fechadevolucion,
+            comentarios,
+            idlibro,
+            idestudiante
+        FROM
+            prestamo
+        WHERE
+            (CAST(%(desde)s AS TIMESTAMP) IS NULL OR fechaprestamo >= %(desde)s)
+            AND (CAST(%(hasta)s AS TIMESTAMP) IS NULL OR fechaprestamo < %(hasta)s)
+    """,
+    'precios': """
+        SELECT
+            id,
+            idlibro,
+            precio,
+            fecha
+        FROM
+            preciolibro
+        WHERE
+            (CAST(%(desde)s AS TIMESTAMP) IS NULL OR fecha >= %(desde)s)
+            AND (CAST(%(hasta)s AS TIMESTAMP) IS NULL OR fecha < %(hasta)s)
+    """,
+}
+
+SQL_COPIAR_EXPORTACION = "COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+
+def _consulta_exportacion(cur, exportacion, filtros):
+    """
+    Devuelve la consulta de una exportacion con los filtros ya escritos en ella (COPY no admite parametros).
+    :return: La consulta (str)
+    """
+    if exportacion not in SQL_EXPORTAR:
+        raise DatosNoValidos(f"La exportacion {exportacion} no existe.")
+    return cur.mogrify(SQL_EXPORTAR[exportacion], {
+        'ic': filtros.idcategoria,
+        'desde': filtros.desde,
+        'hasta': filtros.hasta,
+    }).decode(psycopg2.extensions.encodings[cur.connection.encoding])
+
+
+def exportar_csv(conn, exportacion: str, fichero, filtros: FiltrosExportacion | None = None) -> int:
+    """
+    Escribe las filas de una exportacion en CSV con cabecera, con COPY TO STDOUT: el servidor genera el CSV
+    y se escribe en el fichero segun llega, sin guardar las filas en memoria.
+    :param conn: La conexion con la base de datos
+    :param exportacion: El nombre de la exportacion (clave de SQL_EXPORTAR)
+    :param fichero: El fichero binario de salida
+    :param filtros: Los filtros de la exportacion (None para exportarlo todo)
+    :return: El numero de filas exportadas
+    """
+    filtros = filtros or FiltrosExportacion()
+
+    def cuerpo(cur):
+        consulta = _consulta_exportacion(cur, exportacion, filtros)
+        cur.copy_expert(SQL_COPIAR_EXPORTACION.format(consulta=consulta), fichero)
+        return cur.rowcount
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+def exportar_lotes(conn, exportacion: str, procesar_lote: Callable[[list[str], list[tuple]], None],
+                   filtros: FiltrosExportacion | None = None, tamano_lote: int = 100_000) -> int:
+    """
+    Lee las filas de una exportacion por lotes con un cursor del servidor, asi que solo hay un lote en
+    memoria a la vez, y pasa cada uno a procesar_lote (por ejemplo, para escribirlo en un fichero columnar).
+    :param conn: La conexion con la base de datos
+    :param exportacion: El nombre de la exportacion (clave de SQL_EXPORTAR)
+    :param procesar_lote: Funcion que recibe los nombres de las columnas y las filas del lote (tuplas)
+    :param filtros: Los filtros de la exportacion (None para exportarlo todo)
+    :param tamano_lote: El numero maximo de filas de cada lote
+    :return: El numero de filas exportadas
+    """
+    filtros = filtros or FiltrosExportacion()
+
+    def cuerpo(cur):
+        consulta = _consulta_exportacion(cur, exportacion, filtros)
+        total = 0
+        with cur.connection.cursor(name=f"exportar_{exportacion}", cursor_factory=_Cursor) as servidor:
+            servidor.itersize = tamano_lote
+            servidor.execute(consulta)
+            while True:
+                filas = servidor.fetchmany(tamano_lote)
+                if not filas:
+                    return total
+                procesar_lote([columna.name for columna in servidor.description], [tuple(fila) for fila in filas])
+                total += len(filas)
+
+    return _ejecutar(conn, psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED, cuerpo)
+
+
+instrumentacion.registrar_sentencias(globals())
+
+# Consultas y operaciones de uso continuo (busquedas, fichas, historiales y prestamos), que se preparan en
+# cada conexion la primera vez que se usan, con el tipo de los parametros que solo se comparan con NULL
+TIPOS_BUSQUEDA = {
+    'titulo': "TEXT",
+    'autor': "TEXT",
+    'aniopublicacion': "INTEGER",
+    'isbn': "TEXT",
+    'idcategoria': "BIGINT",
+    'k1': "FLOAT",
+    'k2': "BIGINT",
+}
+TIPOS_HISTORIAL = {
+    'k1': "TIMESTAMP",
+    'k2': "BIGINT",
+}
+
+preparadas.registrar_sentencias(globals(), {
+    "SQL_BUSCAR_LIBROS_MODO": TIPOS_BUSQUEDA,
+    "SQL_CONSULTAR_LIBRO": {},
+    "SQL_NOMBRES_CATEGORIAS": {},
+    "SQL_PRECIO_MANUAL": {},
+    "SQL_PRECIO_PORCENTAJE": {},
+    "SQL_HISTORIAL_PRECIOS": TIPOS_HISTORIAL,
+    "SQL_PRECIOS_EN_FECHA": {},
+    "SQL_EFECTUAR_PRESTAMO": {},
+    "SQL_HISTORIAL_PRESTAMOS_LIBRO": TIPOS_HISTORIAL,
+    "SQL_HISTORIAL_PRESTAMOS_ESTUDIANTE": TIPOS_HISTORIAL,
+    "SQL_CONSULTAR_PRESTAMO": {},
+    "SQL_FINALIZAR_PRESTAMO": {},
+    "SQL_ELIMINAR_PRESTAMO": {},
+    "SQL_CONSULTAR_ESTUDIANTE": {},
+})
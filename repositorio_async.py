@@ -0,0 +1,613 @@
+"""
+Version asincrona (asyncio) de las operaciones de libros, precios, prestamos y estudiantes de repositorio, para
+servicios que atienden muchas peticiones a la vez en un solo proceso.
+
+Usa psycopg 3 y su pool asincrono (pip install "psycopg[pool]"). Las funciones reciben una conexion del pool
+creado con crear_pool y tienen la misma semantica que las de repositorio: las mismas sentencias, niveles de
+aislamiento, reintentos de las transacciones SERIALIZABLE (que se cuentan en
+repositorio.estadisticas_transacciones), caches y errores (ErrorBiblioteca traducidos con
+repositorio.traducir_error). Ejemplo:
+
+    pool = await repositorio_async.crear_pool()
+    async with pool.connection() as conn:
+        libro = await repositorio_async.consultar_libro(conn, 14)
+
+Las sentencias se envian con los parametros ya sustituidos en el cliente (AsyncClientCursor), como en
+psycopg2: con parametros del servidor, PostgreSQL no puede deducir el tipo de los que solo se comparan con
+NULL (%(x)s IS NULL OR ...). Estas sentencias no pasan por instrumentacion ni por preparadas, que son de psycopg2.
+"""
+
+import asyncio
+import os
+import random
+from dataclasses import replace
+
+import psycopg
+import psycopg.rows
+import psycopg_pool
+
+import cache
+import conexion
+import repositorio
+from repositorio import (ConflictoConcurrencia, DatosNoValidos, Estudiante, EstudianteNuevo, Libro, LibroNuevo,
+                         LibroResumen, NoEncontrado, Pagina, Precio, Prestamo, ResultadoLote)
+
+
+async def crear_pool(dsn=None, minconn=None, maxconn=None) -> psycopg_pool.AsyncConnectionPool:
+    """
+    Crea y abre un pool de conexiones asincronas. Los parametros omitidos se toman del entorno, como en
+    conexion.PoolBiblioteca. Las conexiones se comprueban antes de prestarlas.
+    :param dsn: El DSN de la base de datos
+    :param minconn: Numero de conexiones abiertas al crear el pool
+    :param maxconn: Numero maximo de conexiones abiertas
+    :return: El pool abierto (se cierra con await pool.close())
+    :raise psycopg.Error: Si no se pueden abrir las conexiones iniciales
+    """
+    pool = psycopg_pool.AsyncConnectionPool(
+        dsn if dsn is not None else os.environ.get("BIBLIOTECA_DSN", conexion.DSN_POR_DEFECTO),
+        min_size=minconn if minconn is not None else int(os.environ.get("BIBLIOTECA_POOL_MIN", 1)),
+        max_size=maxconn if maxconn is not None else int(os.environ.get("BIBLIOTECA_POOL_MAX", 10)),
+        kwargs={'cursor_factory': psycopg.AsyncClientCursor, 'row_factory': psycopg.rows.dict_row},
+        check=psycopg_pool.AsyncConnectionPool.check_connection,
+        open=False,
+    )
+    await pool.open(wait=True)
+    return pool
+
+
+# ------------------------------------------------------------
+# Transacciones
+
+async def _ejecutar(conn, nivel, cuerpo):
+    """
+    Ejecuta await cuerpo(cur) en una transaccion con el nivel de aislamiento indicado y la confirma, como
+    repositorio._ejecutar.
+    :param conn: La conexion asincrona (sin transaccion abierta)
+    :param nivel: El nivel de aislamiento (psycopg.IsolationLevel)
+    :param cuerpo: Funcion asincrona que recibe un cursor y hace el trabajo de la transaccion
+    :return: Lo que devuelva cuerpo
+    """
+    try:
+        await conn.set_isolation_level(nivel)
+        async with conn.cursor() as cur:
+            resultado = await cuerpo(cur)
+        await conn.commit()
+        return resultado
+    except psycopg.Error as e:
+        await conn.rollback()
+        raise repositorio.traducir_error(e) from e
+    except BaseException:
+        await conn.rollback()
+        raise
+
+
+async def _ejecutar_serializable(conn, operacion, cuerpo):
+    """
+    Ejecuta cuerpo en una transaccion SERIALIZABLE y la repite si falla por un conflicto con otra, con las
+    mismas esperas que repositorio._ejecutar_serializable pero sin bloquear el bucle de eventos.
+    """
+    espera = repositorio.ESPERA_INICIAL_REINTENTO
+    for intento in range(1, repositorio.INTENTOS_SERIALIZABLE + 1):
+        repositorio._contar(operacion, 'intentos')
+        try:
+            return await _ejecutar(conn, psycopg.IsolationLevel.SERIALIZABLE, cuerpo)
+        except ConflictoConcurrencia:
+            if intento == repositorio.INTENTOS_SERIALIZABLE:
+                repositorio._contar(operacion, 'abandonos')
+                raise
+        repositorio._contar(operacion, 'reintentos')
+        await asyncio.sleep(random.uniform(0, espera))
+        espera = min(espera * 2, repositorio.ESPERA_MAXIMA_REINTENTO)
+
+
+async def _leer_pagina(conn, sql_sentence, params, limite, despues, tipo):
+    """
+    Lee una pagina de un listado paginado por clave, como repositorio._leer_pagina.
+    """
+    k1, k2 = despues if despues is not None else (None, None)
+
+    async def cuerpo(cur):
+        await cur.execute(sql_sentence, {**params, 'k1': k1, 'k2': k2, 'n': limite + 1})
+        return [tipo(**fila) for fila in await cur.fetchall()]
+
+    filas = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    if len(filas) > limite:
+        return Pagina(filas[:limite], filas[limite - 1].clave)
+    return Pagina(filas, None)
+
+
+async def _notificar(cur, nombre, clave=None):
+    """Version asincrona de cache.notificar."""
+    if cache.NOTIFY_CACHE:
+        await cur.execute(cache.SQL_NOTIFICAR, {
+            'c': cache.CANAL_INVALIDACIONES, 'm': f"{nombre}:{cache.TODAS if clave is None else clave}"})
+
+
+# ------------------------------------------------------------
+# Libros
+
+async def nombres_categorias(conn, ids_categorias) -> dict[int, str]:
+    """
+    Obtiene el nombre de varias categorias, de repositorio.CACHE_CATEGORIAS o con una sola consulta.
+    :param conn: La conexion asincrona
+    :param ids_categorias: Los ids de las categorias (los None se ignoran)
+    :return: Diccionario con el nombre de cada categoria existente, por id
+    """
+    nombres, faltan, generacion = repositorio.CACHE_CATEGORIAS.consultar(i for i in ids_categorias if i is not None)
+    if faltan:
+        async def cuerpo(cur):
+            await cur.execute(repositorio.SQL_NOMBRES_CATEGORIAS, {'ids': faltan})
+            return {fila['id']: fila['nombre'] for fila in await cur.fetchall()}
+
+        cargados = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+        repositorio.CACHE_CATEGORIAS.guardar(cargados, generacion)
+        nombres.update(cargados)
+    return nombres
+
+
+async def anadir_libro(conn, libro: LibroNuevo) -> int:
+    """
+    Anade un nuevo libro a la biblioteca.
+    :param conn: La conexion asincrona
+    :param libro: Los datos del libro
+    :return: El id del libro anadido
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_ANADIR_LIBRO, vars(libro))
+        return (await cur.fetchone())['id']
+
+    return await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+
+
+async def buscar_libros(conn, filtros: repositorio.FiltrosLibro, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Busca libros segun los filtros (ver repositorio.buscar_libros).
+    :param conn: La conexion asincrona
+    :param filtros: Los filtros de la busqueda
+    :param limite: El numero maximo de libros de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de LibroResumen
+    """
+    if filtros.modo not in repositorio.MODOS_BUSQUEDA:
+        raise DatosNoValidos("Modo de busqueda no valido.")
+    params = vars(filtros).copy()
+    del params['modo']
+    if filtros.modo == 't':
+        params['autor'] = None
+
+    pagina = await _leer_pagina(conn, repositorio.SQL_BUSCAR_LIBROS_MODO[filtros.modo], params, limite, despues,
+                                LibroResumen)
+    nombres = await nombres_categorias(conn, [libro.idcategoria for libro in pagina.filas])
+    for libro in pagina.filas:
+        libro.nombrecategoria = nombres.get(libro.idcategoria)
+    return pagina
+
+
+async def consultar_libro(conn, id_libro: int) -> Libro:
+    """
+    Obtiene toda la informacion de un libro, usando repositorio.CACHE_LIBROS.
+    :param conn: La conexion asincrona
+    :param id_libro: El id del libro
+    :return: El libro
+    """
+    libros, faltan, generacion = repositorio.CACHE_LIBROS.consultar([id_libro])
+    if faltan:
+        async def cuerpo(cur):
+            await cur.execute(repositorio.SQL_CONSULTAR_LIBRO, {'i': id_libro})
+            fila = await cur.fetchone()
+            if fila is None:
+                raise NoEncontrado("No se ha encontrado el libro.")
+            return Libro(**fila)
+
+        libros[id_libro] = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+        repositorio.CACHE_LIBROS.guardar(libros, generacion)
+
+    libro = libros[id_libro]
+    nombres = await nombres_categorias(conn, [libro.idcategoria])
+    return replace(libro, nombrecategoria=nombres.get(libro.idcategoria))
+
+
+async def modificar_libro(conn, id_libro: int, cambios: dict, version: int | None = None) -> int:
+    """
+    Modifica los campos indicados de un libro con una sola sentencia, comprobando la version si se indica
+    (ver repositorio.modificar_libro).
+    :param conn: La conexion asincrona
+    :param id_libro: El id del libro
+    :param cambios: Nuevo valor de cada campo a modificar (claves de COLUMNAS_MODIFICAR_LIBRO)
+    :param version: La version del libro leida, o None para modificarlo sin comprobarla
+    :return: La nueva version del libro
+    """
+    for campo in cambios:
+        if campo not in repositorio.COLUMNAS_MODIFICAR_LIBRO:
+            raise DatosNoValidos(f"El campo {campo} no se puede modificar.")
+
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_MODIFICAR_LIBRO.format(
+            asignaciones=repositorio._asignaciones(repositorio.COLUMNAS_MODIFICAR_LIBRO, cambios)),
+            {**cambios, 'i': id_libro, 'version': version, 'cambia_precio': 'precio' in cambios})
+        fila = await cur.fetchone()
+        if fila is None:
+            await cur.execute(repositorio.SQL_VERSION_LIBRO, {'i': id_libro})
+            if await cur.fetchone() is None:
+                raise NoEncontrado("El libro especificado no existe.")
+            raise ConflictoConcurrencia("Otro usuario ha modificado el libro despues de consultarlo.")
+        await _notificar(cur, repositorio.CACHE_LIBROS.nombre, id_libro)
+        return fila['version']
+
+    try:
+        return await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    finally:
+        repositorio.CACHE_LIBROS.invalidar(id_libro)
+
+
+async def eliminar_libro(conn, id_libro: int) -> None:
+    """
+    Elimina permanentemente un libro de la biblioteca.
+    :param conn: La conexion asincrona
+    :param id_libro: El id del libro
+    :return: None
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_ELIMINAR_LIBRO, {'i': id_libro})
+        if cur.rowcount == 0:
+            raise NoEncontrado(f"El libro con id {id_libro} no existe.")
+        await _notificar(cur, repositorio.CACHE_LIBROS.nombre, id_libro)
+
+    await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    repositorio.CACHE_LIBROS.invalidar(id_libro)
+
+
+# ------------------------------------------------------------
+# Precios
+
+async def actualizar_precio(conn, id_libro: int, precio: float | None = None, porcentaje: float | None = None) -> float:
+    """
+    Registra un nuevo precio para un libro: el indicado o el actual con un porcentaje de variacion.
+    :param conn: La conexion asincrona
+    :param id_libro: El id del libro
+    :param precio: El nuevo precio
+    :param porcentaje: El porcentaje de variacion, si no se indica precio
+    :return: El nuevo precio del libro
+    """
+    if (precio is None) == (porcentaje is None):
+        raise DatosNoValidos("Se debe indicar un precio o un porcentaje.")
+
+    async def cuerpo(cur):
+        if porcentaje is not None:
+            await cur.execute(repositorio.SQL_PRECIO_PORCENTAJE, {'i': id_libro, 'p': porcentaje})
+        else:
+            await cur.execute(repositorio.SQL_PRECIO_MANUAL, {'i': id_libro, 'p': precio})
+        fila = await cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("El libro especificado no existe o no tiene un precio registrado.")
+        await _notificar(cur, repositorio.CACHE_LIBROS.nombre, id_libro)
+        return fila['precio']
+
+    nuevo_precio = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    repositorio.CACHE_LIBROS.invalidar(id_libro)
+    return nuevo_precio
+
+
+async def revalorizar_precios(conn, filtros: repositorio.FiltrosRevalorizacion, precio: float | None = None,
+                              porcentaje: float | None = None,
+                              simular: bool = False) -> repositorio.ResumenRevalorizacion:
+    """
+    Registra un nuevo precio para todos los libros que cumplen los filtros, en una sola sentencia, o con
+    simular=True solo calcula el resumen.
+    :param conn: La conexion asincrona
+    :param filtros: Los libros a revalorizar (al menos un filtro)
+    :param precio: El nuevo precio
+    :param porcentaje: El porcentaje de variacion, si no se indica precio
+    :param simular: Si es True, no se modifica ningun precio
+    :return: El resumen de la revalorizacion
+    """
+    params = repositorio._parametros_revalorizacion(filtros, precio, porcentaje)
+
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_PREVISUALIZAR_REVALORIZACION if simular else repositorio.SQL_REVALORIZAR,
+                          params)
+        resumen = repositorio.ResumenRevalorizacion(simular, **await cur.fetchone())
+        if not simular and resumen.libros > 0:
+            await _notificar(cur, repositorio.CACHE_LIBROS.nombre)
+        return resumen
+
+    resumen = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    if not simular and resumen.libros > 0:
+        repositorio.CACHE_LIBROS.invalidar()
+    return resumen
+
+
+async def historial_precios(conn, id_libro: int, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Obtiene los precios que ha tenido un libro, del mas reciente al mas antiguo.
+    :param conn: La conexion asincrona
+    :param id_libro: El id del libro
+    :param limite: El numero maximo de precios de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de Precio
+    """
+    return await _leer_pagina(conn, repositorio.SQL_HISTORIAL_PRECIOS, {'i': id_libro}, limite, despues, Precio)
+
+
+# ------------------------------------------------------------
+# Prestamos
+
+async def efectuar_prestamo(conn, id_libro: int, id_estudiante: int, comentarios: str | None = None) -> int:
+    """
+    Presta un libro a un estudiante con fecha de hoy.
+    :param conn: La conexion asincrona
+    :param id_libro: El id del libro
+    :param id_estudiante: El id del estudiante
+    :param comentarios: Comentarios sobre el prestamo
+    :return: El id del prestamo
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_EFECTUAR_PRESTAMO, {
+            'c': comentarios, 'il': id_libro, 'ie': id_estudiante, 'dias': repositorio.DIAS_PRESTAMO_POR_DEFECTO,
+        })
+        fila = await cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("El libro especificado no existe.")
+        id_prestamo = fila['id']
+        await _notificar(cur, repositorio.CACHE_LIBROS.nombre, id_libro)
+        return id_prestamo
+
+    id_prestamo = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    repositorio.CACHE_LIBROS.invalidar(id_libro)
+    return id_prestamo
+
+
+async def efectuar_prestamos(conn, prestamos: list[tuple[int, int]],
+                             comentarios: str | None = None) -> list[ResultadoLote]:
+    """
+    Presta varios libros con fecha de hoy en una sola transaccion. Los elementos que no se pueden prestar se
+    devuelven con su motivo y no impiden prestar el resto (ver repositorio.efectuar_prestamos).
+    :param conn: La conexion asincrona
+    :param prestamos: Pares (id del libro, id del estudiante)
+    :param comentarios: Comentarios de todos los prestamos
+    :return: El resultado de cada elemento, en el orden en que se indicaron
+    """
+    prestamos = list(prestamos)
+    if not prestamos:
+        return []
+
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_EFECTUAR_PRESTAMOS_LOTE, {
+            'libros': [id_libro for id_libro, _ in prestamos],
+            'estudiantes': [id_estudiante for _, id_estudiante in prestamos],
+            'c': comentarios,
+            'dias': repositorio.DIAS_PRESTAMO_POR_DEFECTO,
+        })
+        resultados = [ResultadoLote(**fila) for fila in await cur.fetchall()]
+        for resultado in resultados:
+            if resultado.idprestamo is not None:
+                await _notificar(cur, repositorio.CACHE_LIBROS.nombre, resultado.idlibro)
+        return resultados
+
+    resultados = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    for resultado in resultados:
+        if resultado.idprestamo is not None:
+            repositorio.CACHE_LIBROS.invalidar(resultado.idlibro)
+    return resultados
+
+
+async def historial_prestamos_libro(conn, id_libro: int, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Obtiene los prestamos de un libro, del mas reciente al mas antiguo.
+    :param conn: La conexion asincrona
+    :param id_libro: El id del libro
+    :param limite: El numero maximo de prestamos de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de Prestamo
+    """
+    return await _leer_pagina(conn, repositorio.SQL_HISTORIAL_PRESTAMOS_LIBRO, {'i': id_libro}, limite, despues,
+                              Prestamo)
+
+
+async def historial_prestamos_estudiante(conn, id_estudiante: int, limite: int, despues: tuple | None = None) -> Pagina:
+    """
+    Obtiene los prestamos de un estudiante, del mas reciente al mas antiguo.
+    :param conn: La conexion asincrona
+    :param id_estudiante: El id del estudiante
+    :param limite: El numero maximo de prestamos de la pagina
+    :param despues: La clave 'siguiente' de la pagina anterior (None para la primera)
+    :return: Una Pagina de Prestamo
+    """
+    return await _leer_pagina(conn, repositorio.SQL_HISTORIAL_PRESTAMOS_ESTUDIANTE, {'i': id_estudiante}, limite,
+                              despues, Prestamo)
+
+
+async def consultar_prestamo(conn, id_prestamo: int) -> Prestamo:
+    """
+    Obtiene un prestamo con el titulo del libro y el nombre del estudiante.
+    :param conn: La conexion asincrona
+    :param id_prestamo: El id del prestamo
+    :return: El prestamo
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_CONSULTAR_PRESTAMO, {'i': id_prestamo})
+        fila = await cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("No se ha encontrado el prestamo.")
+        return Prestamo(**fila)
+
+    return await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+
+
+async def finalizar_prestamo(conn, id_prestamo: int) -> None:
+    """
+    Da por finalizado un prestamo abierto con fecha de devolucion de hoy.
+    :param conn: La conexion asincrona
+    :param id_prestamo: El id del prestamo
+    :return: None
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_FINALIZAR_PRESTAMO, {'i': id_prestamo})
+        fila = await cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("No se ha encontrado el prestamo o ya estaba finalizado.")
+        if fila['idlibro'] is not None:
+            await _notificar(cur, repositorio.CACHE_LIBROS.nombre, fila['idlibro'])
+        return fila['idlibro']
+
+    id_libro = await _ejecutar_serializable(conn, 'finalizar_prestamo', cuerpo)
+    if id_libro is not None:
+        repositorio.CACHE_LIBROS.invalidar(id_libro)
+
+
+async def finalizar_prestamos(conn, ids_prestamos: list[int]) -> list[ResultadoLote]:
+    """
+    Da por finalizados varios prestamos abiertos en una sola transaccion. Los que no se pueden finalizar se
+    devuelven con su motivo y no impiden finalizar el resto (ver repositorio.finalizar_prestamos).
+    :param conn: La conexion asincrona
+    :param ids_prestamos: Los ids de los prestamos
+    :return: El resultado de cada prestamo, en el orden en que se indicaron
+    """
+    ids = list(ids_prestamos)
+    if not ids:
+        return []
+
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_FINALIZAR_PRESTAMOS_LOTE, {'ids': ids})
+        resultados = [ResultadoLote(**fila) for fila in await cur.fetchall()]
+        for resultado in resultados:
+            if resultado.motivo is None and resultado.idlibro is not None:
+                await _notificar(cur, repositorio.CACHE_LIBROS.nombre, resultado.idlibro)
+        return resultados
+
+    resultados = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    for resultado in resultados:
+        if resultado.motivo is None and resultado.idlibro is not None:
+            repositorio.CACHE_LIBROS.invalidar(resultado.idlibro)
+    return resultados
+
+
+async def eliminar_prestamo(conn, id_prestamo: int) -> None:
+    """
+    Elimina el registro de un prestamo.
+    :param conn: La conexion asincrona
+    :param id_prestamo: El id del prestamo
+    :return: None
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_ELIMINAR_PRESTAMO, {'i': id_prestamo})
+        fila = await cur.fetchone()
+        if fila is None:
+            raise NoEncontrado(f"El prestamo con id {id_prestamo} no existe.")
+        if fila['idlibro'] is not None:
+            await _notificar(cur, repositorio.CACHE_LIBROS.nombre, fila['idlibro'])
+        return fila['idlibro']
+
+    id_libro = await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+    if id_libro is not None:
+        repositorio.CACHE_LIBROS.invalidar(id_libro)
+
+
+# ------------------------------------------------------------
+# Estudiantes
+
+async def anadir_estudiante(conn, estudiante: EstudianteNuevo) -> int:
+    """
+    Anade un estudiante.
+    :param conn: La conexion asincrona
+    :param estudiante: Los datos del estudiante
+    :return: El id del estudiante anadido
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_ANADIR_ESTUDIANTE, vars(estudiante))
+        return (await cur.fetchone())['id']
+
+    return await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+
+
+async def consultar_estudiante(conn, id_estudiante: int) -> Estudiante:
+    """
+    Obtiene los datos de un estudiante y los libros que tiene en posesion, en una sola consulta.
+    :param conn: La conexion asincrona
+    :param id_estudiante: El id del estudiante
+    :return: El estudiante
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_CONSULTAR_ESTUDIANTE, {'i': id_estudiante})
+        fila = await cur.fetchone()
+        if fila is None:
+            raise NoEncontrado("No se ha encontrado el estudiante.")
+        return Estudiante(**fila)
+
+    return await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+
+
+async def aumentar_curso(conn, ids_estudiantes: list[int]) -> tuple[list[int], list[int]]:
+    """
+    Aumenta en uno el curso de varios estudiantes con una sola sentencia (ver repositorio.aumentar_curso).
+    :param conn: La conexion asincrona
+    :param ids_estudiantes: Los ids de los estudiantes (los repetidos se promocionan una sola vez)
+    :return: Los ids actualizados y los ids que no existen, en el orden en que se indicaron
+    """
+    ids = list(dict.fromkeys(ids_estudiantes))
+
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_AUMENTAR_CURSO, {'ids': ids})
+        return {fila['id'] for fila in await cur.fetchall()}
+
+    promocionados = await _ejecutar_serializable(conn, 'aumentar_curso', cuerpo)
+    return ([id_estudiante for id_estudiante in ids if id_estudiante in promocionados],
+            [id_estudiante for id_estudiante in ids if id_estudiante not in promocionados])
+
+
+async def aumentar_curso_completo(conn, curso: int) -> list[int]:
+    """
+    Aumenta en uno el curso de todos los estudiantes de un curso (ver repositorio.aumentar_curso_completo).
+    :param conn: La conexion asincrona
+    :param curso: El curso a promocionar
+    :return: Los ids de los estudiantes promocionados
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_AUMENTAR_CURSO_COMPLETO, {'c': curso})
+        return sorted(fila['id'] for fila in await cur.fetchall())
+
+    return await _ejecutar_serializable(conn, 'aumentar_curso_completo', cuerpo)
+
+
+async def modificar_estudiante(conn, id_estudiante: int, cambios: dict, version: int | None = None) -> int:
+    """
+    Modifica los campos indicados de un estudiante con una sola sentencia, comprobando la version si se indica
+    (ver repositorio.modificar_estudiante).
+    :param conn: La conexion asincrona
+    :param id_estudiante: El id del estudiante
+    :param cambios: Nuevo valor de cada campo a modificar (claves de COLUMNAS_MODIFICAR_ESTUDIANTE)
+    :param version: La version del estudiante leida, o None para modificarlo sin comprobarla
+    :return: La nueva version del estudiante
+    """
+    for campo in cambios:
+        if campo not in repositorio.COLUMNAS_MODIFICAR_ESTUDIANTE:
+            raise DatosNoValidos(f"El campo {campo} no se puede modificar.")
+
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_MODIFICAR_ESTUDIANTE.format(
+            asignaciones=repositorio._asignaciones(repositorio.COLUMNAS_MODIFICAR_ESTUDIANTE, cambios)),
+            {**cambios, 'i': id_estudiante, 'version': version})
+        fila = await cur.fetchone()
+        if fila is None:
+            await cur.execute(repositorio.SQL_VERSION_ESTUDIANTE, {'i': id_estudiante})
+            if await cur.fetchone() is None:
+                raise NoEncontrado(f"El estudiante con id {id_estudiante} no existe.")
+            raise ConflictoConcurrencia("Otro usuario ha modificado el estudiante despues de consultarlo.")
+        return fila['version']
+
+    return await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
+
+
+async def eliminar_estudiante(conn, id_estudiante: int) -> None:
+    """
+    Elimina un estudiante. Sus prestamos se conservan sin estudiante asociado.
+    :param conn: La conexion asincrona
+    :param id_estudiante: El id del estudiante
+    :return: None
+    """
+    async def cuerpo(cur):
+        await cur.execute(repositorio.SQL_ELIMINAR_ESTUDIANTE, {'i': id_estudiante})
+        if cur.rowcount == 0:
+            raise NoEncontrado(f"El estudiante con id {id_estudiante} no existe.")
+
+    await _ejecutar(conn, psycopg.IsolationLevel.READ_COMMITTED, cuerpo)
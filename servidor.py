@@ -0,0 +1,541 @@
+"""
+Servicio HTTP con las operaciones de funcionalidades.txt, con peticiones y respuestas en JSON.
+
+Uso:
+    python servidor.py [--host 0.0.0.0] [--puerto 8080]
+
+Cada peticion se atiende en un hilo con una conexion de conexion.PoolBiblioteca (configurado por entorno).
+El servicio no guarda estado entre peticiones, asi que se pueden ejecutar varias instancias detras de un
+balanceador: las instancias (y los demas programas) se avisan con NOTIFY de los cambios que afectan a sus
+caches, asi que una ficha modificada a traves de una instancia no se sirve desde otra con la version o el
+ETag anteriores. No se debe desactivar con BIBLIOTECA_CACHE_NOTIFY=0 si hay mas de una instancia.
+
+Rutas:
+    POST    /libros                         Anade un libro (campos de repositorio.LibroNuevo)
+    GET     /libros                         Busca libros (?modo=&titulo=&autor=&aniopublicacion=&isbn=&idcategoria=)
+    GET     /libros/{id}                    Ficha del libro (con ETag)
+    PUT     /libros/{id}                    Modifica los campos indicados (y 'precio'); con 'version', solo si el
+                                            libro sigue en esa version. Devuelve {"version": nueva}
+    DELETE  /libros/{id}                    Elimina el libro
+    POST    /libros/{id}/precios            Nuevo precio: {"precio": x} o {"porcentaje": x}
+    POST    /libros/precios                 Nuevo precio de varios libros: filtros de repositorio.FiltrosRevalorizacion,
+                                            "precio" o "porcentaje" y "simular" (solo el resumen, sin cambiar nada)
+    GET     /libros/{id}/precios            Historial de precios
+    GET     /libros/{id}/precio             Precio del libro en una fecha (?fecha=AAAA-MM-DD[THH:MM:SS], por
+                                            defecto ahora)
+    POST    /libros/precios/fecha           Precio de varios libros en una fecha:
+                                            {"consultas": [{"idlibro": ..., "fecha": ...}]}
+    GET     /libros/{id}/prestamos          Historial de prestamos del libro
+    GET     /categorias                     Lista las categorias
+    POST    /categorias                     Anade una categoria: {"nombre": ..., "descripcion": ...,
+                                            "diasprestamo": ...}
+    PUT     /categorias/{id}                Modifica los campos indicados
+    DELETE  /categorias/{id}                Elimina la categoria
+    POST    /prestamos                      Presta un libro: {"idlibro": ..., "idestudiante": ..., "comentarios": ...}
+    POST    /prestamos/lote                 Presta varios libros: {"prestamos": [{"idlibro": ..., "idestudiante": ...}],
+                                            "comentarios": ...}
+    PUT     /prestamos/finalizar            Finaliza varios prestamos: {"ids": [...]}
+    GET     /prestamos/{id}                 Detalle del prestamo
+    PUT     /prestamos/{id}/finalizar       Da el prestamo por finalizado
+    DELETE  /prestamos/{id}                 Elimina el prestamo
+    POST    /estudiantes                    Anade un estudiante (campos de repositorio.EstudianteNuevo)
+    GET     /estudiantes/{id}               Ficha del estudiante (con ETag)
+    PUT     /estudiantes/{id}               Modifica los campos indicados, como PUT /libros/{id}
+    DELETE  /estudiantes/{id}               Elimina el estudiante
+    GET     /estudiantes/{id}/prestamos     Historial de prestamos del estudiante
+    PUT     /estudiantes/curso              Aumenta el curso: {"curso": n} o {"ids": [...]}
+    GET     /informes/vencidos              Prestamos vencidos agrupados por estudiante (?curso=)
+
+Los listados devuelven {"filas": [...], "siguiente": clave}; la pagina siguiente se pide con ?despues=clave,
+y el tamano de pagina con ?limite= (por defecto TAMANO_PAGINA, como mucho TAMANO_PAGINA_MAXIMO).
+Los errores se devuelven como {"error": mensaje} con el estado de ESTADOS_ERROR.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import re
+import sys
+import traceback
+from dataclasses import asdict, is_dataclass
+from datetime import date, datetime
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import psycopg2
+
+import conexion
+import repositorio
+
+
+TAMANO_PAGINA = 20
+TAMANO_PAGINA_MAXIMO = 500
+
+ESTADOS_ERROR = {
+    repositorio.NoEncontrado: HTTPStatus.NOT_FOUND,
+    repositorio.Duplicado: HTTPStatus.CONFLICT,
+    repositorio.DatosNoValidos: HTTPStatus.UNPROCESSABLE_ENTITY,
+    repositorio.ConflictoConcurrencia: HTTPStatus.CONFLICT,
+}
+
+CAMPOS_LIBRO = {'titulo': str, 'autor': str, 'aniopublicacion': int, 'isbn': str, 'sinopsis': str,
+                'idcategoria': int}
+CAMPOS_REVALORIZACION = {'idcategoria': int, 'autor': str, 'aniodesde': int, 'aniohasta': int, 'ids': list}
+CAMPOS_CATEGORIA = {'nombre': str, 'descripcion': str, 'diasprestamo': int}
+CAMPOS_ESTUDIANTE = {'nombre': str, 'apellidos': str, 'curso': int, 'email': str, 'telefono': str}
+
+
+class PeticionNoValida(Exception):
+    """La peticion no tiene el formato esperado (JSON, parametros o tipos de los campos)."""
+
+
+def _a_json(valor):
+    """Convierte a JSON las filas de repositorio (dataclasses) y las fechas."""
+    def convertir(objeto):
+        if isinstance(objeto, datetime):
+            return objeto.isoformat()
+        raise TypeError(f"{type(objeto).__name__} no se puede convertir a JSON")
+
+    if is_dataclass(valor):
+        valor = asdict(valor)
+    return json.dumps(valor, default=convertir, ensure_ascii=False).encode("utf-8")
+
+
+def codificar_clave(clave):
+    """
+    Convierte la clave 'siguiente' de una Pagina en un texto para la URL.
+    :param clave: La clave (tupla) o None
+    :return: El texto, o None
+    """
+    if clave is None:
+        return None
+    texto = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in clave])
+    return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_clave(texto, fecha=False):
+    """
+    Recupera la clave de una Pagina a partir de su texto.
+    :param texto: El texto (de codificar_clave) o None
+    :param fecha: Si el primer valor de la clave es una fecha
+    :return: La clave (tupla), o None
+    """
+    if texto is None:
+        return None
+    try:
+        k1, k2 = json.loads(base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4)))
+        return (datetime.fromisoformat(k1) if fecha else k1), k2
+    except (ValueError, TypeError):
+        raise PeticionNoValida("El parametro 'despues' no es valido.")
+
+
+def _tipo_valido(valor, tipo):
+    """Comprueba el tipo de un valor JSON. Los enteros valen como float; los booleanos no valen como int."""
+    if isinstance(valor, bool):
+        return tipo is bool
+    return isinstance(valor, tipo) or tipo is float and isinstance(valor, int)
+
+
+def _fecha(texto):
+    """
+    Convierte una fecha ISO de la peticion para repositorio.precios_en_fecha: una fecha sin hora se devuelve
+    como date (el final de ese dia).
+    """
+    try:
+        return date.fromisoformat(texto) if len(texto) == 10 else datetime.fromisoformat(texto)
+    except ValueError:
+        raise PeticionNoValida(f"'{texto}' no es una fecha ISO valida.")
+
+
+def _comprobar_campos(datos, campos, obligatorios=()):
+    """
+    Comprueba que un objeto JSON solo tiene campos conocidos, con el tipo esperado (o null).
+    :param datos: El objeto
+    :param campos: Tipo de cada campo permitido
+    :param obligatorios: Campos que deben estar y no pueden ser null
+    :return: El objeto
+    """
+    if not isinstance(datos, dict):
+        raise PeticionNoValida("El cuerpo debe ser un objeto JSON.")
+    for campo, valor in datos.items():
+        tipo = campos.get(campo)
+        if tipo is None:
+            raise PeticionNoValida(f"El campo {campo} no es valido.")
+        if valor is not None and not _tipo_valido(valor, tipo):
+            raise PeticionNoValida(f"El campo {campo} debe ser de tipo {tipo.__name__}.")
+    for campo in obligatorios:
+        if campo not in datos:
+            raise PeticionNoValida(f"Falta el campo {campo}.")
+        if datos[campo] is None:
+            raise PeticionNoValida(f"El campo {campo} no puede ser null.")
+    return datos
+
+
+def _comprobar_enteros(datos, campo):
+    """
+    Comprueba que un campo de una lista (ya comprobado con _comprobar_campos) solo tiene enteros.
+    :param datos: El objeto
+    :param campo: El campo con la lista
+    :return: La lista, o None si el campo no esta o es null
+    """
+    valores = datos.get(campo)
+    if valores is not None and not all(_tipo_valido(v, int) for v in valores):
+        raise PeticionNoValida(f"El campo {campo} debe ser una lista de enteros.")
+    return valores
+
+
+class ManejadorBiblioteca(BaseHTTPRequestHandler):
+    """Atiende una peticion HTTP. Las rutas se asocian a metodos en RUTAS."""
+
+    server_version = "Biblioteca/1.0"
+    protocol_version = "HTTP/1.1"
+
+    # Se asigna al crear el servidor
+    pool: conexion.PoolBiblioteca = None
+
+    # ------------------------------------------------------------
+    # Peticion y respuesta
+
+    def _parametro(self, nombre, tipo=str):
+        """Devuelve un parametro de la URL convertido a tipo, o None si no esta."""
+        valores = self.parametros.get(nombre)
+        if not valores or valores[0] == "":
+            return None
+        try:
+            return tipo(valores[0])
+        except ValueError:
+            raise PeticionNoValida(f"El parametro '{nombre}' debe ser de tipo {tipo.__name__}.")
+
+    def _limite(self):
+        """Tamano de pagina pedido en ?limite=."""
+        limite = self._parametro("limite", int)
+        if limite is None:
+            return TAMANO_PAGINA
+        if not 1 <= limite <= TAMANO_PAGINA_MAXIMO:
+            raise PeticionNoValida(f"El parametro 'limite' debe estar entre 1 y {TAMANO_PAGINA_MAXIMO}.")
+        return limite
+
+    def _cuerpo(self):
+        """Devuelve el cuerpo JSON de la peticion."""
+        if not self.cuerpo:
+            return {}
+        try:
+            return json.loads(self.cuerpo)
+        except ValueError:
+            raise PeticionNoValida("El cuerpo no es JSON valido.")
+
+    def _responder(self, estado, cuerpo=None, cabeceras=None):
+        """Envia la respuesta. cuerpo ya esta codificado en JSON (bytes) o es None."""
+        self.send_response(estado)
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        if cuerpo is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo or b"")))
+        self.end_headers()
+        if cuerpo is not None:
+            self.wfile.write(cuerpo)
+
+    def _responder_ficha(self, ficha):
+        """
+        Responde con la ficha de un libro o estudiante y su ETag (un resumen del JSON, igual en todas las
+        instancias). Si la peticion trae If-None-Match con ese ETag, responde 304 sin cuerpo.
+        """
+        cuerpo = _a_json(ficha)
+        etag = '"' + hashlib.sha256(cuerpo).hexdigest()[:32] + '"'
+        cabeceras = {"ETag": etag, "Cache-Control": "no-cache"}
+        etiquetas = [e.strip() for e in self.headers.get("If-None-Match", "").split(",")]
+        if etag in etiquetas or "*" in etiquetas:
+            self._responder(HTTPStatus.NOT_MODIFIED, None, cabeceras)
+        else:
+            self._responder(HTTPStatus.OK, cuerpo, cabeceras)
+
+    def _responder_pagina(self, pagina):
+        """Responde con una Pagina."""
+        self._responder(HTTPStatus.OK, _a_json({
+            'filas': [asdict(fila) for fila in pagina.filas],
+            'siguiente': codificar_clave(pagina.siguiente),
+        }))
+
+    def _ejecutar(self, operacion, *args):
+        """Ejecuta una operacion de repositorio con una conexion del pool."""
+        with self.pool.conexion() as conn:
+            return operacion(conn, *args)
+
+    def _atender(self):
+        """Busca la ruta de la peticion y la atiende, convirtiendo los errores en respuestas JSON."""
+        url = urlsplit(self.path)
+        ruta = url.path.rstrip("/")
+        self.parametros = parse_qs(url.query)
+        try:
+            # El cuerpo se lee siempre, para que la conexion quede lista para la peticion siguiente
+            try:
+                longitud = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                longitud = -1
+            if longitud < 0:
+                # Sin longitud valida no se sabe donde acaba el cuerpo: se cierra la conexion al responder
+                self.close_connection = True
+                raise PeticionNoValida("La cabecera Content-Length no es valida.")
+            self.cuerpo = self.rfile.read(longitud)
+            encontrada = False
+            for metodo, patron, nombre in RUTAS:
+                coincidencia = re.fullmatch(patron, ruta)
+                if coincidencia is None:
+                    continue
+                encontrada = True
+                if metodo == self.command:
+                    getattr(self, nombre)(*(int(g) for g in coincidencia.groups()))
+                    return
+            if encontrada:
+                self._responder(HTTPStatus.METHOD_NOT_ALLOWED, _a_json({'error': "Metodo no permitido."}))
+            else:
+                self._responder(HTTPStatus.NOT_FOUND, _a_json({'error': "Ruta no encontrada."}))
+        except PeticionNoValida as e:
+            self._responder(HTTPStatus.BAD_REQUEST, _a_json({'error': str(e)}))
+        except repositorio.ErrorBiblioteca as e:
+            estado = ESTADOS_ERROR.get(type(e), HTTPStatus.INTERNAL_SERVER_ERROR)
+            self._responder(estado, _a_json({'error': str(e)}))
+        except psycopg2.Error:
+            self.log_error("Error de conexion con la base de datos")
+            self._responder(HTTPStatus.SERVICE_UNAVAILABLE, _a_json({'error': "Error de conexion."}))
+        except Exception:
+            # Un error no previsto no debe dejar al cliente sin respuesta
+            self.log_error("Error inesperado en %s %s", self.command, self.path)
+            traceback.print_exc()
+            self._responder(HTTPStatus.INTERNAL_SERVER_ERROR, _a_json({'error': "Error interno."}))
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _atender
+
+    # ------------------------------------------------------------
+    # Libros
+
+    def anadir_libro(self):
+        datos = _comprobar_campos(self._cuerpo(), CAMPOS_LIBRO, ('titulo',))
+        id_libro = self._ejecutar(repositorio.anadir_libro, repositorio.LibroNuevo(**datos))
+        self._responder(HTTPStatus.CREATED, _a_json({'id': id_libro}), {"Location": f"/libros/{id_libro}"})
+
+    def buscar_libros(self):
+        filtros = repositorio.FiltrosLibro(
+            modo=self._parametro("modo") or "e",
+            titulo=self._parametro("titulo"),
+            autor=self._parametro("autor"),
+            aniopublicacion=self._parametro("aniopublicacion", int),
+            isbn=self._parametro("isbn"),
+            idcategoria=self._parametro("idcategoria", int),
+        )
+        self._responder_pagina(self._ejecutar(repositorio.buscar_libros, filtros, self._limite(),
+                                              decodificar_clave(self._parametro("despues"))))
+
+    def consultar_libro(self, id_libro):
+        self._responder_ficha(self._ejecutar(repositorio.consultar_libro, id_libro))
+
+    def modificar_libro(self, id_libro):
+        cambios = _comprobar_campos(self._cuerpo(), {**CAMPOS_LIBRO, 'precio': float, 'version': int})
+        version = cambios.pop('version', None)
+        version = self._ejecutar(repositorio.modificar_libro, id_libro, cambios, version)
+        self._responder(HTTPStatus.OK, _a_json({'version': version}))
+
+    def eliminar_libro(self, id_libro):
+        self._ejecutar(repositorio.eliminar_libro, id_libro)
+        self._responder(HTTPStatus.NO_CONTENT)
+
+    def actualizar_precio(self, id_libro):
+        datos = _comprobar_campos(self._cuerpo(), {'precio': float, 'porcentaje': float})
+        precio = self._ejecutar(repositorio.actualizar_precio, id_libro, datos.get('precio'), datos.get('porcentaje'))
+        self._responder(HTTPStatus.OK, _a_json({'precio': precio}))
+
+    def revalorizar_precios(self):
+        datos = _comprobar_campos(self._cuerpo(), {**CAMPOS_REVALORIZACION, 'precio': float, 'porcentaje': float,
+                                                   'simular': bool})
+        _comprobar_enteros(datos, 'ids')
+        filtros = repositorio.FiltrosRevalorizacion(**{campo: datos.get(campo) for campo in CAMPOS_REVALORIZACION})
+        resumen = self._ejecutar(repositorio.revalorizar_precios, filtros, datos.get('precio'),
+                                 datos.get('porcentaje'), bool(datos.get('simular')))
+        self._responder(HTTPStatus.OK, _a_json(resumen))
+
+    def precio_en_fecha(self, id_libro):
+        fecha = self._parametro("fecha")
+        precio = self._ejecutar(repositorio.precio_en_fecha, id_libro, _fecha(fecha) if fecha else datetime.now())
+        self._responder(HTTPStatus.OK, _a_json(precio))
+
+    def precios_en_fecha(self):
+        datos = _comprobar_campos(self._cuerpo(), {'consultas': list}, ('consultas',))
+        consultas = [_comprobar_campos(c, {'idlibro': int, 'fecha': str}, ('idlibro', 'fecha'))
+                     for c in datos['consultas']]
+        precios = self._ejecutar(repositorio.precios_en_fecha,
+                                 [(c['idlibro'], _fecha(c['fecha'])) for c in consultas])
+        self._responder(HTTPStatus.OK, _a_json([asdict(p) for p in precios]))
+
+    def historial_precios(self, id_libro):
+        self._responder_pagina(self._ejecutar(repositorio.historial_precios, id_libro, self._limite(),
+                                              decodificar_clave(self._parametro("despues"), fecha=True)))
+
+    def historial_prestamos_libro(self, id_libro):
+        self._responder_pagina(self._ejecutar(repositorio.historial_prestamos_libro, id_libro, self._limite(),
+                                              decodificar_clave(self._parametro("despues"), fecha=True)))
+
+    # ------------------------------------------------------------
+    # Categorias
+
+    def listar_categorias(self):
+        self._responder_pagina(self._ejecutar(repositorio.listar_categorias, self._limite(),
+                                              decodificar_clave(self._parametro("despues"))))
+
+    def anadir_categoria(self):
+        datos = _comprobar_campos(self._cuerpo(), CAMPOS_CATEGORIA, ('nombre', 'descripcion'))
+        id_categoria = self._ejecutar(repositorio.anadir_categoria, datos['nombre'], datos['descripcion'],
+                                      datos.get('diasprestamo'))
+        self._responder(HTTPStatus.CREATED, _a_json({'id': id_categoria}), {"Location": f"/categorias/{id_categoria}"})
+
+    def modificar_categoria(self, id_categoria):
+        cambios = _comprobar_campos(self._cuerpo(), CAMPOS_CATEGORIA)
+        self._ejecutar(repositorio.modificar_categoria, id_categoria, cambios)
+        self._responder(HTTPStatus.NO_CONTENT)
+
+    def eliminar_categoria(self, id_categoria):
+        self._ejecutar(repositorio.eliminar_categoria, id_categoria)
+        self._responder(HTTPStatus.NO_CONTENT)
+
+    # ------------------------------------------------------------
+    # Prestamos
+
+    def efectuar_prestamo(self):
+        datos = _comprobar_campos(self._cuerpo(), {'idlibro': int, 'idestudiante': int, 'comentarios': str},
+                                  ('idlibro', 'idestudiante'))
+        id_prestamo = self._ejecutar(repositorio.efectuar_prestamo, datos['idlibro'], datos['idestudiante'],
+                                     datos.get('comentarios'))
+        self._responder(HTTPStatus.CREATED, _a_json({'id': id_prestamo}), {"Location": f"/prestamos/{id_prestamo}"})
+
+    def efectuar_prestamos(self):
+        datos = _comprobar_campos(self._cuerpo(), {'prestamos': list, 'comentarios': str}, ('prestamos',))
+        prestamos = [_comprobar_campos(p, {'idlibro': int, 'idestudiante': int}, ('idlibro', 'idestudiante'))
+                     for p in datos['prestamos']]
+        resultados = self._ejecutar(repositorio.efectuar_prestamos,
+                                    [(p['idlibro'], p['idestudiante']) for p in prestamos], datos.get('comentarios'))
+        self._responder(HTTPStatus.OK, _a_json([asdict(r) for r in resultados]))
+
+    def consultar_prestamo(self, id_prestamo):
+        self._responder(HTTPStatus.OK, _a_json(self._ejecutar(repositorio.consultar_prestamo, id_prestamo)))
+
+    def finalizar_prestamo(self, id_prestamo):
+        self._ejecutar(repositorio.finalizar_prestamo, id_prestamo)
+        self._responder(HTTPStatus.NO_CONTENT)
+
+    def finalizar_prestamos(self):
+        datos = _comprobar_campos(self._cuerpo(), {'ids': list}, ('ids',))
+        resultados = self._ejecutar(repositorio.finalizar_prestamos, _comprobar_enteros(datos, 'ids'))
+        self._responder(HTTPStatus.OK, _a_json([asdict(r) for r in resultados]))
+
+    def eliminar_prestamo(self, id_prestamo):
+        self._ejecutar(repositorio.eliminar_prestamo, id_prestamo)
+        self._responder(HTTPStatus.NO_CONTENT)
+
+    # ------------------------------------------------------------
+    # Estudiantes
+
+    def anadir_estudiante(self):
+        datos = _comprobar_campos(self._cuerpo(), CAMPOS_ESTUDIANTE, ('nombre', 'apellidos', 'curso', 'email'))
+        id_estudiante = self._ejecutar(repositorio.anadir_estudiante, repositorio.EstudianteNuevo(**datos))
+        self._responder(HTTPStatus.CREATED, _a_json({'id': id_estudiante}),
+                        {"Location": f"/estudiantes/{id_estudiante}"})
+
+    def consultar_estudiante(self, id_estudiante):
+        self._responder_ficha(self._ejecutar(repositorio.consultar_estudiante, id_estudiante))
+
+    def modificar_estudiante(self, id_estudiante):
+        cambios = _comprobar_campos(self._cuerpo(), {**CAMPOS_ESTUDIANTE, 'version': int})
+        version = cambios.pop('version', None)
+        version = self._ejecutar(repositorio.modificar_estudiante, id_estudiante, cambios, version)
+        self._responder(HTTPStatus.OK, _a_json({'version': version}))
+
+    def eliminar_estudiante(self, id_estudiante):
+        self._ejecutar(repositorio.eliminar_estudiante, id_estudiante)
+        self._responder(HTTPStatus.NO_CONTENT)
+
+    def historial_prestamos_estudiante(self, id_estudiante):
+        self._responder_pagina(self._ejecutar(repositorio.historial_prestamos_estudiante, id_estudiante,
+                                              self._limite(), decodificar_clave(self._parametro("despues"), fecha=True)))
+
+    def aumentar_curso(self):
+        datos = _comprobar_campos(self._cuerpo(), {'curso': int, 'ids': list})
+        curso, ids = datos.get('curso'), _comprobar_enteros(datos, 'ids')
+        if (curso is None) == (ids is None):
+            raise PeticionNoValida("Se debe indicar 'curso' o 'ids'.")
+        if curso is not None:
+            promocionados = self._ejecutar(repositorio.aumentar_curso_completo, curso)
+            self._responder(HTTPStatus.OK, _a_json({'actualizados': promocionados, 'no_encontrados': []}))
+            return
+        actualizados, no_encontrados = self._ejecutar(repositorio.aumentar_curso, ids)
+        self._responder(HTTPStatus.OK, _a_json({'actualizados': actualizados, 'no_encontrados': no_encontrados}))
+
+    # ------------------------------------------------------------
+    # Informes
+
+    def informe_vencidos(self):
+        vencidos = self._ejecutar(repositorio.informe_vencidos, self._parametro("curso", int))
+        self._responder(HTTPStatus.OK, _a_json([asdict(v) for v in vencidos]))
+
+
+# Metodo, ruta (los grupos son ids enteros) y metodo del manejador. Las rutas fijas van antes que las de id.
+RUTAS = [
+    ("POST", r"/libros", "anadir_libro"),
+    ("GET", r"/libros", "buscar_libros"),
+    ("POST", r"/libros/precios", "revalorizar_precios"),
+    ("POST", r"/libros/precios/fecha", "precios_en_fecha"),
+    ("GET", r"/libros/(\d+)", "consultar_libro"),
+    ("PUT", r"/libros/(\d+)", "modificar_libro"),
+    ("DELETE", r"/libros/(\d+)", "eliminar_libro"),
+    ("POST", r"/libros/(\d+)/precios", "actualizar_precio"),
+    ("GET", r"/libros/(\d+)/precios", "historial_precios"),
+    ("GET", r"/libros/(\d+)/precio", "precio_en_fecha"),
+    ("GET", r"/libros/(\d+)/prestamos", "historial_prestamos_libro"),
+    ("GET", r"/categorias", "listar_categorias"),
+    ("POST", r"/categorias", "anadir_categoria"),
+    ("PUT", r"/categorias/(\d+)", "modificar_categoria"),
+    ("DELETE", r"/categorias/(\d+)", "eliminar_categoria"),
+    ("POST", r"/prestamos", "efectuar_prestamo"),
+    ("POST", r"/prestamos/lote", "efectuar_prestamos"),
+    ("PUT", r"/prestamos/finalizar", "finalizar_prestamos"),
+    ("GET", r"/prestamos/(\d+)", "consultar_prestamo"),
+    ("PUT", r"/prestamos/(\d+)/finalizar", "finalizar_prestamo"),
+    ("DELETE", r"/prestamos/(\d+)", "eliminar_prestamo"),
+    ("POST", r"/estudiantes", "anadir_estudiante"),
+    ("PUT", r"/estudiantes/curso", "aumentar_curso"),
+    ("GET", r"/estudiantes/(\d+)", "consultar_estudiante"),
+    ("PUT", r"/estudiantes/(\d+)", "modificar_estudiante"),
+    ("DELETE", r"/estudiantes/(\d+)", "eliminar_estudiante"),
+    ("GET", r"/estudiantes/(\d+)/prestamos", "historial_prestamos_estudiante"),
+    ("GET", r"/informes/vencidos", "informe_vencidos"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP de la biblioteca.")
+    parser.add_argument("--host", default="0.0.0.0", help="Direccion en la que escuchar")
+    parser.add_argument("--puerto", type=int, default=8080, help="Puerto en el que escuchar")
+    args = parser.parse_args()
+
+    try:
+        pool = conexion.PoolBiblioteca()
+    except psycopg2.Error:
+        print("Error de conexion")
+        sys.exit(1)
+    repositorio.escuchar_invalidaciones(pool.dsn)
+
+    ManejadorBiblioteca.pool = pool
+    servidor = ThreadingHTTPServer((args.host, args.puerto), ManejadorBiblioteca)
+    print(f"Escuchando en http://{args.host}:{args.puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        pool.closeall()
+
+
+if __name__ == '__main__':
+    main()